@@ -12,6 +12,9 @@ from homeassistant.exceptions import ConfigEntryNotReady
 from homeassistant.helpers import device_registry as dr
 from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
 
+from .cache import MessageCache, RefreshCache
+from .capabilities import CAPABILITIES
+from .connection import MailConnection
 from .const import (
     ATTR_AMAZON_IMAGE,
     ATTR_IMAGE_NAME,
@@ -20,21 +23,34 @@ from .const import (
     CONF_AMAZON_DOMAIN,
     CONF_AMAZON_FWDS,
     CONF_IMAGE_SECURITY,
+    CONF_IMAP_IDLE,
     CONF_IMAP_SECURITY,
     CONF_IMAP_TIMEOUT,
     CONF_PATH,
     CONF_SCAN_INTERVAL,
+    CONF_STATUS_CHECK,
     CONF_STORAGE,
     CONF_VERIFY_SSL,
     CONFIG_VER,
     COORDINATOR,
     DEFAULT_AMAZON_DAYS,
+    DEFAULT_IMAP_IDLE,
+    DEFAULT_STATUS_CHECK,
     DOMAIN,
     ISSUE_URL,
     PLATFORMS,
     VERSION,
 )
-from .helpers import default_image_path, hash_file, process_emails
+from .helpers import (
+    async_process_emails,
+    async_process_sensors,
+    default_image_path,
+    hash_file,
+    process_emails,
+    process_sensors,
+)
+from .idle import IdleListener
+from .transcode import get_mp4_queue
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -62,11 +78,11 @@ async def async_setup_entry(hass: HomeAssistant, config_entry: ConfigEntry) -> b
     if updated_config != config_entry.data:
         hass.config_entries.async_update_entry(config_entry, data=updated_config)
 
-    # Variables for data coordinator
-    config = config_entry.data
+    # Variables for data coordinator, options override the entry data
+    config = {**config_entry.data, **config_entry.options}
 
     # Setup the data coordinator
-    coordinator = MailDataUpdateCoordinator(hass, config)
+    coordinator = MailDataUpdateCoordinator(hass, config, config_entry.entry_id)
 
     # Fetch initial data so we have data when entities subscribe
     await coordinator.async_refresh()
@@ -74,16 +90,33 @@ async def async_setup_entry(hass: HomeAssistant, config_entry: ConfigEntry) -> b
     # Raise ConfEntryNotReady if coordinator didn't update
     if not coordinator.last_update_success:
         _LOGGER.error("Error updating sensor data: %s", coordinator.last_exception)
+        await coordinator.async_close()
         raise ConfigEntryNotReady
 
     hass.data[DOMAIN][config_entry.entry_id] = {
         COORDINATOR: coordinator,
     }
 
+    # Refresh as soon as the server reports new mail, polling stays as fallback
+    if config.get(CONF_IMAP_IDLE, DEFAULT_IMAP_IDLE):
+        coordinator.start_idle()
+
     await hass.config_entries.async_forward_entry_setups(config_entry, PLATFORMS)
+    config_entry.async_on_unload(config_entry.add_update_listener(update_listener))
     return True
 
 
+async def update_listener(hass: HomeAssistant, config_entry: ConfigEntry) -> None:
+    """Reload the entry when its options change."""
+    coordinator = hass.data[DOMAIN][config_entry.entry_id][COORDINATOR]
+    # Reconfiguring updates the entry too, but reloads it on its own
+    if any(
+        coordinator.config.get(key) != value
+        for key, value in config_entry.options.items()
+    ):
+        await hass.config_entries.async_reload(config_entry.entry_id)
+
+
 async def async_remove_config_entry_device(  # pylint: disable-next=unused-argument
     hass: HomeAssistant, config_entry: ConfigEntry, device_entry: dr.DeviceEntry
 ) -> bool:
@@ -111,11 +144,17 @@ async def async_unload_entry(hass: HomeAssistant, config_entry: ConfigEntry) ->
 
     if unload_ok:
         _LOGGER.debug("Successfully removed sensors from the %s integration", DOMAIN)
-        hass.data[DOMAIN].pop(config_entry.entry_id)
+        coordinator = hass.data[DOMAIN].pop(config_entry.entry_id)[COORDINATOR]
+        await coordinator.async_close()
 
     return unload_ok
 
 
+async def async_remove_entry(hass: HomeAssistant, config_entry: ConfigEntry) -> None:
+    """Delete the message cache when an entry is removed."""
+    await MessageCache(hass, config_entry.entry_id).async_remove()
+
+
 async def async_migrate_entry(hass, config_entry):
     """Migrate an old config entry."""
     version = config_entry.version
@@ -201,13 +240,21 @@ async def async_migrate_entry(hass, config_entry):
 class MailDataUpdateCoordinator(DataUpdateCoordinator):
     """Class to manage fetching mail data."""
 
-    def __init__(self, hass, config):
+    def __init__(self, hass, config, entry_id=None):
         """Initialize."""
         self.interval = timedelta(minutes=config.get(CONF_SCAN_INTERVAL))
         self.name = f"Mail and Packages ({config.get(CONF_HOST)})"
         self.timeout = config.get(CONF_IMAP_TIMEOUT)
         self.config = config
         self.hass = hass
+        self.connection = MailConnection(config)
+        self.cache = MessageCache(hass, entry_id) if entry_id else None
+        self.refresh = (
+            RefreshCache()
+            if config.get(CONF_STATUS_CHECK, DEFAULT_STATUS_CHECK)
+            else None
+        )
+        self.idle = None
         self._data = {}
 
         _LOGGER.debug("Data will be update every %s", self.interval)
@@ -216,20 +263,105 @@ class MailDataUpdateCoordinator(DataUpdateCoordinator):
 
     async def _async_update_data(self):
         """Fetch data."""
+        await CAPABILITIES.async_load(self.hass)
+        if self.cache is not None:
+            await self.cache.async_load()
+
         async with asyncio.timeout(self.timeout):
             try:
-                data = await self.hass.async_add_executor_job(
-                    process_emails, self.hass, self.config
-                )
+                if self.connection.uses_asyncio:
+                    data = await async_process_emails(
+                        self.hass,
+                        self.config,
+                        self.connection,
+                        self.cache,
+                        self.refresh,
+                    )
+                else:
+                    data = await self.hass.async_add_executor_job(
+                        process_emails,
+                        self.hass,
+                        self.config,
+                        self.connection,
+                        self.cache,
+                        self.refresh,
+                    )
+            except asyncio.CancelledError:
+                # Free the worker thread instead of leaving it blocked on I/O
+                self.connection.abort()
+                raise
             except Exception as error:
                 _LOGGER.error("Problem updating sensors: %s", error)
                 raise UpdateFailed(error) from error
 
+            await CAPABILITIES.async_save()
+            if self.cache is not None:
+                await self.cache.async_save()
+
             if data:
                 self._data = data
                 await self._binary_sensor_update()
             return self._data
 
+    def start_idle(self) -> None:
+        """Start listening for new mail with IMAP IDLE."""
+        if self.idle is None:
+            self.idle = IdleListener(self.hass, self.config, self.async_refresh_sensors)
+            self.idle.start()
+
+    async def async_refresh_sensors(self, sensors: list | None) -> None:
+        """Refresh only the sensors new mail changes, or all of them."""
+        if sensors is None or not self._data:
+            await self.async_request_refresh()
+            return
+
+        try:
+            async with asyncio.timeout(self.timeout):
+                try:
+                    if self.connection.uses_asyncio:
+                        data = await async_process_sensors(
+                            self.hass,
+                            self.config,
+                            self.connection,
+                            sensors,
+                            self._data,
+                        )
+                    else:
+                        data = await self.hass.async_add_executor_job(
+                            process_sensors,
+                            self.hass,
+                            self.config,
+                            self.connection,
+                            sensors,
+                            self._data,
+                        )
+                except asyncio.CancelledError:
+                    self.connection.abort()
+                    raise
+        except Exception as error:
+            _LOGGER.error("Problem updating sensors: %s", error)
+            return
+
+        if data:
+            self._data = data
+            await self._binary_sensor_update()
+            self.async_set_updated_data(self._data)
+
+    async def async_close(self) -> None:
+        """Close the IMAP sessions held by this coordinator."""
+        if self.idle is not None:
+            await self.hass.async_add_executor_job(self.idle.stop)
+            self.idle = None
+        if ATTR_IMAGE_NAME in self._data:
+            # Stop generating an MP4 nobody will see
+            path = f"{self.hass.config.path()}/{self._data[ATTR_IMAGE_PATH]}"
+            mp4 = self._data[ATTR_IMAGE_NAME].replace(".gif", ".mp4")
+            await get_mp4_queue(self.hass).async_cancel(os.path.join(path, mp4))
+        if self.connection.uses_asyncio:
+            await self.connection.async_close()
+        else:
+            await self.hass.async_add_executor_job(self.connection.close)
+
     async def _binary_sensor_update(self):
         """Update binary sensor states."""
         attributes = (ATTR_IMAGE_NAME, ATTR_IMAGE_PATH)
@@ -0,0 +1,315 @@
+"""Asyncio IMAP transport for Mail and Packages."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+from typing import Any, Optional, Union
+
+from homeassistant.util import ssl
+
+from .capabilities import CAPABILITIES
+from .commands import async_run
+from .const import DEFAULT_IMAP_TIMEOUT
+
+_LOGGER = logging.getLogger(__name__)
+
+_CAPABILITY = re.compile(rb"^\[CAPABILITY ([^\]]*)\]", re.IGNORECASE)
+_LITERAL = re.compile(rb"\{(\d+)\}$")
+_UNTAGGED_NUMBERED = re.compile(rb"\* (\d+) ([A-Z-]+)(?: (.*))?$", re.IGNORECASE)
+_UNTAGGED = re.compile(rb"\* ([A-Z-]+)(?: (.*))?$", re.IGNORECASE)
+_RESPONSE_CODE = re.compile(rb"^\[([A-Z-]+)(?: ([^\]]*))?\]", re.IGNORECASE)
+
+
+class IMAPError(Exception):
+    """IMAP command failed or the connection was lost."""
+
+
+def _quote(value: str) -> str:
+    """Quote a string argument."""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+class AsyncIMAP:
+    """Minimal IMAP4rev1 client built on asyncio streams.
+
+    Commands are coroutines named and shaped like the imaplib methods, so
+    the command sequences of the helpers run on either transport.
+    """
+
+    def __init__(self, host: str, port: int, timeout: float) -> None:
+        """Initialize."""
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.capabilities = ()
+        self.literal = None
+        self.user = None
+        # Untagged responses no command asked for, kept until read
+        self.responses = {}
+        # LOGIN reported the capabilities of the authenticated session
+        self._logged_in_capabilities = False
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+        self._tags = 0
+
+    async def connect(self, security: str, verify: bool = True) -> None:
+        """Open the connection and read the server capabilities."""
+        context = None
+        if security in ("SSL", "startTLS"):
+            if not verify:
+                context = ssl.client_context_no_verify()
+            else:
+                context = ssl.client_context()
+
+        async with asyncio.timeout(self.timeout):
+            self._reader, self._writer = await asyncio.open_connection(
+                self.host,
+                self.port,
+                ssl=context if security == "SSL" else None,
+            )
+            greeting = await self._readline()
+            if not greeting.startswith(b"* OK"):
+                raise IMAPError(f"Unexpected greeting: {greeting!r}")
+
+        if security == "startTLS":
+            await self.command("STARTTLS")
+            async with asyncio.timeout(self.timeout):
+                await self._writer.start_tls(context)
+        await self.command("CAPABILITY")
+
+    def abort(self) -> None:
+        """Close the connection, failing any command in progress."""
+        if self._writer is not None:
+            self._writer.transport.abort()
+
+    async def close(self) -> None:
+        """Close the connection."""
+        if self._writer is None:
+            return
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except Exception as err:
+            _LOGGER.debug("Error closing IMAP connection: %s", str(err))
+
+    async def command(
+        self,
+        name: str,
+        *args: Any,
+        response: Optional[str] = None,
+        literal: Optional[bytes] = None,
+    ) -> tuple:
+        """Send a command and wait for its completion.
+
+        Returns (typ, data) where data is the untagged response named by
+        response, or the tagged response text
+        """
+        async with self._lock:
+            async with asyncio.timeout(self.timeout):
+                return await self._command(name, args, response, literal)
+
+    async def _command(
+        self, name: str, args: tuple, response: Optional[str], literal: Optional[bytes]
+    ) -> tuple:
+        """Send a command and collect its responses."""
+        if self._writer is None or self._writer.is_closing():
+            raise IMAPError("IMAP connection is closed")
+
+        if name in ("SELECT", "EXAMINE"):
+            # Like imaplib, responses of the previous mailbox are dropped
+            self.responses = {}
+        self._tags += 1
+        tag = f"MP{self._tags:04d}".encode()
+        # Like imaplib, None stands for an argument left out
+        line = b" ".join(
+            [tag, name.encode()]
+            + [
+                arg if isinstance(arg, bytes) else str(arg).encode()
+                for arg in args
+                if arg is not None
+            ]
+        )
+        if literal is not None:
+            line += f" {{{len(literal)}}}".encode()
+        self._writer.write(line + b"\r\n")
+        await self._writer.drain()
+
+        untagged = {}
+        while True:
+            line = await self._readline()
+            if line.startswith(b"+"):
+                if literal is None:
+                    raise IMAPError(f"Unexpected continuation: {line!r}")
+                self._writer.write(literal + b"\r\n")
+                await self._writer.drain()
+                literal = None
+            elif line.startswith(b"* "):
+                typ, data = await self._untagged(line)
+                untagged.setdefault(typ, []).extend(data)
+                if typ == "OK" and (code := _RESPONSE_CODE.match(data[-1])):
+                    # Also kept under the code name, such as UIDNEXT
+                    code_name = code.group(1).decode().upper()
+                    untagged.setdefault(code_name, []).append(code.group(2))
+            elif line.startswith(tag + b" "):
+                break
+            else:
+                _LOGGER.debug("Ignoring IMAP response: %r", line)
+
+        status, _, text = line[len(tag) + 1 :].partition(b" ")
+        status = status.decode().upper()
+        self._capabilities(text)
+        for typ, data in untagged.items():
+            if response is None or typ != response.upper():
+                self.responses.setdefault(typ, []).extend(data)
+        if status == "BAD":
+            raise IMAPError(f"{name} command error: {status} [{text!r}]")
+        if response is None or status == "NO":
+            return status, [text]
+        return status, untagged.get(response.upper(), [None])
+
+    async def _untagged(self, line: bytes) -> tuple:
+        """Parse an untagged response, reading any literals that follow."""
+        if match := _UNTAGGED_NUMBERED.match(line):
+            typ = match.group(2)
+            data = match.group(1)
+            if match.group(3):
+                data += b" " + match.group(3)
+        elif match := _UNTAGGED.match(line):
+            typ = match.group(1)
+            data = match.group(2) or b""
+        else:
+            raise IMAPError(f"Unexpected response: {line!r}")
+
+        # Literals are returned as (header, literal) tuples like imaplib
+        values = []
+        while literal := _LITERAL.search(data):
+            size = int(literal.group(1))
+            values.append((data, await self._reader.readexactly(size)))
+            data = await self._readline()
+        values.append(data)
+
+        typ = typ.decode().upper()
+        if typ == "CAPABILITY":
+            self.capabilities = tuple(data.decode().upper().split())
+        elif typ == "OK":
+            self._capabilities(data)
+        return typ, values
+
+    async def _readline(self) -> bytes:
+        """Read a response line without the line ending."""
+        line = await self._reader.readline()
+        if not line:
+            raise IMAPError("IMAP server closed the connection")
+        return line.rstrip(b"\r\n")
+
+    def _capabilities(self, text: bytes) -> None:
+        """Record capabilities advertised in a response code."""
+        if match := _CAPABILITY.match(text):
+            self.capabilities = tuple(match.group(1).decode().upper().split())
+
+    async def login(self, user: str, password: str) -> tuple:
+        """Identify the client."""
+        status, data = await self.command("LOGIN", _quote(user), _quote(password))
+        if status != "OK":
+            raise IMAPError(data[-1])
+        self.user = user
+        self._logged_in_capabilities = bool(_CAPABILITY.match(data[-1]))
+        return status, data
+
+    async def logout(self) -> tuple:
+        """Log out and close the connection."""
+        try:
+            return await self.command("LOGOUT")
+        finally:
+            await self.close()
+
+    async def capability(self) -> tuple:
+        """Read the server capabilities, without a round trip after LOGIN."""
+        if self._logged_in_capabilities:
+            return "OK", [" ".join(self.capabilities).encode()]
+        return await self.command("CAPABILITY", response="CAPABILITY")
+
+    async def noop(self) -> tuple:
+        """Keep the session alive."""
+        return await self.command("NOOP")
+
+    async def enable(self, capability: str) -> tuple:
+        """Enable a server extension."""
+        return await self.command("ENABLE", capability)
+
+    def response(self, code: str) -> tuple:
+        """Return and forget the untagged responses called code."""
+        return code, self.responses.pop(code.upper(), [None])
+
+    async def list(self, directory: str = '""', pattern: str = "*") -> tuple:
+        """List mailbox names."""
+        return await self.command("LIST", directory, pattern, response="LIST")
+
+    async def select(self, mailbox: str = "INBOX", readonly: bool = False) -> tuple:
+        """Select a mailbox."""
+        name = "EXAMINE" if readonly else "SELECT"
+        return await self.command(name, mailbox, response="EXISTS")
+
+    async def status(self, mailbox: str, names: str) -> tuple:
+        """Request mailbox status."""
+        return await self.command("STATUS", mailbox, names, response="STATUS")
+
+    async def search(self, charset: Optional[str], *criteria: str) -> tuple:
+        """Search the selected mailbox."""
+        args = ("CHARSET", charset) if charset else ()
+        literal, self.literal = self.literal, None
+        return await self.command(
+            "SEARCH", *args, *criteria, response="SEARCH", literal=literal
+        )
+
+    async def fetch(self, message_set: str, message_parts: str) -> tuple:
+        """Fetch parts of messages."""
+        return await self.command("FETCH", message_set, message_parts, response="FETCH")
+
+    async def uid(self, command: str, *args: str) -> tuple:
+        """Run a command with UIDs instead of sequence numbers."""
+        command = command.upper()
+        return await self.command("UID", command, *args, response=command)
+
+
+async def async_login(
+    host: str,
+    port: int,
+    user: str,
+    pwd: str,
+    security: str,
+    verify: bool = True,
+    timeout: float = DEFAULT_IMAP_TIMEOUT,
+) -> Union[bool, AsyncIMAP]:
+    """Login to IMAP server using the asyncio transport.
+
+    Returns client object or False
+    """
+    client = AsyncIMAP(host, int(port), timeout)
+    try:
+        await client.connect(security, verify)
+    except Exception as err:
+        _LOGGER.error("Network error while connecting to server: %s", str(err))
+        await client.close()
+        return False
+
+    try:
+        await client.login(user, pwd)
+    except Exception as err:
+        _LOGGER.error("Error logging into IMAP Server: %s", str(err))
+        await client.close()
+        return False
+
+    await async_run(client, CAPABILITIES.probe_steps(client))
+    return client
+
+
+async def async_logout(client: AsyncIMAP) -> None:
+    """Logout of the IMAP server, ignoring errors."""
+    try:
+        await client.logout()
+    except Exception as err:
+        _LOGGER.debug("Error logging out of IMAP Server: %s", str(err))
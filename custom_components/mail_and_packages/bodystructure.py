@@ -0,0 +1,214 @@
+"""BODYSTRUCTURE parsing and partial fetch planning for Mail and Packages."""
+
+from __future__ import annotations
+
+import re
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+_OPEN = object()
+_CLOSE = object()
+_TOKEN = re.compile(
+    rb"\s*(?:(\()|(\))"  # list
+    rb'|"((?:[^"\\]|\\.)*)"'  # quoted string
+    rb'|([^\s()"\[\]]+(?:\[[^\]]*\](?:<[\d.]+>)?)?))'  # atom such as BODY[1]<0>
+)
+_LITERAL = re.compile(rb"\{(\d+)\}$")
+_SECTION = re.compile(rb"BODY\[([^\]]*)\](?:<\d+>)? \{\d+\}$")
+
+
+@dataclass
+class BodyPart:
+    """A single leaf part of a message as described by BODYSTRUCTURE."""
+
+    section: str
+    content_type: str
+    params: dict = field(default_factory=dict)
+    encoding: str = "7BIT"
+    size: int = 0
+    filename: Optional[str] = None
+
+
+def _tokens(data: bytes) -> list:
+    """Split an IMAP response into tokens."""
+    tokens = []
+    position = 0
+    data = data.rstrip()
+    while position < len(data):
+        match = _TOKEN.match(data, position)
+        if match is None or match.end() == position:
+            raise ValueError(f"Unexpected IMAP response at {position}")
+        position = match.end()
+        if match.group(1):
+            tokens.append(_OPEN)
+        elif match.group(2):
+            tokens.append(_CLOSE)
+        elif match.group(3) is not None:
+            value = re.sub(rb"\\(.)", rb"\1", match.group(3))
+            tokens.append(value.decode("utf-8", "replace"))
+        elif match.group(4) == b"NIL":
+            tokens.append(None)
+        elif match.group(4):
+            tokens.append(match.group(4).decode())
+    return tokens
+
+
+def parse_fetch_response(data: list) -> dict:
+    """Parse FETCH response data.
+
+    Returns dict of message number to dict of fetched items
+    """
+    tokens = []
+    for item in data:
+        if isinstance(item, tuple):
+            head = item[0]
+            if (literal := _LITERAL.search(head)) is None:
+                raise ValueError("Missing literal length")
+            tokens.extend(_tokens(head[: literal.start()]))
+            tokens.append(item[1].decode("utf-8", "replace"))
+        elif isinstance(item, bytes):
+            tokens.extend(_tokens(item))
+
+    stack = [[]]
+    for token in tokens:
+        if token is _OPEN:
+            stack.append([])
+        elif token is _CLOSE:
+            if len(stack) == 1:
+                raise ValueError("Unbalanced IMAP response")
+            inner = stack.pop()
+            stack[-1].append(inner)
+        else:
+            stack[-1].append(token)
+    if len(stack) != 1 or len(stack[0]) % 2:
+        raise ValueError("Unbalanced IMAP response")
+
+    messages = {}
+    top = stack[0]
+    for index in range(0, len(top), 2):
+        items = top[index + 1]
+        if not isinstance(items, list) or len(items) % 2:
+            raise ValueError("Malformed FETCH response")
+        messages[int(top[index])] = {
+            str(items[i]).upper(): items[i + 1] for i in range(0, len(items), 2)
+        }
+    return messages
+
+
+def _params(values: Any) -> dict:
+    """Convert a parameter list into a dict with lower case keys."""
+    if not isinstance(values, list):
+        return {}
+    return {
+        str(values[i]).lower(): values[i + 1]
+        for i in range(0, len(values) - 1, 2)
+        if values[i + 1] is not None
+    }
+
+
+def _leaf(body: list, section: str) -> BodyPart:
+    """Describe a single part."""
+    maintype = str(body[0]).lower()
+    content_type = f"{maintype}/{str(body[1]).lower()}"
+    params = _params(body[2])
+
+    # Extension data moves depending on the type specific fields
+    if maintype == "text":
+        disposition = 9
+    elif content_type == "message/rfc822":
+        disposition = 11
+    else:
+        disposition = 8
+    filename = params.get("name")
+    if len(body) > disposition and isinstance(body[disposition], list):
+        if len(body[disposition]) > 1:
+            filename = _params(body[disposition][1]).get("filename", filename)
+
+    return BodyPart(
+        section=section,
+        content_type=content_type,
+        params=params,
+        encoding=str(body[5] or "7BIT").upper(),
+        size=int(body[6] or 0),
+        filename=filename,
+    )
+
+
+def _children(body: list, prefix: str) -> list:
+    """Return the leaf parts of a multipart body, numbered from prefix."""
+    parts = []
+    for index, child in enumerate(body, start=1):
+        # Subtype and extension data follow the last child
+        if not isinstance(child, list):
+            break
+        parts.extend(_part(child, f"{prefix}{index}"))
+    return parts
+
+
+def _part(body: list, section: str) -> list:
+    """Return the leaf parts of a body part."""
+    if isinstance(body[0], list):
+        return _children(body, f"{section}.")
+    part = _leaf(body, section)
+    if part.content_type == "message/rfc822" and len(body) > 8:
+        # Sections of an attached message are numbered below the attachment
+        if isinstance(body[8][0], list):
+            return _children(body[8], f"{section}.")
+        return _part(body[8], f"{section}.1")
+    return [part]
+
+
+def body_parts(structure: list) -> list:
+    """Return the leaf parts of a BODYSTRUCTURE with their section numbers."""
+    if isinstance(structure[0], list):
+        return _children(structure, "")
+    return _part(structure, "1")
+
+
+def plan_sections(parts: list, content_types: list) -> list:
+    """Return the parts that need to be downloaded."""
+    return [part for part in parts if part.content_type in content_types]
+
+
+def response_section(header: bytes) -> Optional[str]:
+    """Return the section a FETCH response literal belongs to."""
+    if (match := _SECTION.search(header)) is None:
+        return None
+    return match.group(1).decode()
+
+
+def _quote(value: Any) -> str:
+    """Quote a MIME parameter value."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def build_message(headers: bytes, parts: list) -> bytes:
+    """Rebuild a multipart message from fetched parts.
+
+    Returns message as bytes
+    """
+    boundary = f"=_{uuid.uuid4().hex}".encode()
+    lines = [
+        headers.rstrip(b"\r\n"),
+        b"MIME-Version: 1.0",
+        b'Content-Type: multipart/mixed; boundary="' + boundary + b'"',
+        b"",
+    ]
+    for part, payload in parts:
+        content_type = part.content_type + "".join(
+            f'; {key}="{_quote(value)}"' for key, value in part.params.items()
+        )
+        lines.extend(
+            [
+                b"--" + boundary,
+                f"Content-Type: {content_type}".encode(),
+                f"Content-Transfer-Encoding: {part.encoding}".encode(),
+            ]
+        )
+        if part.filename:
+            disposition = f'attachment; filename="{_quote(part.filename)}"'
+            lines.append(f"Content-Disposition: {disposition}".encode())
+        lines.extend([b"", payload.rstrip(b"\r\n")])
+    lines.extend([b"--" + boundary + b"--", b""])
+    return b"\r\n".join(lines)
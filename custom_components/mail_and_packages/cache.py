@@ -0,0 +1,361 @@
+"""Caches of message facts and mail images for Mail and Packages."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+
+from .const import DEFAULT_IMAGE_CACHE_FRAMES, DOMAIN
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_VERSION = 1
+
+ATTR_UIDVALIDITY = "uidvalidity"
+ATTR_UIDNEXT = "uidnext"
+ATTR_FINGERPRINT = "fingerprint"
+ATTR_MESSAGES = "messages"
+ATTR_SEARCH = "search"
+ATTR_KEY = "key"
+ATTR_STAT = "stat"
+
+# Records what each generated image was built from, next to the images
+MANIFEST_FILE = "manifest.json"
+
+
+class MessageCache:
+    """Message facts keyed by UID, valid for a single UIDVALIDITY.
+
+    A message with a given (UIDVALIDITY, UID) never changes, so its facts
+    only need to be extracted once. The cache is read and written from the
+    event loop and mutated only inside the coordinator's executor job.
+    """
+
+    def __init__(self, hass: HomeAssistant, entry_id: str) -> None:
+        """Initialize."""
+        self._store = Store(hass, STORAGE_VERSION, f"{DOMAIN}.{entry_id}.messages")
+        self.uidvalidity = None
+        self.uidnext = None
+        self._fingerprint = None
+        self._messages = {}
+        self._search = None
+        self._loaded = False
+        self._dirty = False
+
+    def __contains__(self, uid: str) -> bool:
+        """Return True if the facts for uid are cached."""
+        return uid in self._messages
+
+    def __len__(self) -> int:
+        """Return the number of cached messages."""
+        return len(self._messages)
+
+    def get(self, uid: str) -> Optional[dict]:
+        """Return a copy of the cached facts for uid."""
+        if uid not in self._messages:
+            return None
+        return dict(self._messages[uid])
+
+    def add(self, uid: str, facts: dict) -> None:
+        """Store the facts for uid."""
+        self._messages[uid] = facts
+        self._dirty = True
+
+    def validate(self, uidvalidity: int, fingerprint: str) -> None:
+        """Drop every entry if the mailbox or the classifier changed."""
+        if uidvalidity == self.uidvalidity and fingerprint == self._fingerprint:
+            return
+        if self._messages:
+            _LOGGER.debug(
+                "Message cache invalidated (UIDVALIDITY %s -> %s)",
+                self.uidvalidity,
+                uidvalidity,
+            )
+        self.uidvalidity = uidvalidity
+        self.uidnext = None
+        self._fingerprint = fingerprint
+        self._messages = {}
+        self._search = None
+        self._dirty = True
+
+    def advance(self, uidnext: int) -> None:
+        """Record the next UID the server will assign."""
+        if uidnext != self.uidnext:
+            self.uidnext = uidnext
+            self._dirty = True
+
+    def search(self, key: str) -> Optional[dict]:
+        """Return the last search result recorded for key.
+
+        The result holds the matching uids, the uids from today and the
+        mailbox state (uidnext, messages, modseq and changes) it was read at.
+        """
+        if self._search is None or self._search.get("key") != key:
+            return None
+        return self._search
+
+    def record_search(self, key: str, uids: list, today: list, status: dict) -> None:
+        """Remember the result of the search key at the mailbox status."""
+        search = {
+            "key": key,
+            "uids": uids,
+            "today": today,
+            "uidnext": status.get("UIDNEXT"),
+            "messages": status.get("MESSAGES"),
+            "modseq": status.get("HIGHESTMODSEQ"),
+            "changes": status.get("CHANGES"),
+        }
+        if search != self._search:
+            self._search = search
+            self._dirty = True
+
+    def prune(self, uids: list) -> None:
+        """Forget messages that are no longer in the search window."""
+        stale = set(self._messages) - set(uids)
+        for uid in stale:
+            del self._messages[uid]
+        if stale:
+            _LOGGER.debug("Pruned %s messages from the cache", len(stale))
+            self._dirty = True
+
+    async def async_load(self) -> None:
+        """Load the cache from disk once."""
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            stored = await self._store.async_load()
+        except Exception as err:
+            _LOGGER.warning("Unable to load message cache: %s", str(err))
+            return
+        if not stored:
+            return
+        self.uidvalidity = stored.get(ATTR_UIDVALIDITY)
+        self.uidnext = stored.get(ATTR_UIDNEXT)
+        self._fingerprint = stored.get(ATTR_FINGERPRINT)
+        self._messages = stored.get(ATTR_MESSAGES) or {}
+        self._search = stored.get(ATTR_SEARCH)
+        _LOGGER.debug("Loaded %s cached messages", len(self._messages))
+
+    async def async_save(self) -> None:
+        """Write the cache to disk if it changed."""
+        if not self._dirty:
+            return
+        self._dirty = False
+        await self._store.async_save(
+            {
+                ATTR_UIDVALIDITY: self.uidvalidity,
+                ATTR_UIDNEXT: self.uidnext,
+                ATTR_FINGERPRINT: self._fingerprint,
+                ATTR_MESSAGES: self._messages,
+                ATTR_SEARCH: self._search,
+            }
+        )
+
+    async def async_remove(self) -> None:
+        """Delete the cache from disk."""
+        self._messages = {}
+        self._search = None
+        self._dirty = False
+        await self._store.async_remove()
+
+
+class RefreshCache:
+    """The last sensor data and the mailbox state it was read at.
+
+    Sensor data only changes when mail arrives or is removed, or when the
+    day rolls over and the searches move on. While the mailbox state and
+    the day stay the same a refresh can return the previous data without
+    searching. Kept in memory only, the first refresh after a restart
+    always searches.
+    """
+
+    def __init__(self) -> None:
+        """Initialize."""
+        self.status = None
+        self.day = None
+        self._data = None
+
+    def get(self, status: dict, day: str) -> Optional[dict]:
+        """Return a copy of the previous data if nothing has changed."""
+        if self._data is None or status != self.status or day != self.day:
+            return None
+        return dict(self._data)
+
+    def record(self, status: dict, day: str, data: dict) -> None:
+        """Remember the data read at status on day."""
+        self.status = status
+        self.day = day
+        self._data = dict(data)
+
+    def clear(self) -> None:
+        """Forget the previous refresh."""
+        self.status = None
+        self.day = None
+        self._data = None
+
+
+class ImageCache:
+    """Resized mail images and generated files, keyed by content.
+
+    Frames are keyed by the SHA-256 of the source image and the target
+    size, so a mail piece is only resized once however often the digest
+    is polled. Generated files remember the frames they were built from
+    and only need writing again when those change. Shared by every entry
+    and safe to use from several executor threads.
+
+    What each file was built from is also kept in a manifest next to it,
+    so an unchanged file is still recognised after a restart. A file
+    replaced by anything else, such as the placeholder image, no longer
+    counts as unchanged.
+    """
+
+    def __init__(self, max_frames: int = DEFAULT_IMAGE_CACHE_FRAMES) -> None:
+        """Initialize."""
+        self._frames = OrderedDict()
+        self._outputs = {}
+        self._max_frames = max_frames
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of cached frames."""
+        return len(self._frames)
+
+    @staticmethod
+    def digest(image: Any) -> str:
+        """Return the content hash of an in memory image.
+
+        Paths name images bundled with the integration, which never
+        change, so the path itself is hashed.
+        """
+        if isinstance(image, str):
+            return hashlib.sha256(image.encode()).hexdigest()
+        return hashlib.sha256(image.getbuffer()).hexdigest()
+
+    def frames(
+        self, images: dict, width: int, height: int, resize: Callable[[dict], dict]
+    ) -> dict:
+        """Return the resized frames of images, resizing only new ones.
+
+        resize takes a dict of name to image and returns a dict of name to
+        frame for the images it could read.
+        Returns dict of name to (digest, frame) in the order of images
+        """
+        digests = {name: self.digest(image) for name, image in images.items()}
+        found = {}
+        with self._lock:
+            for name, digest in digests.items():
+                key = (digest, width, height)
+                if key in self._frames:
+                    self._frames.move_to_end(key)
+                    found[name] = self._frames[key]
+
+        missing = {name: image for name, image in images.items() if name not in found}
+        _LOGGER.debug("Reusing %s cached frames, resizing %s", len(found), len(missing))
+        resized = resize(missing) if missing else {}
+
+        with self._lock:
+            for name, frame in resized.items():
+                self._frames[(digests[name], width, height)] = frame
+            while len(self._frames) > self._max_frames:
+                self._frames.popitem(last=False)
+
+        return {
+            name: (digests[name], found.get(name, resized.get(name)))
+            for name in images
+            if name in found or name in resized
+        }
+
+    def unchanged(self, path: str, key: Any) -> bool:
+        """Return True if path was built from key and not replaced since."""
+        with self._lock:
+            entry = self._entry(path)
+            return entry is not None and entry[ATTR_KEY] == key
+
+    def owns(self, path: str) -> bool:
+        """Return True if path is still the file recorded for it."""
+        with self._lock:
+            return self._entry(path) is not None
+
+    def record(self, path: str, key: Any) -> None:
+        """Remember that path was built from key.
+
+        key must be JSON serializable. Call once the file is written, its
+        size and modification time tell a later replacement apart. Files
+        that no longer exist are dropped from the manifest.
+        """
+        with self._lock:
+            entry = {ATTR_KEY: key, ATTR_STAT: _stat(path)}
+            self._outputs[path] = entry
+            directory = os.path.dirname(path)
+            manifest = {
+                name: recorded
+                for name, recorded in _read_manifest(directory).items()
+                if os.path.exists(os.path.join(directory, name))
+            }
+            manifest[os.path.basename(path)] = entry
+            _write_manifest(directory, manifest)
+            for output in [
+                output
+                for output in self._outputs
+                if os.path.dirname(output) == directory
+                and os.path.basename(output) not in manifest
+            ]:
+                del self._outputs[output]
+
+    def _entry(self, path: str) -> Optional[dict]:
+        """Return the record of path if the file is the one recorded."""
+        if (stat := _stat(path)) is None:
+            return None
+        if path not in self._outputs:
+            manifest = _read_manifest(os.path.dirname(path))
+            self._outputs[path] = manifest.get(os.path.basename(path))
+        entry = self._outputs[path]
+        if not isinstance(entry, dict) or entry.get(ATTR_STAT) != stat:
+            return None
+        return entry
+
+
+def _stat(path: str) -> Optional[list]:
+    """Return the size and modification time of path, None if missing."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _read_manifest(directory: str) -> dict:
+    """Return the image manifest of directory."""
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE), encoding="utf-8") as fd:
+            manifest = json.load(fd)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as err:
+        _LOGGER.warning("Unable to read image manifest: %s", str(err))
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+
+def _write_manifest(directory: str, manifest: dict) -> None:
+    """Replace the image manifest of directory."""
+    path = os.path.join(directory, MANIFEST_FILE)
+    try:
+        with open(f"{path}.tmp", "w", encoding="utf-8") as fd:
+            json.dump(manifest, fd)
+        os.replace(f"{path}.tmp", path)
+    except OSError as err:
+        _LOGGER.warning("Unable to write image manifest: %s", str(err))
+
+
+# Shared by every entry, frames are addressed by content
+IMAGE_CACHE = ImageCache()
@@ -2,8 +2,14 @@
 
 from __future__ import annotations
 
+import hashlib
 import logging
 import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Optional
 
 import voluptuous as vol
 from homeassistant.components.camera import Camera
@@ -17,6 +23,7 @@ from .const import (
     ATTR_IMAGE_PATH,
     CAMERA,
     CAMERA_DATA,
+    CAMERA_RENDITIONS,
     CONF_CUSTOM_IMG,
     CONF_CUSTOM_IMG_FILE,
     COORDINATOR,
@@ -24,11 +31,35 @@ from .const import (
     SENSOR_NAME,
     VERSION,
 )
+from .helpers import scale_image
 
 SERVICE_UPDATE_IMAGE = "update_image"
 _LOGGER = logging.getLogger(__name__)
 
 
+@dataclass(frozen=True)
+class CachedImage:
+    """An image file held in memory and the file state it was read at."""
+
+    path: str
+    mtime: int
+    size: int
+    content: bytes
+
+    @cached_property
+    def digest(self) -> str:
+        """Return the content hash, computed on first use."""
+        return hashlib.sha256(self.content).hexdigest()
+
+    def matches(self, path: str, stat: os.stat_result) -> bool:
+        """Return True if the file has not changed since it was read."""
+        return (path, stat.st_mtime_ns, stat.st_size) == (
+            self.path,
+            self.mtime,
+            self.size,
+        )
+
+
 async def async_setup_entry(hass, config, async_add_entities):
     """Set up the Camera that works with local files."""
     if CAMERA not in hass.data[DOMAIN][config.entry_id]:
@@ -99,6 +130,9 @@ class MailCam(Camera):
         self._type = name
         self.check_file_path_access(file_path)
         self._file_path = file_path
+        self._image: Optional[CachedImage] = None
+        self._renditions = OrderedDict()
+        self._lock = threading.Lock()
         self._coordinator = coordinator
         self._host = config.data.get(CONF_HOST)
         self._unique_id = config.entry_id
@@ -113,8 +147,9 @@ class MailCam(Camera):
     ) -> bytes | None:
         """Return image response."""
         try:
-            file = await self.hass.async_add_executor_job(open, self._file_path, "rb")
-            return file.read()
+            return await self.hass.async_add_executor_job(
+                self._camera_image, self._file_path, width, height
+            )
         except FileNotFoundError:
             _LOGGER.info(
                 "Could not read camera %s image from file: %s",
@@ -122,6 +157,55 @@ class MailCam(Camera):
                 self._file_path,
             )
 
+    def _camera_image(
+        self, file_path: str, width: int | None, height: int | None
+    ) -> bytes:
+        """Return the image, scaled down to width x height if requested."""
+        image = self._read_image(file_path)
+        if width is None and height is None:
+            return image.content
+
+        key = (image.digest, width, height)
+        with self._lock:
+            if key in self._renditions:
+                self._renditions.move_to_end(key)
+                return self._renditions[key]
+
+        try:
+            content = scale_image(image.content, width, height)
+        except Exception as err:
+            _LOGGER.error("Error scaling camera %s image: %s", self._name, err)
+            return image.content
+
+        with self._lock:
+            self._renditions[key] = content
+            while len(self._renditions) > CAMERA_RENDITIONS:
+                self._renditions.popitem(last=False)
+        return content
+
+    def _read_image(self, file_path: str) -> CachedImage:
+        """Return the image, reading the file only when it has changed."""
+        stat = os.stat(file_path)
+        image = self._image
+        if image is not None and image.matches(file_path, stat):
+            return image
+
+        with open(file_path, "rb") as file:
+            content = file.read()
+        image = CachedImage(file_path, stat.st_mtime_ns, stat.st_size, content)
+        with self._lock:
+            # Renditions of the previous file are never asked for again
+            self._renditions.clear()
+            self._image = image
+        return image
+
+    def _preload_image(self, file_path: str) -> None:
+        """Read a new image ahead of the first request for it."""
+        try:
+            self._read_image(file_path)
+        except OSError as err:
+            _LOGGER.debug("Unable to preload camera %s image: %s", self._name, err)
+
     def check_file_path_access(self, file_path: str) -> None:
         """Check that filepath given is readable."""
         if not os.access(file_path, os.R_OK):
@@ -165,6 +249,9 @@ class MailCam(Camera):
                 file_path = f"{self.hass.config.path()}/{path}{image}"
 
         self.check_file_path_access(file_path)
+        if file_path != self._file_path:
+            self._image = None
+            self.hass.add_job(self._preload_image, file_path)
         self._file_path = file_path
         self.schedule_update_ha_state()
 
@@ -0,0 +1,247 @@
+"""IMAP server capabilities and learned quirks for Mail and Packages."""
+
+from __future__ import annotations
+
+import imaplib
+import logging
+import threading
+from typing import Any, Generator, Optional
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+
+from .commands import command, run
+from .const import DOMAIN
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_VERSION = 1
+
+ATTR_CAPABILITIES = "capabilities"
+ATTR_ENABLED = "enabled"
+ATTR_HOST = "host"
+ATTR_QUIRKS = "quirks"
+
+# The server returns message data for RFC822 and BODY.PEEK[...] fetches
+QUIRK_PARTIAL_FETCH = "partial_fetch"
+# SEARCH CHARSET UTF-8 works
+QUIRK_UTF8_SEARCH = "utf8_search"
+
+# Failures in a row before a quirk is kept, one odd answer is not enough
+QUIRK_FAILURES = 3
+
+# Quirks of well known servers, so they never cost a failed round trip
+KNOWN_QUIRKS = {
+    # iCloud only returns messages when fetching BODY[]
+    "imap.mail.me.com": {QUIRK_PARTIAL_FETCH: False},
+}
+
+
+def _session_capabilities(account: Any) -> tuple:
+    """Return the capabilities a session has seen, upper cased."""
+    capabilities = getattr(account, "capabilities", ())
+    if not isinstance(capabilities, (tuple, list)):
+        return ()
+    return tuple(str(name).upper() for name in capabilities)
+
+
+def server_key(account: Any) -> str:
+    """Return the key of the account's server, its user, host and port.
+
+    Servers behind one host name can differ by port, and what ENABLE
+    accepts can differ by user.
+    """
+    host = str(getattr(account, "host", ""))
+    port = getattr(account, "port", None)
+    user = getattr(account, "user", None)
+    return "{}@{}:{}".format(
+        user if isinstance(user, str) else "",
+        host,
+        port if isinstance(port, int) else "",
+    )
+
+
+def refused(err: Exception) -> bool:
+    """Return True if err is the server refusing a command.
+
+    Lost connections say nothing about the server and are not learned.
+    """
+    return isinstance(err, imaplib.IMAP4.error) and not isinstance(
+        err, imaplib.IMAP4.abort
+    )
+
+
+class ServerInfo:
+    """What one IMAP server supports.
+
+    Holds the CAPABILITY list read after the last login, which extensions
+    ENABLE accepted and quirks learned from the server's answers.
+    """
+
+    def __init__(
+        self, host: str, capabilities: tuple = (), stored: Optional[dict] = None
+    ) -> None:
+        """Initialize."""
+        stored = stored or {}
+        self.host = host
+        self.capabilities = tuple(stored.get(ATTR_CAPABILITIES, capabilities))
+        self.enabled = dict(stored.get(ATTR_ENABLED, {}))
+        self.quirks = {**KNOWN_QUIRKS.get(host, {}), **stored.get(ATTR_QUIRKS, {})}
+        # Failures in a row by quirk, not kept between restarts
+        self.failures = {}
+
+    def supports(self, name: str) -> bool:
+        """Return True if the server advertised the capability name."""
+        return name.upper() in self.capabilities
+
+    @property
+    def partial_fetch(self) -> bool:
+        """Return True unless the server is known to need BODY[]."""
+        return self.quirks.get(QUIRK_PARTIAL_FETCH) is not False
+
+    @property
+    def utf8_search(self) -> Optional[bool]:
+        """Return whether UTF-8 searches work, or None if not known yet."""
+        if QUIRK_UTF8_SEARCH in self.quirks:
+            return self.quirks[QUIRK_UTF8_SEARCH]
+        return True if self.supports("UTF8=ACCEPT") else None
+
+    def as_dict(self) -> dict:
+        """Return what is kept between restarts."""
+        return {
+            ATTR_HOST: self.host,
+            ATTR_CAPABILITIES: list(self.capabilities),
+            ATTR_ENABLED: self.enabled,
+            ATTR_QUIRKS: self.quirks,
+        }
+
+
+class CapabilityCache:
+    """Server capabilities and quirks by user, host and port.
+
+    Shared by every entry. Everything learned is kept on disk, so no
+    restart repeats a failed round trip. Safe to use from several
+    executor threads.
+    """
+
+    def __init__(self) -> None:
+        """Initialize."""
+        self._servers = {}
+        self._lock = threading.Lock()
+        self._hass = None
+        self._store = None
+        self._dirty = False
+
+    def server(self, account: Any) -> ServerInfo:
+        """Return what the server of account supports.
+
+        A server not probed yet starts with what the session has seen.
+        """
+        key = server_key(account)
+        with self._lock:
+            if (info := self._servers.get(key)) is None:
+                info = self._servers[key] = ServerInfo(
+                    str(getattr(account, "host", "")),
+                    _session_capabilities(account),
+                )
+                self._dirty = True
+        return info
+
+    def probe(self, account: Any) -> ServerInfo:
+        """Read the capabilities of a freshly logged in session.
+
+        Servers often list more once authenticated, and what they list
+        can change between logins, so the previous list is replaced.
+        Sessions are kept between refreshes, so this costs one command
+        per login.
+        """
+        return run(account, self.probe_steps(account))
+
+    def probe_steps(self, account: Any) -> Generator:
+        """Return the command sequence of probe."""
+        capabilities = ()
+        try:
+            (server_response, data) = yield command("capability")
+        except Exception as err:
+            _LOGGER.debug("Error reading capabilities: %s", str(err))
+        else:
+            if server_response == "OK" and data and isinstance(data[-1], bytes):
+                capabilities = tuple(data[-1].decode().upper().split())
+        # Capabilities the session was told itself, such as in the greeting
+        capabilities += tuple(
+            name for name in _session_capabilities(account) if name not in capabilities
+        )
+
+        info = self.server(account)
+        with self._lock:
+            if capabilities != info.capabilities:
+                info.capabilities = capabilities
+                self._dirty = True
+        _LOGGER.debug(
+            "Capabilities of %s: %s", server_key(account), " ".join(capabilities)
+        )
+        return info
+
+    def record_enabled(self, account: Any, name: str, enabled: bool) -> None:
+        """Remember whether ENABLE accepted the extension name."""
+        info = self.server(account)
+        with self._lock:
+            if info.enabled.get(name) != enabled:
+                info.enabled[name] = enabled
+                self._dirty = True
+
+    def learn(self, account: Any, quirk: str, value: bool) -> None:
+        """Remember a quirk of the server of account.
+
+        A missing feature (value False) is only kept once it failed
+        QUIRK_FAILURES times in a row, a success starts the count again.
+        """
+        info = self.server(account)
+        with self._lock:
+            if value is False and info.quirks.get(quirk) is not False:
+                failures = info.failures[quirk] = info.failures.get(quirk, 0) + 1
+                if failures < QUIRK_FAILURES:
+                    _LOGGER.debug(
+                        "%s failed for %s (%s of %s)",
+                        quirk,
+                        info.host,
+                        failures,
+                        QUIRK_FAILURES,
+                    )
+                    return
+            info.failures.pop(quirk, None)
+            if info.quirks.get(quirk) == value:
+                return
+            info.quirks[quirk] = value
+            self._dirty = True
+        _LOGGER.debug("Learned %s=%s for %s", quirk, value, info.host)
+
+    async def async_load(self, hass: HomeAssistant) -> None:
+        """Load the cache from disk once per Home Assistant instance."""
+        if self._hass is hass:
+            return
+        self._hass = hass
+        self._store = Store(hass, STORAGE_VERSION, f"{DOMAIN}.capabilities")
+        try:
+            stored = await self._store.async_load()
+        except Exception as err:
+            _LOGGER.warning("Unable to load server capabilities: %s", str(err))
+            return
+        with self._lock:
+            for key, server in (stored or {}).items():
+                if key not in self._servers:
+                    self._servers[key] = ServerInfo(
+                        server.get(ATTR_HOST, ""), stored=server
+                    )
+
+    async def async_save(self) -> None:
+        """Write the cache to disk if it changed."""
+        if self._store is None or not self._dirty:
+            return
+        with self._lock:
+            self._dirty = False
+            data = {key: info.as_dict() for key, info in self._servers.items()}
+        await self._store.async_save(data)
+
+
+CAPABILITIES = CapabilityCache()
@@ -0,0 +1,862 @@
+"""Single pass email classifier for Mail and Packages."""
+
+from __future__ import annotations
+
+import datetime
+import hashlib
+import imaplib
+import logging
+import quopri
+import re
+from email.header import decode_header, make_header
+from typing import TYPE_CHECKING, Any, Generator, Iterable, Optional, Type
+
+import dateparser
+import homeassistant.helpers.config_validation as cv
+from homeassistant.const import CONF_HOST, CONF_USERNAME
+
+# helpers imports this module in turn, so only the module is bound here
+from . import helpers
+from .capabilities import CAPABILITIES
+from .commands import command, sequence
+from .const import (
+    AMAZON_DELIVERED,
+    AMAZON_EXCEPTION,
+    AMAZON_EXCEPTION_ORDER,
+    AMAZON_EXCEPTION_SUBJECT,
+    AMAZON_HUB,
+    AMAZON_HUB_CODE,
+    AMAZON_HUB_EMAIL,
+    AMAZON_HUB_SUBJECT,
+    AMAZON_ORDER,
+    AMAZON_OTP,
+    AMAZON_OTP_SUBJECT,
+    AMAZON_PACKAGES,
+    AMAZON_TIME_PATTERN,
+    ATTR_BODY,
+    ATTR_CODE,
+    ATTR_EMAIL,
+    ATTR_SUBJECT,
+    ATTR_USPS_MAIL,
+    CONF_AMAZON_DAYS,
+    CONF_AMAZON_DOMAIN,
+    CONF_AMAZON_FWDS,
+    CONF_FOLDER,
+    DEFAULT_AMAZON_DAYS,
+    DEFAULT_SEARCH_CHUNK_SIZE,
+    HEADER_PARTS,
+    SENSOR_DATA,
+    TEXT_TYPES,
+    VERSION,
+)
+from .matchers import (
+    AMAZON_HUB_BODY_RE,
+    AMAZON_HUB_SUBJECT_RE,
+    AMAZON_ORDER_RE,
+    AMAZON_OTP_RE,
+    MATCHERS,
+    scan_tracking,
+)
+from .mime import LazyMessage
+
+if TYPE_CHECKING:
+    from .cache import MessageCache
+
+_LOGGER = logging.getLogger(__name__)
+
+# Message fact keys
+FACT_FROM = "from"
+FACT_SUBJECT = "subject"
+FACT_TODAY = "today"
+FACT_BODY = "body"
+FACT_TRACKING = "tracking"
+FACT_ORDERS = "orders"
+FACT_ETA = "eta"
+FACT_HUB_CODE = "hub_code"
+FACT_OTP = "otp"
+
+# Amazon exception orders are extracted like carrier tracking numbers
+AMAZON_TRACKING = "amazon"
+
+# Sensors left to the per sensor fetch() path
+UNCLASSIFIED = [ATTR_USPS_MAIL, "amazon_delivered", "mail_updated"]
+CLASSIFIED_AMAZON = [AMAZON_PACKAGES, AMAZON_HUB, AMAZON_EXCEPTION, AMAZON_OTP]
+
+# Line breaks of a header folded over several lines
+FOLD_RE = re.compile(r"\r?\n(?=[ \t])")
+
+
+def _decode(value: Optional[str]) -> str:
+    """Unfold and decode an email header to a string."""
+    if value is None:
+        return ""
+    value = FOLD_RE.sub("", str(value))
+    try:
+        return str(make_header(decode_header(value)))
+    except Exception:
+        return str(value)
+
+
+def _first_payload(msg: Any, multipart_only: bool = False) -> Optional[str]:
+    """Return the quoted-printable decoded first payload of a message."""
+    try:
+        if msg.is_multipart() or multipart_only:
+            email_msg = quopri.decodestring(str(msg.get_payload(0)))
+        else:
+            email_msg = quopri.decodestring(str(msg.get_payload()))
+    except Exception as err:
+        _LOGGER.debug("Problem decoding email message: %s", str(err))
+        return None
+    return email_msg.decode("utf-8", "ignore")
+
+
+def _sender_match(sender: str, addresses: list) -> bool:
+    """Check a lower cased From header against a list of addresses."""
+    return any(address in sender for address in addresses)
+
+
+def count_terms(msg: LazyMessage, terms: list) -> dict:
+    """Count how often each (term, pattern) is found in the text parts.
+
+    Returns dict of counts by term, without the terms that weren't found
+    """
+    counts = {}
+    for term, pattern in terms:
+        if count := sum(len(pattern.findall(text)) for text in msg.texts()):
+            counts[term] = count
+    return counts
+
+
+def tracking_numbers(carriers: dict, subject: str, texts: Iterable) -> dict:
+    """Find tracking numbers in the subject, then the body.
+
+    Every carrier the sender ships with is found in one pass per text.
+
+    Returns dict of tracking numbers by carrier
+    """
+    found = {
+        prefix: [matches[0].number]
+        for prefix, matches in scan_tracking(subject, carriers).items()
+    }
+    remaining = {
+        prefix: pattern for prefix, pattern in carriers.items() if prefix not in found
+    }
+    if not remaining:
+        return found
+    for text in texts:
+        for prefix, matches in scan_tracking(text, remaining).items():
+            tracking = found.setdefault(prefix, [])
+            if matches[0].number not in tracking:
+                tracking.append(matches[0].number)
+    return found
+
+
+def amazon_items(msg: LazyMessage) -> tuple:
+    """Find Amazon order numbers and arrival dates.
+
+    Returns tuple of order numbers and arrival dates
+    """
+    orders = []
+    if found := AMAZON_ORDER_RE.findall(_decode(msg["subject"])):
+        orders.append(found[0])
+    email_msg = _first_payload(msg)
+    eta = []
+    if email_msg is not None:
+        if (found := AMAZON_ORDER_RE.findall(email_msg)) and found[0] not in orders:
+            orders.append(found[0])
+        for search in AMAZON_TIME_PATTERN:
+            if search not in email_msg:
+                continue
+            start = email_msg.find(search) + len(search)
+            end = helpers.amazon_date_search(email_msg)
+            arrive_date = email_msg[start:end].replace(">", "").strip()
+            _LOGGER.debug("First pass: %s", arrive_date)
+            arrive_date = " ".join(arrive_date.split(" ")[0:3]).strip()
+            eta.append(arrive_date)
+    return orders, eta
+
+
+def amazon_hub_code(msg: LazyMessage) -> Optional[str]:
+    """Find the Amazon Hub pickup code in the subject, then the body."""
+    search = AMAZON_HUB_SUBJECT_RE.search(_decode(msg["subject"]))
+    if search is not None and len(search.groups()) > 1:
+        return search.group(3)
+    email_msg = _first_payload(msg)
+    if email_msg is not None:
+        search = AMAZON_HUB_BODY_RE.search(email_msg)
+        if search is not None and len(search.groups()) > 1:
+            return search.group(2)
+    return None
+
+
+def amazon_otp_code(msg: LazyMessage) -> Optional[str]:
+    """Find the Amazon delivery one-time password in the body."""
+    email_msg = _first_payload(msg, True)
+    if email_msg is not None and (search := AMAZON_OTP_RE.search(email_msg)):
+        return search.group(2)
+    return None
+
+
+def amazon_packages(facts: list) -> tuple:
+    """Count Amazon packages arriving today and collect the order numbers.
+
+    Deliveries are arrival dates falling on today, at most one per order.
+
+    Returns tuple of package count and order numbers
+    """
+    orders = []
+    deliveries = 0
+    today = datetime.date.today()
+    for fact in facts:
+        for order in fact.get(FACT_ORDERS, []):
+            if order not in orders:
+                orders.append(order)
+        for arrive_date in fact.get(FACT_ETA, []):
+            dateobj = dateparser.parse(arrive_date)
+            if (
+                dateobj is not None
+                and dateobj.day == today.day
+                and dateobj.month == today.month
+            ):
+                deliveries += 1
+    return min(deliveries, len(orders)), orders
+
+
+class MessageClassifier:
+    """Extract facts from messages and route them to sensors."""
+
+    def __init__(self, config: dict) -> None:
+        """Initialize."""
+        fwds = cv.ensure_list_csv(config.get(CONF_AMAZON_FWDS))
+        domain = config.get(CONF_AMAZON_DOMAIN) or ""
+        self.amazon_days = (
+            DEFAULT_AMAZON_DAYS
+            if config.get(CONF_AMAZON_DAYS) is None
+            else config[CONF_AMAZON_DAYS]
+        )
+
+        self._amazon = [
+            address.lower() for address in helpers.amazon_email_addresses(fwds, domain)
+        ]
+        self._hub = [
+            address.lower()
+            for address in helpers.process_amazon_forwards(fwds) + AMAZON_HUB_EMAIL
+        ]
+        self._otp = self._amazon
+
+        # Body search terms and tracking patterns by sender
+        self._body = []
+        self._tracking = {}
+        for sensor, sensor_data in SENSOR_DATA.items():
+            if ATTR_EMAIL not in sensor_data:
+                continue
+            senders = [address.lower() for address in sensor_data[ATTR_EMAIL]]
+            subjects = [subject.lower() for subject in sensor_data[ATTR_SUBJECT]]
+            if ATTR_BODY in sensor_data:
+                self._body.append((senders, subjects, list(MATCHERS[sensor].body)))
+            prefix = "_".join(sensor.split("_")[:-1])
+            if prefix in MATCHERS.tracking:
+                pattern = MATCHERS.tracking[prefix]
+                # Only messages counted as delivering report tracking numbers
+                delivering = SENSOR_DATA.get(f"{prefix}_delivering", {})
+                entry = self._tracking.setdefault(
+                    prefix,
+                    (
+                        [],
+                        pattern,
+                        [s.lower() for s in delivering.get(ATTR_SUBJECT, [])],
+                    ),
+                )
+                entry[0].extend(s for s in senders if s not in entry[0])
+        self._tracking[AMAZON_TRACKING] = (
+            self._amazon,
+            AMAZON_ORDER_RE,
+            [AMAZON_EXCEPTION_SUBJECT.lower()],
+        )
+
+    @staticmethod
+    def handles(sensor: str) -> bool:
+        """Return True if the sensor value comes from classified messages."""
+        if sensor in UNCLASSIFIED or sensor.startswith("zpackages_"):
+            return False
+        if sensor in CLASSIFIED_AMAZON:
+            return True
+        return sensor in SENSOR_DATA
+
+    def senders(self, sensors: list) -> list:
+        """Return the addresses of every sender the sensors read from."""
+        addresses = {}
+        for sensor in sensors:
+            if sensor in [AMAZON_PACKAGES, AMAZON_EXCEPTION]:
+                found = self._amazon
+            elif sensor == AMAZON_HUB:
+                found = self._hub
+            elif sensor == AMAZON_OTP:
+                found = self._otp
+            else:
+                names = [sensor]
+                if sensor.endswith(("_packages", "_delivering")):
+                    # Package counts depend on the delivered emails
+                    prefix = "_".join(sensor.split("_")[:-1])
+                    names.extend([f"{prefix}_delivering", f"{prefix}_delivered"])
+                found = [
+                    address.lower()
+                    for name in names
+                    for address in SENSOR_DATA.get(name, {}).get(ATTR_EMAIL, [])
+                ]
+            addresses.update(dict.fromkeys(found))
+        return list(addresses)
+
+    def affected(self, sensors: list, headers: list) -> list:
+        """Return which of sensors new messages can change.
+
+        headers are the raw headers of the new messages, with the From
+        header. Package totals and the update time are only refreshed
+        along with another sensor.
+        """
+        found = {_decode(LazyMessage(raw)["from"]).lower() for raw in headers}
+        changed = []
+        for sensor in sensors:
+            if sensor.startswith("zpackages_") or sensor == "mail_updated":
+                continue
+            addresses = (
+                self._amazon if sensor == AMAZON_DELIVERED else self.senders([sensor])
+            )
+            if any(_sender_match(sender, addresses) for sender in found):
+                changed.append(sensor)
+        if changed:
+            changed.extend(
+                sensor
+                for sensor in sensors
+                if sensor.startswith("zpackages_") or sensor == "mail_updated"
+            )
+        return changed
+
+    @property
+    def fingerprint(self) -> str:
+        """Return a hash of everything that changes the extracted facts."""
+        key = repr((VERSION, self._amazon, self._hub))
+        return hashlib.sha1(key.encode(), usedforsecurity=False).hexdigest()
+
+    @property
+    def amazon_window(self) -> bool:
+        """Return True if older Amazon emails are needed."""
+        return self.amazon_days > 0
+
+    def extract(
+        self, raw: bytes | LazyMessage, headers_only: bool = False
+    ) -> Optional[dict]:
+        """Parse a message once and return every fact the sensors use.
+
+        With headers_only, returns None if the body is needed as well.
+        """
+        msg = raw if isinstance(raw, LazyMessage) else LazyMessage(raw)
+        sender = _decode(msg["from"]).lower()
+        subject = _decode(msg["subject"])
+        if headers_only and self._needs_body(sender, subject):
+            return None
+        facts = {
+            FACT_FROM: sender,
+            FACT_SUBJECT: subject,
+            FACT_BODY: {},
+            FACT_TRACKING: {},
+        }
+
+        # Text parts are decoded on first use and only when a sensor needs them
+        for senders, _, terms in self._body:
+            if not _sender_match(sender, senders):
+                continue
+            terms = [term for term in terms if term[0] not in facts[FACT_BODY]]
+            facts[FACT_BODY].update(count_terms(msg, terms))
+
+        carriers = {
+            prefix: pattern
+            for prefix, (senders, pattern, _) in self._tracking.items()
+            if _sender_match(sender, senders)
+        }
+        if carriers:
+            facts[FACT_TRACKING] = tracking_numbers(carriers, subject, msg.texts())
+
+        if _sender_match(sender, self._amazon):
+            facts[FACT_ORDERS], facts[FACT_ETA] = amazon_items(msg)
+        if (
+            _sender_match(sender, self._hub)
+            and AMAZON_HUB_SUBJECT.lower() in subject.lower()
+        ):
+            facts[FACT_HUB_CODE] = amazon_hub_code(msg)
+        if (
+            _sender_match(sender, self._otp)
+            and AMAZON_OTP_SUBJECT.lower() in subject.lower()
+            and (code := amazon_otp_code(msg)) is not None
+        ):
+            facts[FACT_OTP] = code
+
+        return facts
+
+    def whole_message(self, raw: bytes) -> bool:
+        """Return True if facts are read from the raw first payload.
+
+        Amazon facts are, so those messages are downloaded whole. Every
+        other sensor only reads the text parts.
+        """
+        sender = _decode(LazyMessage(raw)["from"]).lower()
+        return any(
+            _sender_match(sender, addresses)
+            for addresses in (self._amazon, self._hub, self._otp)
+        )
+
+    def _needs_body(self, sender: str, subject: str) -> bool:
+        """Return True if a sensor could read facts from the message body."""
+        lower = subject.lower()
+        for senders, subjects, _ in self._body:
+            if _sender_match(sender, senders) and any(s in lower for s in subjects):
+                return True
+        for senders, pattern, subjects in self._tracking.values():
+            if (
+                _sender_match(sender, senders)
+                and any(s in lower for s in subjects)
+                and not pattern.search(subject)
+            ):
+                return True
+        if _sender_match(sender, self._amazon):
+            # Order numbers and arrival dates are in the body
+            return True
+        if (
+            _sender_match(sender, self._hub)
+            and AMAZON_HUB_SUBJECT.lower() in lower
+            and not AMAZON_HUB_SUBJECT_RE.search(subject)
+        ):
+            return True
+        return _sender_match(sender, self._otp) and AMAZON_OTP_SUBJECT.lower() in lower
+
+    def route(self, facts: list, sensors: list) -> dict:
+        """Fill sensor values from the extracted message facts."""
+        data = {}
+        today = [fact for fact in facts if fact[FACT_TODAY]]
+        for sensor in sensors:
+            self._value(sensor, facts, today, data)
+        return data
+
+    def _value(self, sensor: str, facts: list, today: list, data: dict) -> Any:
+        """Compute a single sensor, including any sensors it depends on."""
+        if sensor in data:
+            return data[sensor]
+
+        if sensor == AMAZON_PACKAGES:
+            amazon = [f for f in facts if _sender_match(f[FACT_FROM], self._amazon)]
+            data[sensor], data[AMAZON_ORDER] = amazon_packages(amazon)
+        elif sensor == AMAZON_HUB:
+            codes = [
+                fact[FACT_HUB_CODE]
+                for fact in today
+                if fact.get(FACT_HUB_CODE) is not None
+            ]
+            data[sensor] = len(codes)
+            data[AMAZON_HUB_CODE] = codes
+        elif sensor == AMAZON_EXCEPTION:
+            matched = self._matches(today, self._amazon, [AMAZON_EXCEPTION_SUBJECT])
+            data[sensor] = len(matched)
+            data[AMAZON_EXCEPTION_ORDER] = [
+                order
+                for fact in matched
+                for order in fact[FACT_TRACKING].get(AMAZON_TRACKING, [])
+            ]
+        elif sensor == AMAZON_OTP:
+            matched = self._matches(today, self._otp, [AMAZON_OTP_SUBJECT])
+            data[sensor] = {
+                ATTR_CODE: [fact[FACT_OTP] for fact in matched if FACT_OTP in fact]
+            }
+        elif "_packages" in sensor:
+            prefix = sensor.replace("_packages", "")
+            delivering = self._value(f"{prefix}_delivering", facts, today, data)
+            delivered = self._value(f"{prefix}_delivered", facts, today, data)
+            data[sensor] = delivering + delivered
+        elif "_delivering" in sensor:
+            prefix = sensor.replace("_delivering", "")
+            delivered = self._value(f"{prefix}_delivered", facts, today, data)
+            count, tracking = self.count(sensor, today, True)
+            data[sensor] = max(0, count - delivered)
+            data[f"{prefix}_tracking"] = tracking
+        else:
+            data[sensor] = self.count(sensor, today)[0]
+
+        _LOGGER.debug("Sensor: %s Count: %s", sensor, str(data[sensor]))
+        return data[sensor]
+
+    @staticmethod
+    def _matches(facts: list, senders: list, subjects: list) -> list:
+        """Return facts from any sender with any of the subjects."""
+        subjects = [subject.lower() for subject in subjects]
+        return [
+            fact
+            for fact in facts
+            if _sender_match(fact[FACT_FROM], senders)
+            and any(subject in fact[FACT_SUBJECT].lower() for subject in subjects)
+        ]
+
+    def count(self, sensor: str, today: list, get_tracking_num: bool = False) -> tuple:
+        """Count today's matching messages and collect tracking numbers.
+
+        Returns tuple of count and tracking numbers
+        """
+        sensor_data = SENSOR_DATA.get(sensor, {})
+        if ATTR_EMAIL not in sensor_data:
+            return (0, [])
+
+        matched = self._matches(
+            today,
+            [address.lower() for address in sensor_data[ATTR_EMAIL]],
+            sensor_data[ATTR_SUBJECT],
+        )
+        if ATTR_BODY in sensor_data:
+            count = sum(
+                fact[FACT_BODY].get(term, 0)
+                for fact in matched
+                for term in sensor_data[ATTR_BODY]
+            )
+        else:
+            count = len(matched)
+
+        tracking = []
+        prefix = "_".join(sensor.split("_")[:-1])
+        if get_tracking_num and count > 0:
+            for fact in matched:
+                for number in fact[FACT_TRACKING].get(prefix, []):
+                    if number not in tracking:
+                        tracking.append(number)
+        if len(tracking) > 0:
+            # Use tracking numbers found for count (more accurate)
+            count = len(tracking)
+        return (count, tracking)
+
+
+def _search_senders(
+    account: Type[imaplib.IMAP4_SSL],
+    addresses: list,
+    date: str,
+    uid: bool = False,
+    uids: str = None,
+) -> Generator:
+    """Search for messages from any of the addresses since date.
+
+    Addresses are combined into OR queries of up to DEFAULT_SEARCH_CHUNK_SIZE
+    senders, so the number of searches doesn't grow with the sensors.
+    uids limits the search to a UID set such as 120:*.
+
+    Returns list of message ids, or UIDs if uid is set, or None on error
+    """
+    ids = {}
+    for index in range(0, len(addresses), DEFAULT_SEARCH_CHUNK_SIZE):
+        _, search = helpers.build_search(
+            addresses[index : index + DEFAULT_SEARCH_CHUNK_SIZE], date
+        )
+        if uids is not None:
+            search = f"UID {uids} {search}"
+        try:
+            if uid:
+                (server_response, data) = yield command("uid", "SEARCH", None, search)
+            else:
+                (server_response, data) = yield command("search", None, search)
+        except Exception as err:
+            _LOGGER.error("Error searching emails: %s", str(err))
+            return None
+        if server_response != "OK":
+            return None
+        if data and data[0] is not None:
+            ids.update(dict.fromkeys(data[0].split()))
+    return sorted(ids, key=int)
+
+
+def _search_messages(
+    account: Type[imaplib.IMAP4_SSL],
+    searches: list,
+    uid: bool = False,
+    uids: str = None,
+) -> Generator:
+    """Run each (date, addresses) search, the first being today's.
+
+    Returns tuple of every id found and the set of today's ids, or None on error
+    """
+    found = []
+    for date, addresses in searches:
+        ids = yield from _search_senders(account, addresses, date, uid, uids)
+        if ids is None:
+            return None
+        found.append(ids)
+    ids = sorted(set().union(*found), key=int)
+    _LOGGER.debug("Found %s emails, %s from today", len(ids), len(found[0]))
+    return ids, set(found[0])
+
+
+def _searches(classifier: MessageClassifier, sensors: list) -> list:
+    """Return the senders to search for today and in the Amazon window."""
+    searches = [(helpers.get_formatted_date(), classifier.senders(sensors))]
+    if AMAZON_PACKAGES in sensors and classifier.amazon_window:
+        past_date = datetime.date.today() - datetime.timedelta(
+            days=classifier.amazon_days
+        )
+        searches.append(
+            (past_date.strftime("%d-%b-%Y"), classifier.senders([AMAZON_PACKAGES]))
+        )
+    return searches
+
+
+def _extract(
+    account: Type[imaplib.IMAP4_SSL],
+    classifier: MessageClassifier,
+    ids: list,
+    uid: bool = False,
+) -> Generator:
+    """Fetch headers for every message, then bodies only where needed.
+
+    Where only the text parts are needed, only those are downloaded.
+
+    Returns dict of message facts by id
+    """
+    facts = {}
+    bodies = ids
+    headers = {}
+    if helpers.partial_fetch(account):
+        bodies = []
+        found = yield from helpers.email_fetch_batch.steps(
+            account, ids, HEADER_PARTS, uid
+        )
+        for num, response_part in found:
+            if (fact := classifier.extract(response_part[1], True)) is not None:
+                facts[num] = fact
+            elif classifier.whole_message(response_part[1]):
+                bodies.append(num)
+            else:
+                headers[num] = response_part[1]
+        _LOGGER.debug(
+            "Classified %s emails by header, downloading %s and the text of %s",
+            len(facts),
+            len(bodies),
+            len(headers),
+        )
+
+    messages = yield from helpers.email_fetch_parts.steps(
+        account, list(headers), TEXT_TYPES, uid
+    )
+    for num, msg in messages:
+        facts[num] = classifier.extract(msg)
+    # Emails without any text part are classified by their headers
+    for num, raw in headers.items():
+        if num not in facts:
+            facts[num] = classifier.extract(raw)
+
+    found = yield from helpers.email_fetch_batch.steps(account, bodies, "(RFC822)", uid)
+    for num, response_part in found:
+        facts[num] = classifier.extract(response_part[1])
+    return facts
+
+
+def _fetch_facts(
+    account: Type[imaplib.IMAP4_SSL], classifier: MessageClassifier, searches: list
+) -> Generator:
+    """Search and fetch every candidate message.
+
+    Returns list of message facts or None on error
+    """
+    if (result := (yield from _search_messages(account, searches))) is None:
+        return None
+    ids, today = result
+
+    facts = []
+    found = yield from _extract(account, classifier, ids)
+    for num in ids:
+        if (fact := found.get(num)) is not None:
+            fact[FACT_TODAY] = num in today
+            facts.append(fact)
+    return facts
+
+
+@sequence
+def search_facts(
+    account: Type[imaplib.IMAP4_SSL], classifier: MessageClassifier, sensors: list
+) -> list:
+    """Search and fetch the messages of sensors without the message cache.
+
+    Returns list of message facts, empty on error
+    """
+    searches = _searches(classifier, sensors)
+    return (yield from _fetch_facts(account, classifier, searches)) or []
+
+
+def _search_key(folder: str, searches: list) -> str:
+    """Return a key for searches, which changes with the day."""
+    key = repr((folder, searches))
+    return hashlib.sha1(key.encode(), usedforsecurity=False).hexdigest()
+
+
+def _cache_fingerprint(config: dict, classifier: MessageClassifier) -> str:
+    """Return a hash of the mailbox the cached UIDs belong to and the classifier.
+
+    UIDVALIDITY alone does not tell mailboxes apart, many servers start
+    it at 1 for every folder.
+    """
+    key = repr(
+        (
+            config.get(CONF_HOST),
+            config.get(CONF_USERNAME),
+            config.get(CONF_FOLDER),
+            classifier.fingerprint,
+        )
+    )
+    return hashlib.sha1(key.encode(), usedforsecurity=False).hexdigest()
+
+
+def _search_changes(
+    account: Type[imaplib.IMAP4_SSL],
+    searches: list,
+    previous: Optional[dict],
+    status: dict,
+) -> Generator:
+    """Bring the previous search result up to date from what changed.
+
+    An unchanged mailbox state means nothing was added or expunged.
+    Otherwise only messages from the previous UIDNEXT on are searched, so
+    the cost follows the number of changes rather than the size of the
+    mailbox. With QRESYNC, expunged UIDs are dropped; without it, any
+    expunge means a full search. UIDNEXT is only reported on select, so
+    a held session always searches from the previous one.
+
+    Returns tuple of uids and today's uids, or None if a full search is needed
+    """
+    if previous is None or previous["uidnext"] is None or "UIDNEXT" not in status:
+        return None
+    uids = previous["uids"]
+    today = set(previous["today"])
+    if (
+        "MESSAGES" in status
+        and status["UIDNEXT"] == previous["uidnext"]
+        and status["MESSAGES"] == previous["messages"]
+        and status.get("HIGHESTMODSEQ") == previous["modseq"]
+        and status.get("CHANGES") == previous.get("changes")
+    ):
+        _LOGGER.debug("Mailbox unchanged, reusing %s searched emails", len(uids))
+        return uids, today
+
+    first = previous["uidnext"]
+    server = CAPABILITIES.server(account)
+    if previous["modseq"] is not None and server.enabled.get("QRESYNC"):
+        vanished = yield from helpers.vanished_since.steps(
+            account, uids, previous["modseq"]
+        )
+        if vanished is None:
+            return None
+    else:
+        # Nothing was expunged if the mailbox only grew by the new messages
+        if previous["messages"] is None or "MESSAGES" not in status:
+            return None
+        if (added := (yield from helpers.uids_since.steps(account, first))) is None:
+            return None
+        if status["MESSAGES"] != previous["messages"] + len(added):
+            _LOGGER.debug("Emails were expunged, searching the mailbox again")
+            return None
+        vanished = set()
+
+    found = yield from _search_messages(account, searches, True, f"{first}:*")
+    if found is None:
+        return None
+    # n:* always matches the last message, even when its UID is below n
+    new = [
+        uid.decode()
+        for uid in found[0]
+        if int(uid) >= first and uid.decode() not in uids
+    ]
+    new_today = {uid.decode() for uid in found[1]}.intersection(new)
+
+    _LOGGER.debug(
+        "%s emails expunged and %s added since UIDNEXT %s",
+        len(vanished),
+        len(new),
+        first,
+    )
+    uids = [uid for uid in uids if uid not in vanished] + new
+    return uids, (today - vanished) | new_today
+
+
+def _cached_facts(
+    account: Type[imaplib.IMAP4_SSL],
+    config: dict,
+    classifier: MessageClassifier,
+    searches: list,
+    cache: MessageCache,
+) -> Generator:
+    """Search by UID and only fetch messages missing from the cache.
+
+    Returns list of message facts or None on error
+    """
+    folder = config.get(CONF_FOLDER)
+    status = yield from helpers.folder_status.steps(account)
+    if not status or "UIDVALIDITY" not in status:
+        _LOGGER.debug("UIDVALIDITY unavailable, not using the message cache")
+        return (yield from _fetch_facts(account, classifier, searches))
+    cache.validate(status["UIDVALIDITY"], _cache_fingerprint(config, classifier))
+
+    key = _search_key(folder, searches)
+    result = yield from _search_changes(account, searches, cache.search(key), status)
+    if result is None:
+        found = yield from _search_messages(account, searches, True)
+        if found is None:
+            return None
+        result = (
+            [uid.decode() for uid in found[0]],
+            {uid.decode() for uid in found[1]},
+        )
+    uids, today = result
+
+    # Only messages that arrived since the last refresh are missing
+    new = [uid for uid in uids if uid not in cache]
+    _LOGGER.debug(
+        "Classifying %s emails, %s cached (UIDNEXT %s)",
+        len(new),
+        len(uids) - len(new),
+        cache.uidnext,
+    )
+    found = yield from _extract(account, classifier, new, True)
+    for uid, fact in found.items():
+        cache.add(uid, fact)
+
+    cache.prune(uids)
+    if "UIDNEXT" in status:
+        cache.advance(status["UIDNEXT"])
+    cache.record_search(key, uids, sorted(today, key=int), status)
+
+    facts = []
+    for uid in uids:
+        if (fact := cache.get(uid)) is not None:
+            fact[FACT_TODAY] = uid in today
+            facts.append(fact)
+    return facts
+
+
+@sequence
+def classify_emails(
+    account: Type[imaplib.IMAP4_SSL],
+    config: dict,
+    resources: list,
+    cache: MessageCache = None,
+) -> dict:
+    """Fetch each candidate message once and fill every classified sensor.
+
+    With a cache, messages already classified are not fetched again.
+
+    Returns dict of sensor data
+    """
+    classifier = MessageClassifier(config)
+    sensors = [sensor for sensor in resources if classifier.handles(sensor)]
+    if not sensors:
+        return {}
+
+    searches = _searches(classifier, sensors)
+    if cache is not None:
+        facts = yield from _cached_facts(account, config, classifier, searches, cache)
+    else:
+        facts = yield from _fetch_facts(account, classifier, searches)
+    if facts is None:
+        return {}
+
+    _LOGGER.debug("Routing %s emails to %s sensors", len(facts), len(sensors))
+    return classifier.route(facts, sensors)
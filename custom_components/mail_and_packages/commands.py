@@ -0,0 +1,87 @@
+"""IMAP command sequences shared by the blocking and asyncio transports."""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+from typing import Any, Callable, Generator, NamedTuple
+
+
+class Command(NamedTuple):
+    """An IMAP command a sequence waits on, named like the imaplib method."""
+
+    name: str
+    args: tuple
+
+
+def command(name: str, *args: Any) -> Command:
+    """Return the command calling the account method name with args."""
+    return Command(name, args)
+
+
+def sequence(func: Callable[..., Generator]) -> Callable:
+    """Make a command sequence callable with a blocking account.
+
+    func takes the account first and yields a Command for every round
+    trip. It is sent the (typ, data) result, or thrown the error the
+    command raised. The generator function stays available as steps, for
+    other sequences to yield from and for async_run.
+    """
+
+    @functools.wraps(func)
+    def wrapper(account: Any, *args: Any, **kwargs: Any) -> Any:
+        return run(account, func(account, *args, **kwargs))
+
+    wrapper.steps = func
+    return wrapper
+
+
+def run(account: Any, steps: Generator) -> Any:
+    """Run a command sequence on a blocking, imaplib compatible account.
+
+    Returns the value of the sequence
+    """
+    try:
+        request = next(steps)
+        while True:
+            try:
+                result = getattr(account, request.name)(*request.args)
+            except Exception as err:
+                request = steps.throw(err)
+            else:
+                request = steps.send(result)
+    except StopIteration as stop:
+        return stop.value
+
+
+def _advance(func: Callable, *args: Any) -> tuple:
+    """Resume a sequence until its next command.
+
+    Returns tuple of whether it finished and its next command or value
+    """
+    try:
+        return False, func(*args)
+    except StopIteration as stop:
+        return True, stop.value
+
+
+async def async_run(client: Any, steps: Generator) -> Any:
+    """Run a command sequence on an AsyncIMAP client.
+
+    Commands are awaited on the event loop and the code between them runs
+    in the executor, so parsing never blocks the loop and no thread waits
+    on the server.
+
+    Returns the value of the sequence
+    """
+    loop = asyncio.get_running_loop()
+    done, value = await loop.run_in_executor(None, _advance, next, steps)
+    while not done:
+        try:
+            result = await getattr(client, value.name)(*value.args)
+        except Exception as err:
+            resume = (steps.throw, err)
+        else:
+            resume = (steps.send, result)
+        done, value = await loop.run_in_executor(None, _advance, *resume)
+    return value
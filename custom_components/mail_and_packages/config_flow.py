@@ -14,6 +14,7 @@ from homeassistant.const import (
     CONF_RESOURCES,
     CONF_USERNAME,
 )
+from homeassistant.core import callback
 
 from .const import (
     CONF_ALLOW_EXTERNAL,
@@ -25,11 +26,19 @@ from .const import (
     CONF_DURATION,
     CONF_FOLDER,
     CONF_GENERATE_MP4,
+    CONF_GIF_OPTIMIZE,
+    CONF_GIF_WEBP,
     CONF_IMAGE_SECURITY,
+    CONF_IMAP_ASYNC,
+    CONF_IMAP_COMPRESS,
+    CONF_IMAP_CONNECTIONS,
+    CONF_IMAP_IDLE,
     CONF_IMAP_SECURITY,
     CONF_IMAP_TIMEOUT,
     CONF_PATH,
+    CONF_RESIZE_WORKERS,
     CONF_SCAN_INTERVAL,
+    CONF_STATUS_CHECK,
     CONF_STORAGE,
     CONF_VERIFY_SSL,
     CONFIG_VER,
@@ -41,13 +50,22 @@ from .const import (
     DEFAULT_CUSTOM_IMG_FILE,
     DEFAULT_FOLDER,
     DEFAULT_GIF_DURATION,
+    DEFAULT_GIF_OPTIMIZE,
+    DEFAULT_GIF_WEBP,
     DEFAULT_IMAGE_SECURITY,
+    DEFAULT_IMAP_ASYNC,
+    DEFAULT_IMAP_COMPRESS,
+    DEFAULT_IMAP_CONNECTIONS,
+    DEFAULT_IMAP_IDLE,
     DEFAULT_IMAP_TIMEOUT,
     DEFAULT_PATH,
     DEFAULT_PORT,
+    DEFAULT_RESIZE_WORKERS,
     DEFAULT_SCAN_INTERVAL,
+    DEFAULT_STATUS_CHECK,
     DEFAULT_STORAGE,
     DOMAIN,
+    MAX_IMAP_CONNECTIONS,
 )
 from .helpers import _check_ffmpeg, _test_login, get_resources, login
 
@@ -302,6 +320,51 @@ def _get_schema_step_storage(user_input: list, default_dict: list) -> Any:
     )
 
 
+def _get_schema_options(user_input: list, default_dict: list) -> Any:
+    """Get a schema using the default_dict as a backup."""
+    if user_input is None:
+        user_input = {}
+
+    def _get_default(key: str, fallback_default: Any = None) -> None:
+        """Get default value for key."""
+        return user_input.get(key, default_dict.get(key, fallback_default))
+
+    return vol.Schema(
+        {
+            vol.Optional(
+                CONF_IMAP_IDLE, default=_get_default(CONF_IMAP_IDLE, DEFAULT_IMAP_IDLE)
+            ): bool,
+            vol.Optional(
+                CONF_IMAP_ASYNC,
+                default=_get_default(CONF_IMAP_ASYNC, DEFAULT_IMAP_ASYNC),
+            ): bool,
+            vol.Optional(
+                CONF_IMAP_COMPRESS,
+                default=_get_default(CONF_IMAP_COMPRESS, DEFAULT_IMAP_COMPRESS),
+            ): bool,
+            vol.Optional(
+                CONF_IMAP_CONNECTIONS,
+                default=_get_default(CONF_IMAP_CONNECTIONS, DEFAULT_IMAP_CONNECTIONS),
+            ): vol.All(vol.Coerce(int), vol.Range(min=1, max=MAX_IMAP_CONNECTIONS)),
+            vol.Optional(
+                CONF_STATUS_CHECK,
+                default=_get_default(CONF_STATUS_CHECK, DEFAULT_STATUS_CHECK),
+            ): bool,
+            vol.Optional(
+                CONF_RESIZE_WORKERS,
+                default=_get_default(CONF_RESIZE_WORKERS, DEFAULT_RESIZE_WORKERS),
+            ): vol.All(vol.Coerce(int), vol.Range(min=1)),
+            vol.Optional(
+                CONF_GIF_OPTIMIZE,
+                default=_get_default(CONF_GIF_OPTIMIZE, DEFAULT_GIF_OPTIMIZE),
+            ): bool,
+            vol.Optional(
+                CONF_GIF_WEBP, default=_get_default(CONF_GIF_WEBP, DEFAULT_GIF_WEBP)
+            ): bool,
+        }
+    )
+
+
 @config_entries.HANDLERS.register(DOMAIN)
 class MailAndPackagesFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
     """Config flow for Mail and Packages."""
@@ -315,6 +378,12 @@ class MailAndPackagesFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
         self._data = {}
         self._errors = {}
 
+    @staticmethod
+    @callback
+    def async_get_options_flow(config_entry):
+        """Get the options flow for this handler."""
+        return MailAndPackagesOptionsFlow(config_entry)
+
     async def async_step_user(self, user_input=None):
         """Handle a flow initialized by the user."""
         self._errors = {}
@@ -617,3 +686,28 @@ class MailAndPackagesFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
             data_schema=_get_schema_step_storage(user_input, self._data),
             errors=self._errors,
         )
+
+
+class MailAndPackagesOptionsFlow(config_entries.OptionsFlow):
+    """Options flow for Mail and Packages."""
+
+    def __init__(self, config_entry):
+        """Initialize."""
+        self._entry = config_entry
+        self._errors = {}
+
+    async def async_step_init(self, user_input=None):
+        """Manage the connection and image options."""
+        self._errors = {}
+        if user_input is not None:
+            if user_input.get(CONF_IMAP_ASYNC) and user_input.get(CONF_IMAP_COMPRESS):
+                # The asyncio client does not negotiate COMPRESS=DEFLATE
+                self._errors[CONF_IMAP_COMPRESS] = "compress_async"
+            else:
+                return self.async_create_entry(title="", data=user_input)
+
+        return self.async_show_form(
+            step_id="init",
+            data_schema=_get_schema_options(user_input, dict(self._entry.options)),
+            errors=self._errors,
+        )
@@ -0,0 +1,262 @@
+"""IMAP connection manager for Mail and Packages."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import socket
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, Optional
+
+from homeassistant.const import CONF_HOST, CONF_PASSWORD, CONF_PORT, CONF_USERNAME
+
+from . import aioimap
+from .commands import async_run
+from .const import (
+    CONF_FOLDER,
+    CONF_IMAP_ASYNC,
+    CONF_IMAP_COMPRESS,
+    CONF_IMAP_SECURITY,
+    CONF_IMAP_TIMEOUT,
+    CONF_VERIFY_SSL,
+    DEFAULT_IMAP_ASYNC,
+    DEFAULT_IMAP_COMPRESS,
+    DEFAULT_IMAP_TIMEOUT,
+    DEFAULT_RECONNECT_ATTEMPTS,
+    DEFAULT_RECONNECT_BACKOFF,
+    DEFAULT_RECONNECT_MAX_BACKOFF,
+)
+from .helpers import login, logout, selectfolder
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class MailConnection:
+    """Keep an authenticated IMAP session alive between coordinator refreshes."""
+
+    def __init__(self, config: dict) -> None:
+        """Initialize.
+
+        With the asyncio transport enabled, sessions are AsyncIMAP clients
+        used through async_session instead of session.
+        """
+        self._config = config
+        self.uses_asyncio = config.get(CONF_IMAP_ASYNC, DEFAULT_IMAP_ASYNC)
+        self._account = None
+        self._lock = threading.RLock()
+        self._async_lock = asyncio.Lock()
+        self._failures = 0
+        self._retry_after = 0.0
+
+    @property
+    def connected(self) -> bool:
+        """Return True if an authenticated session is held."""
+        return self._account is not None
+
+    @contextmanager
+    def session(self, probe: Callable[[Any], bool] = None) -> Iterator[Any]:
+        """Yield a live account with the folder selected.
+
+        A held session is checked with NOOP, or with probe when given so
+        the check can do useful work. probe returns False if the session
+        did not answer. Yields False if the server could not be reached.
+        The session is locked for the duration so refreshes never
+        interleave commands.
+        """
+        with self._lock:
+            yield self._acquire(probe)
+
+    @asynccontextmanager
+    async def async_session(
+        self, probe: Callable[[Any], Awaitable[bool]] = None
+    ) -> AsyncIterator[Any]:
+        """Yield a live AsyncIMAP client with the folder selected.
+
+        The asyncio transport's session, probe is awaited. A command that
+        was cancelled or failed can leave responses in flight, so any error
+        drops the client.
+        """
+        async with self._async_lock:
+            client = await self._async_acquire(probe)
+            try:
+                yield client
+            except BaseException:
+                if client:
+                    client.abort()
+                    self._account = None
+                raise
+
+    def open(self) -> Any:
+        """Return a separate session for parallel work, or False.
+
+        The caller owns the session and must log it out.
+        """
+        account = self._login()
+        if not account:
+            return False
+        if not selectfolder(account, self._config.get(CONF_FOLDER)):
+            logout(account)
+            return False
+        return account
+
+    def abort(self) -> None:
+        """Interrupt the command in progress, callable from any thread."""
+        # Deliberately lock free, the refresh being aborted holds the lock
+        if self.uses_asyncio or (account := self._account) is None:
+            # Cancelling the refresh stops an asyncio command
+            return
+        _LOGGER.debug("Aborting IMAP session to %s", self._config[CONF_HOST])
+        # Wakes a thread blocked reading, the next session check reconnects
+        try:
+            account.sock.shutdown(socket.SHUT_RDWR)
+        except (AttributeError, OSError) as err:
+            _LOGGER.debug("Error aborting IMAP session: %s", str(err))
+
+    def close(self) -> None:
+        """Log out and drop the session."""
+        with self._lock:
+            if self._account is not None:
+                _LOGGER.debug("Closing IMAP session to %s", self._config[CONF_HOST])
+            self._drop()
+
+    async def async_close(self) -> None:
+        """Log out and drop the session of the asyncio transport."""
+        async with self._async_lock:
+            if self._account is not None:
+                _LOGGER.debug("Closing IMAP session to %s", self._config[CONF_HOST])
+                await aioimap.async_logout(self._account)
+            self._account = None
+
+    def _acquire(self, probe: Optional[Callable[[Any], bool]]) -> Any:
+        """Return the current session or reconnect."""
+        if self._account is not None:
+            if probe(self._account) if probe is not None else self._is_alive():
+                return self._account
+            _LOGGER.debug("IMAP session went stale, reconnecting.")
+            self._drop()
+        return self._connect()
+
+    async def _async_acquire(
+        self, probe: Optional[Callable[[Any], Awaitable[bool]]]
+    ) -> Any:
+        """Return the current client or reconnect."""
+        if self._account is not None:
+            if await (probe or self._async_is_alive)(self._account):
+                return self._account
+            _LOGGER.debug("IMAP session went stale, reconnecting.")
+            await aioimap.async_logout(self._account)
+            self._account = None
+        return await self._async_connect()
+
+    def _is_alive(self) -> bool:
+        """Check the session with NOOP."""
+        try:
+            status, _ = self._account.noop()
+        except Exception as err:
+            _LOGGER.debug("IMAP NOOP failed: %s", str(err))
+            return False
+        return status == "OK"
+
+    @staticmethod
+    async def _async_is_alive(client: aioimap.AsyncIMAP) -> bool:
+        """Check the client with NOOP."""
+        try:
+            status, _ = await client.noop()
+        except Exception as err:
+            _LOGGER.debug("IMAP NOOP failed: %s", str(err))
+            return False
+        return status == "OK"
+
+    def _connect(self) -> Any:
+        """Login and select the folder, retrying with backoff."""
+        if self._waiting():
+            return False
+
+        for attempt in range(DEFAULT_RECONNECT_ATTEMPTS):
+            if attempt:
+                time.sleep(DEFAULT_RECONNECT_BACKOFF * 2 ** (attempt - 1))
+            account = self._login()
+            if not account:
+                continue
+            if selectfolder(account, self._config.get(CONF_FOLDER)):
+                return self._connected(account)
+            logout(account)
+
+        return self._failed()
+
+    async def _async_connect(self) -> Any:
+        """Login and select the folder with the asyncio transport."""
+        if self._waiting():
+            return False
+
+        folder = self._config.get(CONF_FOLDER)
+        for attempt in range(DEFAULT_RECONNECT_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(DEFAULT_RECONNECT_BACKOFF * 2 ** (attempt - 1))
+            client = await aioimap.async_login(
+                *self._login_args(), timeout=self._timeout()
+            )
+            if not client:
+                continue
+            if await async_run(client, selectfolder.steps(client, folder)):
+                return self._connected(client)
+            await aioimap.async_logout(client)
+
+        return self._failed()
+
+    def _waiting(self) -> bool:
+        """Return True while backing off after failed reconnects."""
+        now = time.monotonic()
+        if now < self._retry_after:
+            _LOGGER.debug(
+                "Waiting %s seconds before reconnecting to the IMAP server",
+                int(self._retry_after - now),
+            )
+            return True
+        return False
+
+    def _connected(self, account: Any) -> Any:
+        """Keep a new session and reset the backoff."""
+        self._account = account
+        self._failures = 0
+        self._retry_after = 0.0
+        return account
+
+    def _failed(self) -> bool:
+        """Back off after every reconnect attempt failed."""
+        self._failures += 1
+        delay = min(
+            DEFAULT_RECONNECT_BACKOFF * 2 ** (self._failures + 1),
+            DEFAULT_RECONNECT_MAX_BACKOFF,
+        )
+        self._retry_after = time.monotonic() + delay
+        _LOGGER.error("Unable to connect to the IMAP server, retrying in %s", delay)
+        return False
+
+    def _login(self) -> Any:
+        """Login with the blocking transport."""
+        compress = self._config.get(CONF_IMAP_COMPRESS, DEFAULT_IMAP_COMPRESS)
+        return login(*self._login_args(), compress=compress, timeout=self._timeout())
+
+    def _login_args(self) -> tuple:
+        """Return the server and credentials to login with."""
+        return (
+            self._config.get(CONF_HOST),
+            self._config.get(CONF_PORT),
+            self._config.get(CONF_USERNAME),
+            self._config.get(CONF_PASSWORD),
+            self._config.get(CONF_IMAP_SECURITY),
+            self._config.get(CONF_VERIFY_SSL),
+        )
+
+    def _timeout(self) -> float:
+        """Return the timeout of every IMAP operation."""
+        return self._config.get(CONF_IMAP_TIMEOUT) or DEFAULT_IMAP_TIMEOUT
+
+    def _drop(self) -> None:
+        """Forget the current session."""
+        if self._account is not None:
+            logout(self._account)
+        self._account = None
@@ -58,6 +58,14 @@ CONF_AMAZON_DAYS = "amazon_days"
 CONF_VERIFY_SSL = "verify_ssl"
 CONF_IMAP_SECURITY = "imap_security"
 CONF_AMAZON_DOMAIN = "amazon_domain"
+CONF_IMAP_IDLE = "imap_idle"
+CONF_IMAP_ASYNC = "imap_async"
+CONF_IMAP_COMPRESS = "imap_compress"
+CONF_IMAP_CONNECTIONS = "imap_connections"
+CONF_RESIZE_WORKERS = "resize_workers"
+CONF_GIF_OPTIMIZE = "gif_optimize"
+CONF_GIF_WEBP = "gif_webp"
+CONF_STATUS_CHECK = "status_check"
 
 # Defaults
 DEFAULT_CAMERA_NAME = "Mail USPS Camera"
@@ -77,6 +85,43 @@ DEFAULT_CUSTOM_IMG_FILE = "custom_components/mail_and_packages/images/mail_none.
 DEFAULT_AMAZON_DAYS = 3
 DEFAULT_AMAZON_DOMAIN = "amazon.com"
 DEFAULT_STORAGE = "custom_components/mail_and_packages/images/"
+DEFAULT_RECONNECT_ATTEMPTS = 3
+DEFAULT_RECONNECT_BACKOFF = 1
+DEFAULT_RECONNECT_MAX_BACKOFF = 300
+DEFAULT_FETCH_CHUNK_SIZE = 50
+DEFAULT_SEARCH_CHUNK_SIZE = 25
+DEFAULT_IMAP_IDLE = False
+DEFAULT_IMAP_ASYNC = False
+DEFAULT_IMAP_COMPRESS = False
+DEFAULT_IMAP_CONNECTIONS = 1
+# Stay well below the per account connection limit of common providers
+MAX_IMAP_CONNECTIONS = 4
+DEFAULT_IDLE_TIMEOUT = 1740
+DEFAULT_IDLE_STOP_TIMEOUT = 10
+DEFAULT_RESIZE_WORKERS = 1
+# Smaller batches are resized serially, a pool would cost more than it saves
+MIN_PARALLEL_RESIZE = 4
+DEFAULT_IMAGE_CACHE_FRAMES = 64
+DEFAULT_GIF_OPTIMIZE = False
+DEFAULT_GIF_WEBP = False
+DEFAULT_STATUS_CHECK = False
+# Resized camera images kept per camera
+CAMERA_RENDITIONS = 8
+# Requests up to this width get a still JPEG instead of the animation
+CAMERA_STILL_WIDTH = 360
+
+# Response codes of the selected mailbox compared between refreshes
+MAILBOX_STATE_CODES = ("UIDVALIDITY", "UIDNEXT", "HIGHESTMODSEQ")
+# Untagged responses announcing expunges and flag changes
+MAILBOX_CHANGES = ("EXPUNGE", "VANISHED", "FETCH")
+
+# Header fields needed to classify a message without its body
+HEADER_FIELDS = "BODY.PEEK[HEADER.FIELDS (FROM SUBJECT DATE)]"
+HEADER_PARTS = f"({HEADER_FIELDS})"
+
+# Message parts read by the sensors
+TEXT_TYPES = ["text/html", "text/plain"]
+USPS_MAIL_TYPES = ["text/html", "image/jpeg"]
 
 # Amazon
 AMAZON_DOMAINS = [
@@ -0,0 +1,118 @@
+"""IMAP COMPRESS=DEFLATE (RFC 4978) for Mail and Packages."""
+
+from __future__ import annotations
+
+import imaplib
+import logging
+import zlib
+from typing import Any, Type
+
+from .capabilities import CAPABILITIES
+
+_LOGGER = logging.getLogger(__name__)
+
+CAPABILITY = "COMPRESS=DEFLATE"
+
+# Same limit imaplib puts on a single response line
+MAX_LINE = 1000000
+READ_SIZE = 16384
+
+
+class DeflateTransport:
+    """Raw DEFLATE codec between an imaplib session and its socket.
+
+    Replaces the read, readline and send methods of the session, so
+    every command and response after COMPRESS goes through zlib. Counts
+    the bytes on the wire and after inflating to show the saving.
+    """
+
+    def __init__(self, account: Type[imaplib.IMAP4_SSL]) -> None:
+        """Initialize."""
+        self._file = account.file
+        self._sock = account.sock
+        self._error = account.abort
+        self._deflate = zlib.compressobj(
+            zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS
+        )
+        self._inflate = zlib.decompressobj(-zlib.MAX_WBITS)
+        self._buffer = bytearray()
+        self.received = 0
+        self.inflated = 0
+        self.sent = 0
+        self.deflated = 0
+
+    def install(self, account: Type[imaplib.IMAP4_SSL]) -> None:
+        """Route the session's I/O through this transport."""
+        account.read = self.read
+        account.readline = self.readline
+        account.send = self.send
+        account.compression = self
+
+    def _fill(self) -> None:
+        """Read and inflate whatever the server has sent."""
+        data = self._file.read1(READ_SIZE)
+        if not data:
+            raise self._error("socket error: EOF")
+        self.received += len(data)
+        data = self._inflate.decompress(data)
+        self.inflated += len(data)
+        self._buffer += data
+
+    def read(self, size: int) -> bytes:
+        """Read size bytes."""
+        while len(self._buffer) < size:
+            self._fill()
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def readline(self) -> bytes:
+        """Read a line including its line ending."""
+        while (end := self._buffer.find(b"\n")) == -1:
+            if len(self._buffer) > MAX_LINE:
+                raise self._error(f"got more than {MAX_LINE} bytes")
+            self._fill()
+        return self.read(end + 1)
+
+    def send(self, data: bytes) -> None:
+        """Deflate and send data, flushing so the server can act on it."""
+        self.sent += len(data)
+        data = self._deflate.compress(data) + self._deflate.flush(zlib.Z_SYNC_FLUSH)
+        self.deflated += len(data)
+        self._sock.sendall(data)
+
+    def log(self) -> None:
+        """Log the traffic so far."""
+        _LOGGER.debug(
+            "IMAP compression: received %s bytes as %s, sent %s bytes as %s",
+            self.inflated,
+            self.received,
+            self.sent,
+            self.deflated,
+        )
+
+
+def enable_compression(account: Type[imaplib.IMAP4_SSL]) -> bool:
+    """Negotiate COMPRESS=DEFLATE on a logged in imaplib session.
+
+    Returns True if the session is now compressed
+    """
+    if not CAPABILITIES.server(account).supports(CAPABILITY):
+        _LOGGER.debug("Server does not support %s", CAPABILITY)
+        return False
+    try:
+        (server_response, _) = account.xatom("COMPRESS", "DEFLATE")
+    except Exception as err:
+        _LOGGER.debug("Error enabling compression: %s", str(err))
+        return False
+    if server_response != "OK":
+        return False
+    DeflateTransport(account).install(account)
+    _LOGGER.debug("IMAP compression enabled")
+    return True
+
+
+def log_compression(account: Any) -> None:
+    """Log the traffic of a compressed session."""
+    if isinstance(transport := getattr(account, "compression", None), DeflateTransport):
+        transport.log()
@@ -3,25 +3,26 @@
 from __future__ import annotations
 
 import base64
+import binascii
 import datetime
-import email
 import hashlib
 import imaplib
+import io
 import logging
 import os
-import quopri
+import queue
 import re
 import subprocess  # nosec
+import threading
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timezone
-from email.header import decode_header
-from shutil import copyfile, copytree, which
-from typing import Any, List, Optional, Type, Union
+from shutil import copyfile, copytree, ignore_patterns, which
+from typing import TYPE_CHECKING, Any, Callable, Generator, List, Optional, Type, Union
 
 import aiohttp
-import dateparser
 import homeassistant.helpers.config_validation as cv
-from bs4 import BeautifulSoup
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import (
     CONF_HOST,
@@ -32,43 +33,46 @@ from homeassistant.const import (
 )
 from homeassistant.core import HomeAssistant
 from homeassistant.util import ssl
-from PIL import Image, ImageOps
-
+from PIL import Image, ImageOps, ImageSequence
+
+from . import aioimap, classifier
+from .bodystructure import (
+    body_parts,
+    build_message,
+    parse_fetch_response,
+    plan_sections,
+    response_section,
+)
+from .cache import IMAGE_CACHE, MANIFEST_FILE, ImageCache, MessageCache, RefreshCache
+from .capabilities import CAPABILITIES, QUIRK_PARTIAL_FETCH, QUIRK_UTF8_SEARCH, refused
+from .commands import Command, async_run, command, run, sequence
 from .const import (
     AMAZON_DELIVERED,
     AMAZON_DELIVERED_SUBJECT,
     AMAZON_EXCEPTION,
     AMAZON_EXCEPTION_ORDER,
-    AMAZON_EXCEPTION_SUBJECT,
     AMAZON_HUB,
-    AMAZON_HUB_BODY,
     AMAZON_HUB_CODE,
     AMAZON_HUB_EMAIL,
     AMAZON_HUB_SUBJECT,
-    AMAZON_HUB_SUBJECT_SEARCH,
-    AMAZON_IMG_PATTERN,
     AMAZON_ORDER,
     AMAZON_OTP,
-    AMAZON_OTP_REGEX,
     AMAZON_OTP_SUBJECT,
     AMAZON_PACKAGES,
-    AMAZON_PATTERN,
     AMAZON_SHIPMENT_TRACKING,
-    AMAZON_TIME_PATTERN,
     AMAZON_TIME_PATTERN_END,
     ATTR_AMAZON_IMAGE,
-    ATTR_BODY,
     ATTR_CODE,
     ATTR_COUNT,
     ATTR_EMAIL,
     ATTR_IMAGE_NAME,
     ATTR_IMAGE_PATH,
     ATTR_ORDER,
-    ATTR_PATTERN,
     ATTR_SUBJECT,
     ATTR_TRACKING,
     ATTR_USPS_MAIL,
     BINARY_SENSORS,
+    CAMERA_STILL_WIDTH,
     CONF_ALLOW_EXTERNAL,
     CONF_AMAZON_DAYS,
     CONF_AMAZON_DOMAIN,
@@ -78,15 +82,50 @@ from .const import (
     CONF_DURATION,
     CONF_FOLDER,
     CONF_GENERATE_MP4,
+    CONF_GIF_OPTIMIZE,
+    CONF_GIF_WEBP,
+    CONF_IMAP_COMPRESS,
+    CONF_IMAP_CONNECTIONS,
     CONF_IMAP_SECURITY,
+    CONF_IMAP_TIMEOUT,
+    CONF_RESIZE_WORKERS,
     CONF_STORAGE,
     CONF_VERIFY_SSL,
     DEFAULT_AMAZON_DAYS,
+    DEFAULT_FETCH_CHUNK_SIZE,
+    DEFAULT_GIF_OPTIMIZE,
+    DEFAULT_GIF_WEBP,
+    DEFAULT_IMAP_COMPRESS,
+    DEFAULT_IMAP_CONNECTIONS,
+    DEFAULT_IMAP_TIMEOUT,
+    DEFAULT_RESIZE_WORKERS,
+    DOMAIN,
+    HEADER_FIELDS,
+    HEADER_PARTS,
+    MAILBOX_CHANGES,
+    MAILBOX_STATE_CODES,
+    MAX_IMAP_CONNECTIONS,
+    MIN_PARALLEL_RESIZE,
     OVERLAY,
     SENSOR_DATA,
     SENSOR_TYPES,
     SHIPPERS,
+    TEXT_TYPES,
+    USPS_MAIL_TYPES,
+)
+from .deflate import enable_compression, log_compression
+from .matchers import (
+    AMAZON_IMG_RE,
+    FETCH_NO_DATA_RE,
+    NO_MAILPIECES_RE,
+    compile_pattern,
+    scan_mailpieces,
 )
+from .mime import LazyMessage
+from .transcode import Mp4Queue, get_mp4_queue
+
+if TYPE_CHECKING:
+    from .connection import MailConnection
 
 NO_SSL = "Email will be accessed without encryption using this method and is not recommended."
 _LOGGER = logging.getLogger(__name__)
@@ -181,33 +220,304 @@ def default_image_path(
     return "custom_components/mail_and_packages/images/"
 
 
-def process_emails(hass: HomeAssistant, config: ConfigEntry) -> dict:
+def process_emails(
+    hass: HomeAssistant,
+    config: ConfigEntry,
+    connection: MailConnection = None,
+    cache: MessageCache = None,
+    refresh: RefreshCache = None,
+) -> dict:
     """Process emails and return value.
 
+    Uses the persistent session from connection when given, otherwise
+    logs in for this refresh only. Messages already in cache are not
+    fetched again. With refresh, the previous data is returned when the
+    mailbox state and the day have not changed since it was read. The
+    NOOP reading the state then also serves as the liveness check of a
+    held session, so an idle poll costs a single command.
+
     Returns dict containing sensor data
     """
-    host = config.get(CONF_HOST)
-    port = config.get(CONF_PORT)
-    user = config.get(CONF_USERNAME)
-    pwd = config.get(CONF_PASSWORD)
-    folder = config.get(CONF_FOLDER)
-    resources = config.get(CONF_RESOURCES)
-    imap_security = config.get(CONF_IMAP_SECURITY)
-    verify_ssl = config.get(CONF_VERIFY_SSL)
+    if connection is not None:
+        probed = []
 
-    # Create the dict container
-    data = {}
+        def probe(account: Any) -> bool:
+            probed.append(folder_status(account))
+            return probed[-1] is not None
+
+        with connection.session(probe if refresh is not None else None) as account:
+            # Do not process if account returns false
+            if not account:
+                return {}
+            try:
+                return run(
+                    account,
+                    _refresh_account(
+                        hass,
+                        config,
+                        account,
+                        cache,
+                        connection.open,
+                        refresh,
+                        probed[-1] if probed else None,
+                    ),
+                )
+            finally:
+                log_compression(account)
 
     # Login to email server and select the folder
-    account = login(host, port, user, pwd, imap_security, verify_ssl)
+    account = open_account(config)
 
     # Do not process if account returns false
     if not account:
+        return {}
+
+    try:
+        return run(
+            account, _refresh_account(hass, config, account, cache, None, refresh)
+        )
+    finally:
+        logout(account)
+
+
+async def async_process_emails(
+    hass: HomeAssistant,
+    config: ConfigEntry,
+    connection: MailConnection,
+    cache: MessageCache = None,
+    refresh: RefreshCache = None,
+) -> dict:
+    """Process emails with the asyncio transport, like process_emails.
+
+    IMAP commands are awaited on the event loop and only the work between
+    them runs in the executor, so no thread waits on the server. Sensor
+    groups are not fetched over extra connections, the classifier already
+    reads every sensor in one pass.
+
+    Returns dict containing sensor data
+    """
+    probed = []
+
+    async def probe(client: aioimap.AsyncIMAP) -> bool:
+        probed.append(await async_run(client, folder_status.steps(client)))
+        return probed[-1] is not None
+
+    async with connection.async_session(
+        probe if refresh is not None else None
+    ) as client:
+        # Do not process if account returns false
+        if not client:
+            return {}
+        return await async_run(
+            client,
+            _refresh_account(
+                hass,
+                config,
+                client,
+                cache,
+                None,
+                refresh,
+                probed[-1] if probed else None,
+            ),
+        )
+
+
+def process_sensors(
+    hass: HomeAssistant,
+    config: ConfigEntry,
+    connection: MailConnection,
+    sensors: list,
+    data: dict,
+) -> dict:
+    """Refresh only sensors and merge them into the data of the last refresh.
+
+    Neither the message cache nor the refresh cache is used, both describe
+    the searches of every sensor. Package totals are added up again from
+    the merged data and the image names are kept unless their sensor was
+    refreshed.
+
+    Returns dict containing sensor data
+    """
+    found = process_emails(hass, _sensor_config(config, sensors), connection)
+    return _merge_sensors(sensors, data, found)
+
+
+async def async_process_sensors(
+    hass: HomeAssistant,
+    config: ConfigEntry,
+    connection: MailConnection,
+    sensors: list,
+    data: dict,
+) -> dict:
+    """Refresh only sensors with the asyncio transport, like process_sensors.
+
+    Returns dict containing sensor data
+    """
+    found = await async_process_emails(
+        hass, _sensor_config(config, sensors), connection
+    )
+    return _merge_sensors(sensors, data, found)
+
+
+def _sensor_config(config: ConfigEntry, sensors: list) -> dict:
+    """Return config limited to the sensors read from the mailbox."""
+    resources = [sensor for sensor in sensors if not sensor.startswith("zpackages_")]
+    return {**config, CONF_RESOURCES: resources}
+
+
+def _merge_sensors(sensors: list, data: dict, found: dict) -> dict:
+    """Merge the refreshed sensors into the data of the last refresh."""
+    if not found:
+        return {}
+    if ATTR_USPS_MAIL not in sensors:
+        found.pop(ATTR_IMAGE_NAME, None)
+    if AMAZON_DELIVERED not in sensors:
+        found.pop(ATTR_AMAZON_IMAGE, None)
+
+    data = {**data, **found}
+    if "zpackages_delivered" in sensors:
+        data["zpackages_delivered"] = package_total(data, "delivered")
+    if "zpackages_transit" in sensors:
+        data["zpackages_transit"] = max(0, package_total(data, "delivering"))
+    return data
+
+
+@sequence
+def folder_status(account: Any) -> Optional[dict]:
+    """Return the state of the selected mailbox compared between refreshes.
+
+    STATUS is not reliable for the selected mailbox (RFC 3501 6.3.10),
+    some servers answer it from stale counts. NOOP is sent instead, which
+    is also the liveness check of a held session, and the state reported
+    on select is brought up to date from the untagged responses since:
+    EXISTS for the message count and a running count of expunges and
+    flag changes. UIDNEXT and HIGHESTMODSEQ stay those of the select
+    unless the server reports newer ones.
+
+    Returns dict of MESSAGES, UIDVALIDITY, UIDNEXT, HIGHESTMODSEQ and
+    CHANGES as known, or None on error
+    """
+    try:
+        (server_response, _) = yield command("noop")
+    except Exception as err:
+        _LOGGER.debug("IMAP NOOP failed: %s", str(err))
+        return None
+    if server_response != "OK":
+        return None
+    state = getattr(account, "mailbox_state", None)
+    state = _mailbox_updates(account, state if isinstance(state, dict) else {})
+    account.mailbox_state = state
+    _LOGGER.debug("Mailbox state: %s", state)
+    return dict(state)
+
+
+def _mailbox_updates(account: Any, state: dict) -> dict:
+    """Apply the untagged responses received since the last call to state."""
+    for code in MAILBOX_STATE_CODES:
+        if values := _untagged_numbers(account, code):
+            state[code] = values[-1]
+    if values := _untagged_numbers(account, "EXISTS"):
+        state["MESSAGES"] = values[-1]
+    if changes := sum(len(_untagged(account, name)) for name in MAILBOX_CHANGES):
+        state["CHANGES"] = state.get("CHANGES", 0) + changes
+    return state
+
+
+def _untagged(account: Any, name: str) -> list:
+    """Return and forget the untagged responses called name."""
+    try:
+        (_, data) = account.response(name)
+    except Exception as err:
+        _LOGGER.debug("Error reading %s responses: %s", name, str(err))
+        return []
+    return [value for value in data or [] if value is not None]
+
+
+def _untagged_numbers(account: Any, name: str) -> list:
+    """Return and forget the numbers of the untagged responses called name."""
+    return [
+        int(value)
+        for value in _untagged(account, name)
+        if isinstance(value, bytes) and value.strip().isdigit()
+    ]
+
+
+def _refresh_account(
+    hass: HomeAssistant,
+    config: ConfigEntry,
+    account: Any,
+    cache: Optional[MessageCache],
+    opener: Optional[Callable[[], Any]],
+    refresh: Optional[RefreshCache],
+    status: Optional[dict] = None,
+) -> Generator:
+    """Process the account unless the previous refresh is still current."""
+    if refresh is None:
+        return (yield from _process_account(hass, config, account, cache, opener))
+
+    if status is None:
+        status = yield from folder_status.steps(account)
+    day = get_formatted_date()
+    if status and (data := refresh.get(status, day)) is not None:
+        _LOGGER.debug("Mailbox unchanged since the last refresh, reusing its data")
+        # Neither depends on the mailbox
+        if "mail_updated" in config.get(CONF_RESOURCES):
+            data["mail_updated"] = update_time()
+        if config.get(CONF_ALLOW_EXTERNAL):
+            copy_images(hass, config)
         return data
 
-    if not selectfolder(account, folder):
+    data = yield from _process_account(hass, config, account, cache, opener)
+    if status:
+        # Mail arriving during the searches changes the status again,
+        # so recording the status read before them is always safe
+        refresh.record(status, day, data)
+    else:
+        refresh.clear()
+    return data
+
+
+def open_account(config: ConfigEntry) -> Any:
+    """Login and select the configured folder.
+
+    Returns account object or False
+    """
+    account = login(
+        config.get(CONF_HOST),
+        config.get(CONF_PORT),
+        config.get(CONF_USERNAME),
+        config.get(CONF_PASSWORD),
+        config.get(CONF_IMAP_SECURITY),
+        config.get(CONF_VERIFY_SSL),
+        config.get(CONF_IMAP_COMPRESS, DEFAULT_IMAP_COMPRESS),
+        config.get(CONF_IMAP_TIMEOUT) or DEFAULT_IMAP_TIMEOUT,
+    )
+    if not account:
+        return False
+    if not selectfolder(account, config.get(CONF_FOLDER)):
         # Bail out on error
-        return data
+        logout(account)
+        return False
+    return account
+
+
+def _process_account(
+    hass: HomeAssistant,
+    config: ConfigEntry,
+    account: Any,
+    cache: MessageCache = None,
+    opener: Callable[[], Any] = None,
+) -> Generator:
+    """Update all sensors using a logged in account.
+
+    opener returns an extra session for parallel fetching.
+
+    Returns dict containing sensor data
+    """
+    resources = config.get(CONF_RESOURCES)
+
+    # Create the dict container
+    data = {}
 
     # Create image file name dict container
     _image = {}
@@ -227,12 +537,47 @@ def process_emails(hass: HomeAssistant, config: ConfigEntry) -> dict:
     _image[ATTR_IMAGE_PATH] = image_path
     data.update(_image)
 
+    # Classify today's emails in a single pass for the sensors that support it
+    try:
+        data.update(
+            (
+                yield from classifier.classify_emails.steps(
+                    account, config, resources, cache
+                )
+            )
+        )
+    except Exception as err:
+        _LOGGER.error("Error classifying emails: %s", err)
+
+    if isinstance(account, aioimap.AsyncIMAP):
+        groups, dependent = sensor_groups(resources)
+        for sensor in [sensor for group in groups for sensor in group] + dependent:
+            yield from _fetch_async_sensor(hass, config, account, data, sensor)
+        if config.get(CONF_ALLOW_EXTERNAL):
+            copy_images(hass, config)
+        return data
+
+    connections = min(
+        config.get(CONF_IMAP_CONNECTIONS, DEFAULT_IMAP_CONNECTIONS),
+        MAX_IMAP_CONNECTIONS,
+    )
+    if connections > 1:
+        groups, dependent = sensor_groups(resources)
+        fetch_parallel(
+            hass,
+            config,
+            account,
+            data,
+            groups,
+            connections,
+            opener or (lambda: open_account(config)),
+        )
+    else:
+        dependent = resources
+
     # Only update sensors we're intrested in
-    for sensor in resources:
-        try:
-            fetch(hass, config, account, data, sensor)
-        except Exception as err:
-            _LOGGER.error("Error updating sensor: %s reason: %s", sensor, err)
+    for sensor in dependent:
+        _fetch_sensor(hass, config, account, data, sensor)
 
     # Copy image file to www directory if enabled
     if config.get(CONF_ALLOW_EXTERNAL):
@@ -241,6 +586,134 @@ def process_emails(hass: HomeAssistant, config: ConfigEntry) -> dict:
     return data
 
 
+def _fetch_sensor(
+    hass: HomeAssistant, config: ConfigEntry, account: Any, data: dict, sensor: str
+) -> None:
+    """Fetch a single sensor, logging any error."""
+    try:
+        fetch(hass, config, account, data, sensor)
+    except Exception as err:
+        _LOGGER.error("Error updating sensor: %s reason: %s", sensor, err)
+
+
+def _fetch_async_sensor(
+    hass: HomeAssistant, config: ConfigEntry, account: Any, data: dict, sensor: str
+) -> Generator:
+    """Fetch a single sensor with the asyncio transport, logging any error.
+
+    Only the mail images search the mailbox outside the classifier. A
+    classified sensor missing after an error is left out, the searches
+    fetch() falls back to need a blocking session.
+    """
+    try:
+        if sensor == ATTR_USPS_MAIL:
+            messages = yield from informed_delivery_mail(account)
+            options = mail_image_options(hass, config, data[ATTR_IMAGE_NAME])
+            data[sensor] = 0 if messages is None else mail_image(messages, **options)
+        elif sensor == AMAZON_DELIVERED:
+            data[sensor] = yield from amazon_search.steps(
+                account,
+                f"{hass.config.path()}/{default_image_path(hass, config)}",
+                hass,
+                data[ATTR_AMAZON_IMAGE],
+                config.get(CONF_AMAZON_DOMAIN) or None,
+                cv.ensure_list_csv(config.get(CONF_AMAZON_FWDS)),
+            )
+        elif sensor in data or not classifier.MessageClassifier.handles(sensor):
+            fetch(hass, config, account, data, sensor)
+            return
+        else:
+            _LOGGER.debug("Sensor %s was not classified, leaving it out", sensor)
+            return
+        _LOGGER.debug("Sensor: %s Count: %s", sensor, str(data[sensor]))
+    except Exception as err:
+        _LOGGER.error("Error updating sensor: %s reason: %s", sensor, err)
+
+
+def sensor_groups(resources: list) -> tuple:
+    """Split sensors into groups that can be fetched independently.
+
+    Each carrier family is a group, since fetch() only resolves
+    dependencies within a family. Totals across every carrier need the
+    other groups' results first.
+
+    Returns tuple of (list of groups, list of dependent sensors)
+    """
+    groups = {}
+    dependent = []
+    for sensor in resources:
+        if sensor.startswith("zpackages_") or sensor == "mail_updated":
+            dependent.append(sensor)
+            continue
+        family = "amazon" if sensor.startswith("amazon_") else sensor.rsplit("_", 1)[0]
+        groups.setdefault(family, []).append(sensor)
+    return list(groups.values()), dependent
+
+
+def fetch_parallel(
+    hass: HomeAssistant,
+    config: ConfigEntry,
+    account: Any,
+    data: dict,
+    groups: list,
+    connections: int,
+    opener: Callable[[], Any],
+) -> None:
+    """Fetch sensor groups concurrently over a bounded pool of sessions.
+
+    IMAP sessions can't interleave commands, so each worker borrows its
+    own session. Extra sessions are opened on demand, up to connections
+    in total, and logged out afterwards.
+    """
+    idle = queue.SimpleQueue()
+    idle.put(account)
+    opened = []
+    slots = threading.Semaphore(connections - 1)
+
+    def borrow() -> Any:
+        try:
+            return idle.get_nowait()
+        except queue.Empty:
+            pass
+        if slots.acquire(blocking=False):
+            session = False
+            try:
+                session = opener()
+            except Exception as err:
+                _LOGGER.debug("Unable to open another IMAP session: %s", str(err))
+            finally:
+                if not session:
+                    # Leave the slot to a later worker
+                    slots.release()
+            if session:
+                opened.append(session)
+                return session
+        # Wait for a session to be returned instead
+        return idle.get()
+
+    def run(group: list) -> dict:
+        session = borrow()
+        results = dict(data)
+        try:
+            for sensor in group:
+                _fetch_sensor(hass, config, session, results, sensor)
+        finally:
+            idle.put(session)
+        return results
+
+    if not groups:
+        return
+    workers = min(connections, len(groups))
+    _LOGGER.debug("Fetching %s sensor groups with %s workers", len(groups), workers)
+    try:
+        with ThreadPoolExecutor(workers, f"{DOMAIN}_fetch") as pool:
+            for results in pool.map(run, groups):
+                data.update(results)
+    finally:
+        for session in opened:
+            logout(session)
+
+
 def copy_images(hass: HomeAssistant, config: ConfigEntry) -> None:
     """Copy images to www directory if enabled."""
     paths = []
@@ -264,7 +737,8 @@ def copy_images(hass: HomeAssistant, config: ConfigEntry) -> None:
         cleanup_images(path)
 
     try:
-        copytree(src, dst, dirs_exist_ok=True)
+        # The image manifest is internal, only the images are published
+        copytree(src, dst, dirs_exist_ok=True, ignore=ignore_patterns(MANIFEST_FILE))
     except Exception as err:
         _LOGGER.error(
             "Problem copying files from %s to %s error returned: %s", src, dst, err
@@ -339,7 +813,10 @@ def image_file_name(
         image_name = f"{str(uuid.uuid4())}{ext}"
     _LOGGER.debug("Image Name: %s", image_name)
 
-    # Insert place holder image
+    # Insert place holder image, unless the image of today's mail is kept
+    if IMAGE_CACHE.owns(os.path.join(path, image_name)):
+        _LOGGER.debug("Keeping %s", os.path.join(path, image_name))
+        return image_name
     _LOGGER.debug("Copying %s to %s", mail_none, os.path.join(path, image_name))
 
     copyfile(mail_none, os.path.join(path, image_name))
@@ -379,17 +856,11 @@ def fetch(
         return data[sensor]
 
     img_out_path = f"{hass.config.path()}/{default_image_path(hass, config)}"
-    gif_duration = config.get(CONF_DURATION)
-    generate_mp4 = config.get(CONF_GENERATE_MP4)
     amazon_fwds = cv.ensure_list_csv(config.get(CONF_AMAZON_FWDS))
-    image_name = data[ATTR_IMAGE_NAME]
     amazon_image_name = data[ATTR_AMAZON_IMAGE]
     amazon_days = config.get(CONF_AMAZON_DAYS)
 
     # Conditional variables
-    nomail = (
-        config.get(CONF_CUSTOM_IMG_FILE) if config.get(CONF_CUSTOM_IMG_FILE) else None
-    )
     amazon_domain = (
         config.get(CONF_AMAZON_DOMAIN) if config.get(CONF_AMAZON_DOMAIN) else None
     )
@@ -398,12 +869,7 @@ def fetch(
 
     if sensor == "usps_mail":
         count[sensor] = get_mails(
-            account,
-            img_out_path,
-            gif_duration,
-            image_name,
-            generate_mp4,
-            nomail,
+            account, **mail_image_options(hass, config, data[ATTR_IMAGE_NAME])
         )
     elif sensor == AMAZON_PACKAGES:
         count[sensor] = get_items(
@@ -442,18 +908,9 @@ def fetch(
         count[sensor] = max(0, info[ATTR_COUNT] - delivered)
         count[f"{prefix}_tracking"] = info[ATTR_TRACKING]
     elif sensor == "zpackages_delivered":
-        count[sensor] = 0  # initialize the variable
-        for shipper in SHIPPERS:
-            delivered = f"{shipper}_delivered"
-            if delivered in data and delivered != sensor:
-                count[sensor] += fetch(hass, config, account, data, delivered)
+        count[sensor] = package_total(data, "delivered")
     elif sensor == "zpackages_transit":
-        total = 0
-        for shipper in SHIPPERS:
-            delivering = f"{shipper}_delivering"
-            if delivering in data and delivering != sensor:
-                total += fetch(hass, config, account, data, delivering)
-        count[sensor] = max(0, total)
+        count[sensor] = max(0, package_total(data, "delivering"))
     elif sensor == "mail_updated":
         count[sensor] = update_time()
     else:
@@ -473,11 +930,53 @@ def fetch(
     return count[sensor]
 
 
+def mail_image_options(
+    hass: HomeAssistant, config: ConfigEntry, image_name: str
+) -> dict:
+    """Return the arguments of get_mails and mail_image set by config."""
+    generate_mp4 = config.get(CONF_GENERATE_MP4)
+    return {
+        "image_output_path": f"{hass.config.path()}/{default_image_path(hass, config)}",
+        "gif_duration": config.get(CONF_DURATION),
+        "image_name": image_name,
+        "gen_mp4": generate_mp4,
+        "custom_img": config.get(CONF_CUSTOM_IMG_FILE) or None,
+        "resize_workers": config.get(CONF_RESIZE_WORKERS, DEFAULT_RESIZE_WORKERS),
+        "image_cache": IMAGE_CACHE,
+        "mp4_queue": get_mp4_queue(hass) if generate_mp4 else None,
+        "gif_optimize": config.get(CONF_GIF_OPTIMIZE, DEFAULT_GIF_OPTIMIZE),
+        "gif_webp": config.get(CONF_GIF_WEBP, DEFAULT_GIF_WEBP),
+    }
+
+
+def package_total(data: dict, suffix: str) -> int:
+    """Add up the sensors of every shipper ending in suffix found in data.
+
+    Returns integer total
+    """
+    return sum(
+        data[f"{shipper}_{suffix}"]
+        for shipper in SHIPPERS
+        if f"{shipper}_{suffix}" in data and shipper != "zpackages"
+    )
+
+
 def login(
-    host: str, port: int, user: str, pwd: str, security: str, verify: bool = True
+    host: str,
+    port: int,
+    user: str,
+    pwd: str,
+    security: str,
+    verify: bool = True,
+    compress: bool = False,
+    timeout: Optional[float] = None,
 ) -> Union[bool, Type[imaplib.IMAP4_SSL]]:
     """Login to IMAP server.
 
+    With compress, COMPRESS=DEFLATE is negotiated if the server offers it.
+    timeout bounds every socket operation, so a dropped connection fails
+    instead of blocking until TCP gives up.
+
     Returns account object
     """
     try:
@@ -486,16 +985,18 @@ def login(
                 context = ssl.client_context_no_verify()
             else:
                 context = ssl.client_context()
-            account = imaplib.IMAP4_SSL(host=host, port=port, ssl_context=context)
+            account = imaplib.IMAP4_SSL(
+                host=host, port=port, ssl_context=context, timeout=timeout
+            )
         elif security == "startTLS":
             if not verify:
                 context = ssl.client_context_no_verify()
             else:
                 context = ssl.client_context()
-            account = imaplib.IMAP4(host=host, port=port)
+            account = imaplib.IMAP4(host=host, port=port, timeout=timeout)
             account.starttls(context)
         else:
-            account = imaplib.IMAP4(host=host, port=port)
+            account = imaplib.IMAP4(host=host, port=port, timeout=timeout)
 
     except Exception as err:
         _LOGGER.error("Network error while connecting to server: %s", str(err))
@@ -508,24 +1009,121 @@ def login(
         _LOGGER.error("Error logging into IMAP Server: %s", str(err))
         return False
 
+    # Users of one server are told apart by the capability cache
+    account.user = user
+    CAPABILITIES.probe(account)
+    if compress:
+        enable_compression(account)
+
     return account
 
 
+def logout(account: Type[imaplib.IMAP4_SSL]) -> None:
+    """Logout of the IMAP server, ignoring errors."""
+    log_compression(account)
+    try:
+        account.logout()
+    except Exception as err:
+        _LOGGER.debug("Error logging out of IMAP Server: %s", str(err))
+
+
+@sequence
 def selectfolder(account: Type[imaplib.IMAP4_SSL], folder: str) -> bool:
     """Select folder inside the mailbox."""
     try:
-        account.list()
+        yield command("list")
     except Exception as err:
         _LOGGER.error("Error listing folders: %s", str(err))
         return False
+    server = CAPABILITIES.server(account)
+    if server.supports("QRESYNC") and server.enabled.get("QRESYNC") is not False:
+        # Must be enabled before selecting to report expunged UIDs
+        try:
+            (server_response, _) = yield command("enable", "QRESYNC")
+        except Exception as err:
+            _LOGGER.debug("Error enabling QRESYNC: %s", str(err))
+            if refused(err):
+                CAPABILITIES.record_enabled(account, "QRESYNC", False)
+        else:
+            CAPABILITIES.record_enabled(account, "QRESYNC", server_response == "OK")
     try:
-        account.select(folder, readonly=True)
+        value = yield command("select", folder, True)
     except Exception as err:
         _LOGGER.error("Error selecting folder: %s", str(err))
         return False
+    # The state folder_status keeps up to date
+    state = {}
+    if isinstance(value, tuple) and len(value) == 2 and value[0] == "OK":
+        data = value[1]
+        if data and isinstance(data[-1], bytes) and data[-1].strip().isdigit():
+            state["MESSAGES"] = int(data[-1])
+    account.mailbox_state = _mailbox_updates(account, state)
     return True
 
 
+def has_capability(account: Type[imaplib.IMAP4_SSL], name: str) -> bool:
+    """Return True if the server advertised the capability name."""
+    return CAPABILITIES.server(account).supports(name)
+
+
+@sequence
+def vanished_since(
+    account: Type[imaplib.IMAP4_SSL], uids: list, modseq: int
+) -> Optional[set]:
+    """Return which of uids were expunged since modseq.
+
+    Needs QRESYNC to have been enabled before the folder was selected.
+    Returns set of expunged uids or None on error
+    """
+    if not uids:
+        return set()
+    # Drop VANISHED responses left over from earlier commands
+    account.response("VANISHED")
+    try:
+        (server_response, _) = yield command(
+            "uid",
+            "FETCH",
+            sequence_set(uids),
+            f"(UID) (CHANGEDSINCE {modseq} VANISHED)",
+        )
+    except Exception as err:
+        _LOGGER.debug("Error fetching expunged messages: %s", str(err))
+        return None
+    if server_response != "OK":
+        return None
+
+    ranges = []
+    for data in account.response("VANISHED")[1]:
+        if not isinstance(data, bytes):
+            continue
+        for item in data.replace(b"(EARLIER)", b"").strip().split(b","):
+            start, _, end = item.partition(b":")
+            if start.isdigit() and (not end or end.isdigit()):
+                ranges.append(sorted((int(start), int(end or start))))
+    vanished = {
+        uid for uid in uids if any(low <= int(uid) <= high for low, high in ranges)
+    }
+    _LOGGER.debug("%s messages expunged since MODSEQ %s", len(vanished), modseq)
+    return vanished
+
+
+@sequence
+def uids_since(account: Type[imaplib.IMAP4_SSL], first: int) -> Optional[list]:
+    """Return the UIDs of every message from UID first on.
+
+    Returns list of uids or None on error
+    """
+    try:
+        (server_response, data) = yield command("uid", "SEARCH", None, f"UID {first}:*")
+    except Exception as err:
+        _LOGGER.debug("Error searching new messages: %s", str(err))
+        return None
+    if server_response != "OK":
+        return None
+    # n:* always matches the last message, even when its UID is below n
+    return [uid.decode() for uid in (data[0] or b"").split() if int(uid) >= first]
+
+
 def get_formatted_date() -> str:
     """Return today in specific format.
 
@@ -597,6 +1195,7 @@ def build_search(address: list, date: str, subject: str = None) -> tuple:
     return (utf8_flag, imap_search)
 
 
+@sequence
 def email_search(
     account: Type[imaplib.IMAP4_SSL], address: list, date: str, subject: str = None
 ) -> tuple:
@@ -607,19 +1206,27 @@ def email_search(
     utf8_flag, search = build_search(address, date, subject)
     value = ("", [""])
 
-    if utf8_flag:
+    if utf8_flag and CAPABILITIES.server(account).utf8_search is False:
+        _LOGGER.debug("Server does not support searching with unicode characters")
+        value = "BAD", [b""]
+    elif utf8_flag:
         subject = subject.encode("utf-8")
         account.literal = subject
         try:
-            value = account.search("utf-8", search)
+            value = yield command("search", "utf-8", search)
         except Exception as err:
             _LOGGER.debug(
                 "Error searching emails with unicode characters: %s", str(err)
             )
+            if refused(err):
+                CAPABILITIES.learn(account, QUIRK_UTF8_SEARCH, False)
             value = "BAD", err.args[0]
+        else:
+            if value[0] == "OK":
+                CAPABILITIES.learn(account, QUIRK_UTF8_SEARCH, True)
     else:
         try:
-            value = account.search(None, search)
+            value = yield command("search", None, search)
         except Exception as err:
             _LOGGER.error("Error searching emails: %s", str(err))
             value = "BAD", err.args[0]
@@ -634,19 +1241,19 @@ def email_search(
     return value
 
 
+@sequence
 def email_fetch(
-    account: Type[imaplib.IMAP4_SSL], num: int, parts: str = "(RFC822)"
+    account: Type[imaplib.IMAP4_SSL],
+    num: int,
+    parts: str = "(RFC822)",
+    uid: bool = False,
 ) -> tuple:
     """Download specified email for parsing.
 
     Returns tuple
     """
-    # iCloud doesn't support RFC822 so override the 'message parts'
-    if account.host == "imap.mail.me.com":
-        parts = "BODY[]"
-
     try:
-        value = account.fetch(num, parts)
+        value = yield from _fetch(account, num, parts, uid)
     except Exception as err:
         _LOGGER.error("Error fetching emails: %s", str(err))
         value = "BAD", err.args[0]
@@ -654,6 +1261,254 @@ def email_fetch(
     return value
 
 
+def partial_fetch(account: Type[imaplib.IMAP4_SSL]) -> bool:
+    """Return True if the server can fetch parts of a message."""
+    return CAPABILITIES.server(account).partial_fetch
+
+
+def _fetch(
+    account: Type[imaplib.IMAP4_SSL], message_set: str, parts: str, uid: bool
+) -> Generator:
+    """Run FETCH with message parts this server answers.
+
+    Some servers (iCloud) only return messages for BODY[] and answer
+    anything else with bare message ids. The first time that happens the
+    FETCH is repeated with BODY[] and the quirk is kept for the host.
+    """
+    server = CAPABILITIES.server(account)
+    if not server.partial_fetch:
+        parts = "BODY[]"
+    value = yield _fetch_command(message_set, parts, uid)
+    if parts == "BODY[]" or QUIRK_PARTIAL_FETCH in server.quirks:
+        return value
+    if _fetched(value):
+        CAPABILITIES.learn(account, QUIRK_PARTIAL_FETCH, True)
+    elif _fetched_ids(value):
+        retry = yield _fetch_command(message_set, "BODY[]", uid)
+        if _fetched(retry):
+            CAPABILITIES.learn(account, QUIRK_PARTIAL_FETCH, False)
+            return retry
+    return value
+
+
+def _fetch_command(message_set: str, parts: str, uid: bool) -> Command:
+    """Return a single FETCH or UID FETCH."""
+    if uid:
+        return command("uid", "FETCH", message_set, parts)
+    return command("fetch", message_set, parts)
+
+
+def _fetched(value: Any) -> bool:
+    """Return True if a FETCH succeeded with message data."""
+    if not isinstance(value, tuple) or len(value) != 2 or value[0] != "OK":
+        return False
+    return any(isinstance(part, tuple) for part in value[1] or [])
+
+
+def _fetched_ids(value: Any) -> bool:
+    """Return True if a FETCH succeeded with message ids but no data."""
+    if not isinstance(value, tuple) or len(value) != 2 or value[0] != "OK":
+        return False
+    return any(
+        isinstance(part, bytes) and FETCH_NO_DATA_RE.match(part)
+        for part in value[1] or []
+    )
+
+
+def sequence_set(ids: list) -> str:
+    """Build an IMAP sequence set such as 1,5,9:12 from message ids.
+
+    Returns sequence set as string
+    """
+    numbers = sorted({int(num) for num in ids})
+    ranges = []
+    for num in numbers:
+        if ranges and num == ranges[-1][1] + 1:
+            ranges[-1][1] = num
+        else:
+            ranges.append([num, num])
+    return ",".join(
+        str(start) if start == end else f"{start}:{end}" for start, end in ranges
+    )
+
+
+@sequence
+def email_fetch_batch(
+    account: Type[imaplib.IMAP4_SSL],
+    ids: list,
+    parts: str = "(RFC822)",
+    uid: bool = False,
+    chunk_size: int = DEFAULT_FETCH_CHUNK_SIZE,
+) -> List[tuple]:
+    """Download several emails with one FETCH command per chunk.
+
+    Returns list of tuples of the requested id and response part
+    """
+    ids = list(dict.fromkeys(ids))
+    found = []
+
+    for index in range(0, len(ids), chunk_size):
+        chunk = ids[index : index + chunk_size]
+        lookup = {int(num): num for num in chunk}
+        message_set = sequence_set(chunk)
+        _LOGGER.debug("Fetching %s emails: %s", len(chunk), message_set)
+
+        try:
+            (server_response, data) = yield from _fetch(
+                account, message_set, parts, uid
+            )
+        except Exception as err:
+            _LOGGER.error("Error fetching emails: %s", str(err))
+            return found
+        if server_response != "OK":
+            _LOGGER.error("Error fetching emails: %s", server_response)
+            return found
+
+        # Responses come back in sequence order, which is also UID order
+        ordered = sorted(chunk, key=int)
+        current = None
+        position = 0
+        for response_part in data:
+            if not isinstance(response_part, tuple):
+                continue
+            header = response_part[0] if isinstance(response_part[0], bytes) else b""
+            match = re.match(rb"(\d+) \((?:.*\bUID (\d+))?", header)
+            number = match.group(2 if uid else 1) if match else None
+            if number is not None:
+                current = lookup.get(int(number), number.decode())
+            elif match or not header or current is None:
+                # No usable id in the response, fall back to its position
+                if position >= len(ordered):
+                    break
+                current = ordered[position]
+            else:
+                # Another literal for the same message
+                found.append((current, response_part))
+                continue
+            position += 1
+            found.append((current, response_part))
+    return found
+
+
+def _plan_sections(
+    account: Type[imaplib.IMAP4_SSL],
+    ids: list,
+    content_types: list,
+    uid: bool,
+    chunk_size: int,
+) -> Generator:
+    """Read BODYSTRUCTURE to find the parts of each email to download.
+
+    Returns dict of body parts by id, emails that could not be planned are left out
+    """
+    plans = {}
+    for index in range(0, len(ids), chunk_size):
+        chunk = ids[index : index + chunk_size]
+        lookup = {int(num): num for num in chunk}
+        message_set = sequence_set(chunk)
+        try:
+            if uid:
+                (server_response, data) = yield command(
+                    "uid", "FETCH", message_set, "(UID BODYSTRUCTURE)"
+                )
+            else:
+                (server_response, data) = yield command(
+                    "fetch", message_set, "(BODYSTRUCTURE)"
+                )
+            if server_response != "OK":
+                continue
+            messages = parse_fetch_response(data)
+        except Exception as err:
+            _LOGGER.debug("Unable to read BODYSTRUCTURE: %s", str(err))
+            continue
+
+        for number, items in messages.items():
+            key = int(items.get("UID", 0)) if uid else number
+            if key not in lookup or "BODYSTRUCTURE" not in items:
+                continue
+            try:
+                parts = body_parts(items["BODYSTRUCTURE"])
+            except (IndexError, TypeError, ValueError) as err:
+                _LOGGER.debug("Unable to read BODYSTRUCTURE: %s", str(err))
+                continue
+            plans[lookup[key]] = plan_sections(parts, content_types)
+    return plans
+
+
+def _rebuild_message(parts: list, fetched: dict) -> Any:
+    """Parse the downloaded parts of an email as a single message."""
+    headers = next(
+        (data for section, data in fetched.items() if section.startswith("HEADER")),
+        b"",
+    )
+    found = [(part, fetched[part.section]) for part in parts if part.section in fetched]
+    return LazyMessage(build_message(headers, found))
+
+
+@sequence
+def email_fetch_parts(
+    account: Type[imaplib.IMAP4_SSL],
+    ids: list,
+    content_types: list,
+    uid: bool = False,
+    chunk_size: int = DEFAULT_FETCH_CHUNK_SIZE,
+) -> List[tuple]:
+    """Download only the parts of each email with the given content types.
+
+    Emails are downloaded whole if the server can't fetch single parts or
+    their BODYSTRUCTURE can't be read. Emails without any of the content
+    types are skipped.
+
+    Returns list of tuples of the requested id and parsed message
+    """
+    ids = list(dict.fromkeys(ids))
+    plans = {}
+    if partial_fetch(account):
+        plans = yield from _plan_sections(account, ids, content_types, uid, chunk_size)
+
+    # Batch consecutive emails that need the same sections
+    runs = []
+    for num in ids:
+        sections = None
+        if num in plans:
+            sections = tuple(part.section for part in plans[num])
+        if runs and runs[-1][0] == sections:
+            runs[-1][1].append(num)
+        else:
+            runs.append((sections, [num]))
+
+    messages = []
+    for sections, batch in runs:
+        if sections is None:
+            found = yield from email_fetch_batch.steps(
+                account, batch, "(RFC822)", uid, chunk_size
+            )
+            for num, response_part in found:
+                messages.append((num, LazyMessage(response_part[1])))
+            continue
+        if not sections:
+            continue
+
+        items = " ".join([HEADER_FIELDS] + [f"BODY.PEEK[{s}]" for s in sections])
+        _LOGGER.debug("Fetching %s from %s emails", items, len(batch))
+        current = None
+        fetched = {}
+        found = yield from email_fetch_batch.steps(
+            account, batch, f"({items})", uid, chunk_size
+        )
+        for num, response_part in found:
+            if current is not None and num != current:
+                messages.append((current, _rebuild_message(plans[current], fetched)))
+                fetched = {}
+            current = num
+            section = response_section(response_part[0])
+            if section is not None:
+                fetched[section] = response_part[1]
+        if current is not None:
+            messages.append((current, _rebuild_message(plans[current], fetched)))
+    return messages
+
+
 def get_mails(
     account: Type[imaplib.IMAP4_SSL],
     image_output_path: str,
@@ -661,13 +1516,19 @@ def get_mails(
     image_name: str,
     gen_mp4: bool = False,
     custom_img: str = None,
+    resize_workers: int = DEFAULT_RESIZE_WORKERS,
+    image_cache: ImageCache = None,
+    mp4_queue: Mp4Queue = None,
+    gif_optimize: bool = DEFAULT_GIF_OPTIMIZE,
+    gif_webp: bool = DEFAULT_GIF_WEBP,
 ) -> int:
-    """Create GIF image based on the attachments in the inbox."""
-    image_count = 0
-    images = []
-    images_delete = []
-    msg = ""
+    """Create GIF image based on the attachments in the inbox.
 
+    With image_cache, mail pieces seen before are not resized again and
+    files built from the same frames are not written again. With
+    mp4_queue, the MP4 is generated in the background instead of blocking
+    this thread until ffmpeg finishes.
+    """
     _LOGGER.debug("Attempting to find Informed Delivery mail")
     _LOGGER.debug("Informed delivery search date: %s", get_formatted_date())
 
@@ -680,7 +1541,62 @@ def get_mails(
 
     # Bail out on error
     if server_response != "OK" or data[0] is None:
-        return image_count
+        return 0
+
+    messages = email_fetch_parts(account, data[0].split(), USPS_MAIL_TYPES)
+    return mail_image(
+        messages,
+        image_output_path,
+        gif_duration,
+        image_name,
+        gen_mp4,
+        custom_img,
+        resize_workers,
+        image_cache,
+        mp4_queue,
+        gif_optimize,
+        gif_webp,
+    )
+
+
+def informed_delivery_mail(account: Type[imaplib.IMAP4_SSL]) -> Generator:
+    """Return the command sequence downloading today's Informed Delivery mail.
+
+    The search and download of get_mails, for the asyncio transport.
+    """
+    (server_response, data) = yield from email_search.steps(
+        account,
+        SENSOR_DATA[ATTR_USPS_MAIL][ATTR_EMAIL],
+        get_formatted_date(),
+        SENSOR_DATA[ATTR_USPS_MAIL][ATTR_SUBJECT][0],
+    )
+    if server_response != "OK" or data[0] is None:
+        return None
+    return (
+        yield from email_fetch_parts.steps(account, data[0].split(), USPS_MAIL_TYPES)
+    )
+
+
+def mail_image(
+    messages: list,
+    image_output_path: str,
+    gif_duration: int,
+    image_name: str,
+    gen_mp4: bool = False,
+    custom_img: str = None,
+    resize_workers: int = DEFAULT_RESIZE_WORKERS,
+    image_cache: ImageCache = None,
+    mp4_queue: Mp4Queue = None,
+    gif_optimize: bool = DEFAULT_GIF_OPTIMIZE,
+    gif_webp: bool = DEFAULT_GIF_WEBP,
+) -> int:
+    """Create GIF image from the downloaded Informed Delivery mail.
+
+    Returns the number of mail pieces
+    """
+    image_count = 0
+    images = {}
+    msg = ""
 
     # Check to see if the path exists, if not make it
     if not os.path.isdir(image_output_path):
@@ -689,158 +1605,252 @@ def get_mails(
         except Exception as err:
             _LOGGER.critical("Error creating directory: %s", str(err))
 
-    # Clean up image directory
-    _LOGGER.debug("Cleaning up image directory: %s", str(image_output_path))
-    cleanup_images(image_output_path)
-
     # Copy overlays to image directory
     _LOGGER.debug("Checking for overlay files in: %s", str(image_output_path))
     copy_overlays(image_output_path)
 
-    if server_response == "OK":
-        _LOGGER.debug("Informed Delivery email found processing...")
-        for num in data[0].split():
-            msg = email_fetch(account, num, "(RFC822)")[1]
-            for response_part in msg:
-                if isinstance(response_part, tuple):
-                    msg = email.message_from_bytes(response_part[1])
-                    _LOGGER.debug("msg: %s", msg)
-
-                    # walking through the email parts to find images
-                    for part in msg.walk():
-                        if part.get_content_type() == "text/html":
-                            _LOGGER.debug("Found html email processing...")
-                            part = part.get_payload(decode=True)
-                            part = part.decode("utf-8", "ignore")
-                            soup = BeautifulSoup(part, "html.parser")
-                            found_images = soup.find_all(id="mailpiece-image-src-id")
-                            if not found_images:
-                                continue
-                            if "data:image/jpeg;base64" not in part:
-                                _LOGGER.debug("Unexpected html format found.")
-                                continue
-                            _LOGGER.debug("Found images: %s", bool(found_images))
-
-                            # Convert all the images to binary data
-                            for image in found_images:
-                                filename = random_filename()
-                                data = str(image["src"]).split(",")[1]
-                                try:
-                                    with open(
-                                        image_output_path + filename, "wb"
-                                    ) as the_file:
-                                        the_file.write(base64.b64decode(data))
-                                        images.append(image_output_path + filename)
-                                        image_count = image_count + 1
-                                except Exception as err:
-                                    _LOGGER.critical(
-                                        "Error opening filepath: %s", str(err)
-                                    )
-                                    return image_count
-
-                        # Log error message if we are unable to open the filepath for
-                        # some reason
-                        elif part.get_content_type() == "image/jpeg":
-                            _LOGGER.debug("Extracting image from email")
-                            filename = part.get_filename()
-                            junkmail = ["mailer", "content"]
-                            if any(junk in filename for junk in junkmail):
-                                _LOGGER.debug("Discarding junk mail.")
-                                continue
-                            try:
-                                with open(
-                                    image_output_path + filename, "wb"
-                                ) as the_file:
-                                    the_file.write(part.get_payload(decode=True))
-                                    images.append(image_output_path + filename)
-                                    image_count = image_count + 1
-                            except Exception as err:
-                                _LOGGER.critical("Error opening filepath: %s", str(err))
-                                return image_count
-
-                        elif part.get_content_type() == "multipart":
-                            continue
-
-        # Remove duplicate images
-        _LOGGER.debug("Removing duplicate images.")
-        images = list(dict.fromkeys(images))
-
-        # Create copy of image list for deleting temporary images
-        images_delete = images[:]
-
-        # Look for mail pieces without images image
-        if re.compile(r"\bimage-no-mailpieces?700\.jpg\b").search(str(msg)) is not None:
-            images.append(os.path.dirname(__file__) + "/image-no-mailpieces700.jpg")
-            image_count = image_count + 1
-            _LOGGER.debug("Placeholder image found using: image-no-mailpieces700.jpg.")
-
-        # Remove USPS announcement images
-        _LOGGER.debug("Removing USPS announcement images.")
-        images = [
-            el
-            for el in images
-            if not any(
-                ignore in el
-                for ignore in ["mailerProvidedImage", "ra_0", "Mail Attachment.txt"]
-            )
-        ]
-        image_count = len(images)
-        _LOGGER.debug("Image Count: %s", str(image_count))
+    _LOGGER.debug("Informed Delivery email found processing...")
+    for _, msg in messages:
+        _LOGGER.debug("msg: %s", msg)
 
-        if image_count > 0:
-            all_images = []
+        # walking through the email parts to find images
+        for part in msg.walk():
+            if part.get_content_type() == "text/html":
+                _LOGGER.debug("Found html email processing...")
+                found_images = list(scan_mailpieces(part.get_payload(decode=True)))
+                if not found_images:
+                    continue
+                _LOGGER.debug("Found images: %s", bool(found_images))
 
-            _LOGGER.debug("Resizing images to 724x320...")
-            # Resize images to 724x320
-            all_images = resize_images(images, 724, 320)
+                # Convert all the images to binary data
+                for image in found_images:
+                    try:
+                        images[random_filename()] = io.BytesIO(base64.b64decode(image))
+                    except binascii.Error as err:
+                        _LOGGER.error("Error decoding mail image: %s", str(err))
+
+            elif part.get_content_type() == "image/jpeg":
+                _LOGGER.debug("Extracting image from email")
+                filename = part.get_filename()
+                junkmail = ["mailer", "content"]
+                if any(junk in filename for junk in junkmail):
+                    _LOGGER.debug("Discarding junk mail.")
+                    continue
+                # Duplicate attachments keep their first position
+                images.setdefault(filename, io.BytesIO(part.get_payload(decode=True)))
 
-            # Create copy of image list for deleting temporary images
-            for image in all_images:
-                images_delete.append(image)
+            elif part.get_content_type() == "multipart":
+                continue
 
-            # Create numpy array of images
-            _LOGGER.debug("Creating array of image files...")
-            img, *imgs = [Image.open(file) for file in all_images]
+    # Look for mail pieces without images image
+    if NO_MAILPIECES_RE.search(str(msg)) is not None:
+        images["image-no-mailpieces700.jpg"] = (
+            os.path.dirname(__file__) + "/image-no-mailpieces700.jpg"
+        )
+        _LOGGER.debug("Placeholder image found using: image-no-mailpieces700.jpg.")
+
+    # Remove USPS announcement images
+    _LOGGER.debug("Removing USPS announcement images.")
+    images = {
+        name: image
+        for name, image in images.items()
+        if not any(
+            ignore in name
+            for ignore in ["mailerProvidedImage", "ra_0", "Mail Attachment.txt"]
+        )
+    }
+    image_count = len(images)
+    _LOGGER.debug("Image Count: %s", str(image_count))
+
+    gif = os.path.join(image_output_path, image_name)
+    webp = os.path.splitext(gif)[0] + ".webp"
+    if image_count > 0:
+        # Mail pieces the current image was built from
+        output = {
+            "images": [ImageCache.digest(image) for image in images.values()],
+            "duration": gif_duration,
+            "optimize": gif_optimize,
+            "webp": gif_webp,
+        }
+
+        if (
+            image_cache is not None
+            and image_cache.unchanged(gif, output)
+            and (not gif_webp or image_cache.unchanged(webp, output))
+        ):
+            _LOGGER.debug("Mail pieces unchanged, keeping %s", gif)
+        else:
+            # Clean up image directory
+            _LOGGER.debug("Cleaning up image directory: %s", image_output_path)
+            cleanup_images(image_output_path)
 
+            _LOGGER.debug("Resizing images to 724x320...")
+            frames = _mail_frames(images, resize_workers, image_cache)
             try:
                 _LOGGER.debug("Generating animated GIF")
-                # Use Pillow to create mail images
-                img.save(
-                    fp=os.path.join(image_output_path, image_name),
-                    format="GIF",
-                    append_images=imgs,
-                    save_all=True,
-                    duration=gif_duration * 1000,
-                    loop=0,
-                )
+                encode_gif(frames, gif, gif_duration * 1000, gif_optimize, gif_webp)
                 _LOGGER.debug("Mail image generated.")
+                if image_cache is not None:
+                    image_cache.record(gif, output)
+                    if gif_webp and os.path.isfile(webp):
+                        image_cache.record(webp, output)
             except Exception as err:
                 _LOGGER.error("Error attempting to generate image: %s", str(err))
-            for image in images_delete:
-                cleanup_images(f"{os.path.split(image)[0]}/", os.path.split(image)[1])
 
-        elif image_count == 0:
-            _LOGGER.debug("No mail found.")
+    elif image_count == 0:
+        _LOGGER.debug("No mail found.")
+        if custom_img is not None:
+            nomail = custom_img
+        else:
+            nomail = os.path.dirname(__file__) + "/mail_none.gif"
+        output = {"source": nomail}
+
+        if image_cache is not None and image_cache.unchanged(gif, output):
+            _LOGGER.debug("Still no mail, keeping %s", gif)
+        else:
+            # Clean up image directory
+            _LOGGER.debug("Cleaning up image directory: %s", image_output_path)
+            cleanup_images(image_output_path)
             if os.path.isfile(image_output_path + image_name):
                 _LOGGER.debug("Removing " + image_output_path + image_name)
                 cleanup_images(image_output_path, image_name)
 
             try:
                 _LOGGER.debug("Copying nomail gif")
-                if custom_img is not None:
-                    nomail = custom_img
-                else:
-                    nomail = os.path.dirname(__file__) + "/mail_none.gif"
                 copyfile(nomail, image_output_path + image_name)
+                if image_cache is not None:
+                    image_cache.record(gif, output)
             except Exception as err:
                 _LOGGER.error("Error attempting to copy image: %s", str(err))
 
-        if gen_mp4:
+    if gen_mp4:
+        mp4 = os.path.join(image_output_path, image_name.replace(".gif", ".mp4"))
+        if image_cache is not None and image_cache.unchanged(mp4, output):
+            _LOGGER.debug("Mail pieces unchanged, keeping %s", mp4)
+        elif mp4_queue is not None:
+            mp4_queue.submit(
+                gif,
+                mp4,
+                (lambda: image_cache.record(mp4, output)) if image_cache else None,
+                output,
+            )
+        else:
             _generate_mp4(image_output_path, image_name)
+            if image_cache is not None and os.path.isfile(mp4):
+                image_cache.record(mp4, output)
 
     return image_count
 
 
+def encode_gif(
+    frames: list,
+    path: str,
+    duration: int,
+    optimize: bool = False,
+    webp: bool = False,
+) -> None:
+    """Write frames to path as an animated GIF.
+
+    duration is per frame in milliseconds. optimize drops repeated frames
+    and maps every frame onto a single palette built from all of them, so
+    the GIF needs one color table instead of one per frame. webp also
+    writes an animated WebP next to the GIF.
+    """
+    start = time.perf_counter()
+    if optimize:
+        frames = _unique_frames(frames)
+
+    # Use Pillow to create mail images
+    img, *imgs = _shared_palette(frames) if optimize else frames
+    img.save(
+        fp=path,
+        format="GIF",
+        append_images=imgs,
+        save_all=True,
+        duration=duration,
+        loop=0,
+        optimize=optimize,
+    )
+    _log_encoded(path, len(frames), start)
+
+    if webp:
+        start = time.perf_counter()
+        webp_path = os.path.splitext(path)[0] + ".webp"
+        img, *imgs = frames
+        try:
+            img.save(
+                webp_path,
+                format="WEBP",
+                append_images=imgs,
+                save_all=True,
+                duration=duration,
+                loop=0,
+            )
+        except Exception as err:
+            _LOGGER.error("Error attempting to generate webp image: %s", str(err))
+            return
+        _log_encoded(webp_path, len(frames), start)
+
+
+def _unique_frames(frames: list) -> list:
+    """Drop frames identical to the one before them."""
+    unique = []
+    previous = None
+    for frame in frames:
+        digest = hashlib.sha256(frame.tobytes()).digest()
+        if digest != previous:
+            unique.append(frame)
+        previous = digest
+    if len(unique) < len(frames):
+        _LOGGER.debug("Dropped %s repeated frames", len(frames) - len(unique))
+    return unique
+
+
+def _shared_palette(frames: list) -> list:
+    """Quantize every frame to one adaptive palette built from all frames."""
+    width = max(1, frames[0].width // 4)
+    height = max(1, frames[0].height // 4)
+
+    # A reduced copy of every frame is enough to pick the colors
+    sample = Image.new("RGB", (width, height * len(frames)))
+    for index, frame in enumerate(frames):
+        sample.paste(frame.convert("RGB").resize((width, height)), (0, index * height))
+    palette = sample.quantize(colors=256, method=Image.Quantize.MEDIANCUT)
+
+    return [
+        frame.convert("RGB").quantize(
+            palette=palette, dither=Image.Dither.FLOYDSTEINBERG
+        )
+        for frame in frames
+    ]
+
+
+def _log_encoded(path: str, frames: int, start: float) -> None:
+    """Log the size and encoding time of an animation."""
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return
+    _LOGGER.debug(
+        "Encoded %s: %s frames, %s bytes in %.3fs",
+        path,
+        frames,
+        size,
+        time.perf_counter() - start,
+    )
+
+
+def _mail_frames(images: dict, workers: int, image_cache: ImageCache = None) -> list:
+    """Resize mail pieces to 724x320, reusing cached frames."""
+
+    def resize(new: dict) -> dict:
+        return resize_frames(new, 724, 320, workers)
+
+    if image_cache is None:
+        return list(resize(images).values())
+    return [frame for _, frame in image_cache.frames(images, 724, 320, resize).values()]
+
+
 def random_filename(ext: str = ".jpg") -> str:
     """Generate random filename."""
     return f"{str(uuid.uuid4())}{ext}"
@@ -875,42 +1885,122 @@ def _generate_mp4(path: str, image_file: str) -> None:
     )
 
 
-def resize_images(images: list, width: int, height: int) -> list:
-    """Resize images.
+def resize_image(image: Any, width: int, height: int) -> Image.Image:
+    """Resize a single image to width x height.
 
-    This should keep the aspect ratio of the images
-    Returns list of images
+    This should keep the aspect ratio of the image, image may be a file
+    path or a file object.
     """
-    all_images = []
-    for image in images:
-        try:
-            with open(image, "rb") as fd_img:
-                try:
-                    img = Image.open(fd_img)
-                    img.thumbnail((width, height), resample=Image.Resampling.LANCZOS)
-
-                    # Add padding as needed
-                    img = ImageOps.pad(
-                        img, (width, height), method=Image.Resampling.LANCZOS
-                    )
-                    # Crop to size
-                    img = img.crop((0, 0, width, height))
-
-                    pre = os.path.splitext(image)[0]
-                    image = pre + ".gif"
-                    img.save(image, img.format)
-                    fd_img.close()
-                    all_images.append(image)
-                except Exception as err:
-                    _LOGGER.error(
-                        "Error attempting to read image %s: %s", str(image), str(err)
-                    )
-                    continue
-        except Exception as err:
-            _LOGGER.error("Error attempting to open image %s: %s", str(image), str(err))
-            continue
+    img = Image.open(image)
+    img.thumbnail((width, height), resample=Image.Resampling.LANCZOS)
+
+    # Add padding as needed
+    img = ImageOps.pad(img, (width, height), method=Image.Resampling.LANCZOS)
+    # Crop to size
+    return img.crop((0, 0, width, height))
+
+
+def _resize_frame(
+    name: str, image: Any, width: int, height: int
+) -> Optional[Image.Image]:
+    """Resize a single in memory image, logging any error."""
+    start = time.perf_counter()
+    try:
+        frame = resize_image(image, width, height)
+    except Exception as err:
+        _LOGGER.error("Error attempting to read image %s: %s", name, str(err))
+        return None
+    _LOGGER.debug("Resized %s in %.3fs", name, time.perf_counter() - start)
+    return frame
+
+
+def scale_image(
+    content: bytes, width: Optional[int] = None, height: Optional[int] = None
+) -> bytes:
+    """Return a rendition of an image that fits width x height.
+
+    Small requests, and images that are not animated, get the first frame
+    as a JPEG, larger requests keep the animation. Images that already
+    fit are returned unchanged.
+    """
+    with Image.open(io.BytesIO(content)) as img:
+        size = _fit_size(img.size, width, height)
+        if size is None:
+            return content
+
+        output = io.BytesIO()
+        animated = getattr(img, "n_frames", 1) > 1
+        if not animated or size[0] <= CAMERA_STILL_WIDTH:
+            frame = img.convert("RGB").resize(size, Image.Resampling.LANCZOS)
+            frame.save(output, format="JPEG", quality=85)
+            return output.getvalue()
+
+        frames = []
+        durations = []
+        for frame in ImageSequence.Iterator(img):
+            durations.append(frame.info.get("duration", 0))
+            frames.append(frame.convert("RGB").resize(size, Image.Resampling.LANCZOS))
+        first, *rest = frames
+        first.save(
+            output,
+            format="GIF",
+            append_images=rest,
+            save_all=True,
+            duration=durations,
+            loop=img.info.get("loop", 0),
+        )
+        return output.getvalue()
+
+
+def _fit_size(
+    size: tuple, width: Optional[int], height: Optional[int]
+) -> Optional[tuple]:
+    """Return size scaled down to fit width x height, or None if it fits."""
+    scales = [
+        limit / current
+        for limit, current in ((width, size[0]), (height, size[1]))
+        if limit
+    ]
+    if not scales or min(scales) >= 1:
+        return None
+    scale = min(scales)
+    return (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+
+
+def resize_frames(
+    images: dict, width: int, height: int, workers: int = DEFAULT_RESIZE_WORKERS
+) -> dict:
+    """Resize images in memory.
+
+    images maps a name to a file path or file object. Batches of at
+    least MIN_PARALLEL_RESIZE images are spread over a thread pool of
+    workers threads, Pillow releases the GIL while resampling. Smaller
+    batches are resized one after the other.
+    Returns dict of name to PIL image in the order of images, images
+    that could not be read are left out
+    """
+    start = time.perf_counter()
+    workers = min(workers, len(images))
+
+    def resize(item: tuple) -> Optional[Image.Image]:
+        return _resize_frame(*item, width, height)
 
-    return all_images
+    if workers > 1 and len(images) >= MIN_PARALLEL_RESIZE:
+        with ThreadPoolExecutor(workers, f"{DOMAIN}_resize") as pool:
+            frames = list(pool.map(resize, images.items()))
+    else:
+        workers = 1
+        frames = list(map(resize, images.items()))
+
+    elapsed = time.perf_counter() - start
+    _LOGGER.debug(
+        "Resized %s images in %.3fs (%.3fs per image) with %s workers",
+        len(images),
+        elapsed,
+        elapsed / len(images) if images else 0,
+        workers,
+    )
+    return {name: frame for name, frame in zip(images, frames) if frame is not None}
 
 
 def copy_overlays(path: str) -> None:
@@ -931,7 +2021,7 @@ def copy_overlays(path: str) -> None:
 def cleanup_images(path: str, image: Optional[str] = None) -> None:
     """Clean up image storage directory.
 
-    Only supose to delete .gif, .mp4, and .jpg files
+    Only supose to delete .gif, .mp4, .jpg and .webp files
     """
     if image is not None:
         try:
@@ -941,7 +2031,7 @@ def cleanup_images(path: str, image: Optional[str] = None) -> None:
         return
 
     for file in os.listdir(path):
-        if file.endswith(".gif") or file.endswith(".mp4") or file.endswith(".jpg"):
+        if file.endswith((".gif", ".mp4", ".jpg", ".webp")):
             try:
                 os.remove(path + file)
             except Exception as err:
@@ -962,12 +2052,7 @@ def get_count(
 
     Returns dict of sensor data
     """
-    count = 0
-    tracking = []
     result = {}
-    today = get_formatted_date()
-    track = None
-    found = []
 
     # Return Amazon delivered info
     if sensor_type == AMAZON_DELIVERED:
@@ -980,56 +2065,17 @@ def get_count(
     # Bail out if unknown sensor type
     if ATTR_EMAIL not in SENSOR_DATA[sensor_type]:
         _LOGGER.debug("Unknown sensor type: %s", str(sensor_type))
-        result[ATTR_COUNT] = count
+        result[ATTR_COUNT] = 0
         result[ATTR_TRACKING] = ""
         return result
 
-    subjects = SENSOR_DATA[sensor_type][ATTR_SUBJECT]
-    for subject in subjects:
-        _LOGGER.debug(
-            "Attempting to find mail from (%s) with subject (%s)",
-            SENSOR_DATA[sensor_type][ATTR_EMAIL],
-            subject,
-        )
-
-        (server_response, data) = email_search(
-            account, SENSOR_DATA[sensor_type][ATTR_EMAIL], today, subject
-        )
-        if server_response == "OK" and data[0] is not None:
-            if ATTR_BODY in SENSOR_DATA[sensor_type].keys():
-                count += find_text(data, account, SENSOR_DATA[sensor_type][ATTR_BODY])
-            else:
-                count += len(data[0].split())
-
-            _LOGGER.debug(
-                "Search for (%s) with subject (%s) results: %s count: %s",
-                SENSOR_DATA[sensor_type][ATTR_EMAIL],
-                subject,
-                data[0],
-                count,
-            )
-            found.append(data[0])
-
-    if (
-        f"{'_'.join(sensor_type.split('_')[:-1])}_tracking" in SENSOR_DATA
-        and ATTR_PATTERN
-        in SENSOR_DATA[f"{'_'.join(sensor_type.split('_')[:-1])}_tracking"].keys()
-    ):
-        track = SENSOR_DATA[f"{'_'.join(sensor_type.split('_')[:-1])}_tracking"][
-            ATTR_PATTERN
-        ][0]
-
-    if track is not None and get_tracking_num and count > 0:
-        for sdata in found:
-            tracking.extend(get_tracking(sdata, account, track))
-        tracking = list(dict.fromkeys(tracking))
-
-    if len(tracking) > 0:
-        # Use tracking numbers found for count (more accurate)
-        count = len(tracking)
+    message_classifier = classifier.MessageClassifier(
+        {CONF_AMAZON_DOMAIN: amazon_domain, CONF_AMAZON_FWDS: amazon_fwds}
+    )
+    facts = classifier.search_facts(account, message_classifier, [sensor_type])
+    count, tracking = message_classifier.count(sensor_type, facts, get_tracking_num)
 
     result[ATTR_TRACKING] = tracking
-
     result[ATTR_COUNT] = count
     return result
 
@@ -1042,48 +2088,31 @@ def get_tracking(
     Returns list of tracking numbers
     """
     tracking = []
-    pattern = None
     mail_list = sdata.split()
     _LOGGER.debug("Searching for tracking numbers in %s messages...", len(mail_list))
 
-    pattern = re.compile(rf"{the_format}")
-    for i in mail_list:
-        data = email_fetch(account, i, "(RFC822)")[1]
-        for response_part in data:
-            if isinstance(response_part, tuple):
-                msg = email.message_from_bytes(response_part[1])
-                _LOGGER.debug("Checking message subject...")
-
-                # Search subject for a tracking number
-                email_subject = msg["subject"]
-                if (found := pattern.findall(email_subject)) and len(found) > 0:
-                    _LOGGER.debug(
-                        "Found tracking number in email subject: (%s)",
-                        found[0],
-                    )
-                    if found[0] not in tracking:
-                        tracking.append(found[0])
-                    continue
+    carriers = {the_format: compile_pattern(the_format)}
+    found = {}
+    bodies = mail_list
+    if partial_fetch(account):
+        # Only download the body if the subject has no tracking number
+        bodies = []
+        for num, response_part in email_fetch_batch(account, mail_list, HEADER_PARTS):
+            subject = LazyMessage(response_part[1])["subject"]
+            if numbers := classifier.tracking_numbers(carriers, subject, ()):
+                found[num] = numbers[the_format]
+            else:
+                bodies.append(num)
+        _LOGGER.debug("Downloading %s message bodies", len(bodies))
 
-                # Search in email body for tracking number
-                _LOGGER.debug("Checking message body using %s ...", the_format)
-                for part in msg.walk():
-                    _LOGGER.debug("Content type: %s", part.get_content_type())
-                    if part.get_content_type() not in ["text/html", "text/plain"]:
-                        continue
-                    email_msg = part.get_payload(decode=True)
-                    email_msg = email_msg.decode("utf-8", "ignore")
-                    if (found := pattern.findall(email_msg)) and len(found) > 0:
-                        # DHL is special
-                        if " " in the_format:
-                            found[0] = found[0].split(" ")[1]
-
-                        _LOGGER.debug(
-                            "Found tracking number in email body: %s", found[0]
-                        )
-                        if found[0] not in tracking:
-                            tracking.append(found[0])
-                        continue
+    for num, msg in email_fetch_parts(account, bodies, TEXT_TYPES):
+        numbers = classifier.tracking_numbers(carriers, msg["subject"], msg.texts())
+        found[num] = numbers.get(the_format, [])
+
+    for num in mail_list:
+        for number in found.get(num, []):
+            if number not in tracking:
+                tracking.append(number)
 
     if len(tracking) == 0:
         _LOGGER.debug("No tracking numbers found")
@@ -1099,32 +2128,16 @@ def find_text(sdata: Any, account: Type[imaplib.IMAP4_SSL], search_terms: list)
     _LOGGER.debug("Searching for (%s) in (%s) emails", search_terms, len(sdata))
     mail_list = sdata[0].split()
     count = 0
-    found = None
+    terms = [(search, compile_pattern(search)) for search in search_terms]
 
-    for i in mail_list:
-        data = email_fetch(account, i, "(RFC822)")[1]
-        for response_part in data:
-            if isinstance(response_part, tuple):
-                msg = email.message_from_bytes(response_part[1])
-
-                for part in msg.walk():
-                    for search in search_terms:
-                        _LOGGER.debug("Content type: %s", part.get_content_type())
-                        if part.get_content_type() not in ["text/html", "text/plain"]:
-                            continue
-                        email_msg = part.get_payload(decode=True)
-                        email_msg = email_msg.decode("utf-8", "ignore")
-                        pattern = re.compile(rf"{search}")
-                        if (found := pattern.findall(email_msg)) and len(found) > 0:
-                            _LOGGER.debug(
-                                "Found (%s) in email %s times.", search, str(len(found))
-                            )
-                            count += len(found)
+    for _, msg in email_fetch_parts(account, mail_list, TEXT_TYPES):
+        count += sum(classifier.count_terms(msg, terms).values())
 
     _LOGGER.debug("Search for (%s) count results: %s", search_terms, count)
     return count
 
 
+@sequence
 def amazon_search(
     account: Type[imaplib.IMAP4_SSL],
     image_path: str,
@@ -1150,12 +2163,14 @@ def amazon_search(
     _LOGGER.debug("Amazon email list: %s", str(address_list))
 
     for subject in subjects:
-        (server_response, data) = email_search(account, address_list, today, subject)
+        (server_response, data) = yield from email_search.steps(
+            account, address_list, today, subject
+        )
 
         if server_response == "OK" and data[0] is not None:
             count += len(data[0].split())
             _LOGGER.debug("Amazon delivered email(s) found: %s", count)
-            get_amazon_image(
+            yield from get_amazon_image(
                 data[0],
                 account,
                 image_path,
@@ -1180,36 +2195,32 @@ def get_amazon_image(
     image_path: str,
     hass: HomeAssistant,
     image_name: str,
-) -> None:
-    """Find Amazon delivery image."""
+) -> Generator:
+    """Return the command sequence finding the Amazon delivery image."""
     _LOGGER.debug("Searching for Amazon image in emails...")
 
     img_url = None
     mail_list = sdata.split()
     _LOGGER.debug("HTML Amazon emails found: %s", len(mail_list))
 
-    for i in mail_list:
-        data = email_fetch(account, i, "(RFC822)")[1]
-        for response_part in data:
-            if isinstance(response_part, tuple):
-                msg = email.message_from_bytes(response_part[1])
-                _LOGGER.debug("Email Multipart: %s", str(msg.is_multipart()))
-                _LOGGER.debug("Content Type: %s", str(msg.get_content_type()))
-
-                for part in msg.walk():
-                    if part.get_content_type() != "text/html":
-                        continue
-                    _LOGGER.debug("Processing HTML email...")
-                    part = part.get_payload(decode=True)
-                    part = part.decode("utf-8", "ignore")
-                    pattern = re.compile(rf"{AMAZON_IMG_PATTERN}")
-                    found = pattern.findall(part)
-                    for url in found:
-                        if url[1] != "us-prod-temp.s3.amazonaws.com":
-                            continue
-                        img_url = url[0] + url[1] + url[2]
-                        _LOGGER.debug("Amazon img URL: %s", img_url)
-                        break
+    messages = yield from email_fetch_parts.steps(account, mail_list, ["text/html"])
+    for _, msg in messages:
+        _LOGGER.debug("Email Multipart: %s", str(msg.is_multipart()))
+        _LOGGER.debug("Content Type: %s", str(msg.get_content_type()))
+
+        for part in msg.walk():
+            if part.get_content_type() != "text/html":
+                continue
+            _LOGGER.debug("Processing HTML email...")
+            part = part.get_payload(decode=True)
+            part = part.decode("utf-8", "ignore")
+            found = AMAZON_IMG_RE.findall(part)
+            for url in found:
+                if url[1] != "us-prod-temp.s3.amazonaws.com":
+                    continue
+                img_url = url[0] + url[1] + url[2]
+                _LOGGER.debug("Amazon img URL: %s", img_url)
+                break
 
     if img_url is not None:
         _LOGGER.debug("Attempting to download Amazon image.")
@@ -1239,7 +2250,7 @@ async def download_img(
                 _LOGGER.debug("Amazon image downloaded")
 
 
-def _process_amazon_forwards(email_list: str | list | None) -> list:
+def process_amazon_forwards(email_list: str | list | None) -> list:
     """Process amazon forward emails.
 
     Returns list of email addresses
@@ -1262,9 +2273,7 @@ def amazon_hub(account: Type[imaplib.IMAP4_SSL], fwds: Optional[str] = None) ->
     Returns dict of sensor data
     """
     email_addresses = []
-    email_addresses.extend(_process_amazon_forwards(fwds))
-    body_regex = AMAZON_HUB_BODY
-    subject_regex = AMAZON_HUB_SUBJECT_SEARCH
+    email_addresses.extend(process_amazon_forwards(fwds))
     info = {}
     today = get_formatted_date()
 
@@ -1288,36 +2297,10 @@ def amazon_hub(account: Type[imaplib.IMAP4_SSL], fwds: Optional[str] = None) ->
         found = []
         id_list = sdata[0].split()
         _LOGGER.debug("Amazon hub emails found: %s", str(len(id_list)))
-        for i in id_list:
-            data = email_fetch(account, i, "(RFC822)")[1]
-            for response_part in data:
-                if isinstance(response_part, tuple):
-                    msg = email.message_from_bytes(response_part[1])
-
-                    # Get combo number from subject line
-                    email_subject = msg["subject"]
-                    pattern = re.compile(rf"{subject_regex}")
-                    search = pattern.search(email_subject)
-                    if search is not None:
-                        if len(search.groups()) > 1:
-                            found.append(search.group(3))
-                            continue
-
-                    # Get combo number from message body
-                    try:
-                        if msg.is_multipart():
-                            email_msg = quopri.decodestring(str(msg.get_payload(0)))
-                        else:
-                            email_msg = quopri.decodestring(str(msg.get_payload()))
-                    except Exception as err:
-                        _LOGGER.debug("Problem decoding email message: %s", str(err))
-                        continue
-                    email_msg = email_msg.decode("utf-8", "ignore")
-                    pattern = re.compile(rf"{body_regex}")
-                    search = pattern.search(email_msg)
-                    if search is not None:
-                        if len(search.groups()) > 1:
-                            found.append(search.group(2))
+        for _, response_part in email_fetch_batch(account, id_list):
+            code = classifier.amazon_hub_code(LazyMessage(response_part[1]))
+            if code is not None:
+                found.append(code)
 
     info[ATTR_COUNT] = len(found)
     info[ATTR_CODE] = found
@@ -1332,9 +2315,8 @@ def amazon_otp(account: Type[imaplib.IMAP4_SSL], fwds: Optional[list] = None) ->
     """
     tfmt = get_formatted_date()
     info = {}
-    body_regex = AMAZON_OTP_REGEX
     email_addresses = []
-    email_addresses.extend(_process_amazon_forwards(fwds))
+    email_addresses.extend(process_amazon_forwards(fwds))
 
     for address in email_addresses:
 
@@ -1346,35 +2328,11 @@ def amazon_otp(account: Type[imaplib.IMAP4_SSL], fwds: Optional[list] = None) ->
             id_list = sdata[0].split()
             _LOGGER.debug("Found Amazon OTP email(s): %s", str(len(id_list)))
             found = []
-            for i in id_list:
-                data = email_fetch(account, i, "(RFC822)")[1]
-                for response_part in data:
-                    if isinstance(response_part, tuple):
-                        msg = email.message_from_bytes(response_part[1])
-
-                        _LOGGER.debug("Email Multipart: %s", str(msg.is_multipart()))
-                        _LOGGER.debug("Content Type: %s", str(msg.get_content_type()))
-
-                        # Get code from message body
-                        try:
-                            _LOGGER.debug("Decoding OTP email...")
-                            email_msg = quopri.decodestring(
-                                str(msg.get_payload(0))
-                            )  # msg.get_payload(0).encode('utf-8')
-                        except Exception as err:
-                            _LOGGER.debug(
-                                "Problem decoding email message: %s", str(err)
-                            )
-                            continue
-                        email_msg = email_msg.decode("utf-8", "ignore")
-                        pattern = re.compile(rf"{body_regex}")
-                        search = pattern.search(email_msg)
-                        if search is not None:
-                            if len(search.groups()) > 1:
-                                _LOGGER.debug(
-                                    "Amazon OTP search results: %s", search.group(2)
-                                )
-                                found.append(search.group(2))
+            for _, response_part in email_fetch_batch(account, id_list):
+                code = classifier.amazon_otp_code(LazyMessage(response_part[1]))
+                if code is not None:
+                    _LOGGER.debug("Amazon OTP search results: %s", code)
+                    found.append(code)
 
     info[ATTR_CODE] = found
     return info
@@ -1389,29 +2347,20 @@ def amazon_exception(
 
     Returns dict of sensor data
     """
-    order_number = []
-    tfmt = get_formatted_date()
-    count = 0
-    info = {}
-
-    address_list = amazon_email_addresses(fwds, the_domain)
-    _LOGGER.debug("Amazon email list: %s", str(address_list))
-
-    (server_response, sdata) = email_search(
-        account, address_list, tfmt, AMAZON_EXCEPTION_SUBJECT
+    message_classifier = classifier.MessageClassifier(
+        {CONF_AMAZON_DOMAIN: the_domain, CONF_AMAZON_FWDS: fwds}
     )
+    _LOGGER.debug(
+        "Amazon email list: %s", str(message_classifier.senders([AMAZON_EXCEPTION]))
+    )
+    facts = classifier.search_facts(account, message_classifier, [AMAZON_EXCEPTION])
+    data = message_classifier.route(facts, [AMAZON_EXCEPTION])
+    _LOGGER.debug("Found %s Amazon exceptions", data[AMAZON_EXCEPTION])
 
-    if server_response == "OK":
-        count += len(sdata[0].split())
-        _LOGGER.debug("Found %s Amazon exceptions", count)
-        order_numbers = get_tracking(sdata[0], account, AMAZON_PATTERN)
-        for order in order_numbers:
-            order_number.append(order)
-
-    info[ATTR_COUNT] = count
-    info[ATTR_ORDER] = order_number
-
-    return info
+    return {
+        ATTR_COUNT: data[AMAZON_EXCEPTION],
+        ATTR_ORDER: data[AMAZON_EXCEPTION_ORDER],
+    }
 
 
 def amazon_date_search(email_msg: str) -> int:
@@ -1444,7 +2393,7 @@ def amazon_email_addresses(
 ) -> list | None:
     """Return Amazon email addresses in list format."""
     domains = []
-    domains.extend(_process_amazon_forwards(fwds))
+    domains.extend(process_amazon_forwards(fwds))
     the_domain = the_domain.split()
     domains.extend(the_domain)
     value = []
@@ -1480,8 +2429,7 @@ def get_items(
     # Limit to past X days
     past_date = datetime.date.today() - datetime.timedelta(days=days)
     tfmt = past_date.strftime("%d-%b-%Y")
-    deliveries_today = []
-    order_number = []
+    facts = []
 
     address_list = amazon_email_addresses(fwds, the_domain)
     _LOGGER.debug("Amazon email list: %s", str(address_list))
@@ -1489,94 +2437,15 @@ def get_items(
     (server_response, sdata) = email_search(account, address_list, tfmt)
 
     if server_response == "OK":
-        mail_ids = sdata[0]
-        id_list = mail_ids.split()
+        id_list = sdata[0].split()
         _LOGGER.debug("Amazon emails found: %s", str(len(id_list)))
-        for i in id_list:
-            data = email_fetch(account, i, "(RFC822)")[1]
-            for response_part in data:
-                if isinstance(response_part, tuple):
-                    msg = email.message_from_bytes(response_part[1])
-
-                    _LOGGER.debug("Email Multipart: %s", str(msg.is_multipart()))
-                    _LOGGER.debug("Content Type: %s", str(msg.get_content_type()))
-
-                    # Get order number from subject line
-                    encoding = decode_header(msg["subject"])[0][1]
-                    if encoding is not None:
-                        email_subject = decode_header(msg["subject"])[0][0].decode(
-                            encoding, "ignore"
-                        )
-                    else:
-                        email_subject = decode_header(msg["subject"])[0][0]
-
-                    if not isinstance(email_subject, str):
-                        _LOGGER.debug("Converting subject to string.")
-                        email_subject = email_subject.decode("utf-8", "ignore")
-
-                    _LOGGER.debug("Amazon Subject: %s", str(email_subject))
-                    pattern = re.compile(r"[0-9]{3}-[0-9]{7}-[0-9]{7}")
-
-                    # Don't add the same order number twice
-                    if (
-                        (found := pattern.findall(email_subject))
-                        and len(found) > 0
-                        and found[0] not in order_number
-                    ):
-                        order_number.append(found[0])
+        for _, response_part in email_fetch_batch(account, id_list):
+            orders, eta = classifier.amazon_items(LazyMessage(response_part[1]))
+            facts.append({classifier.FACT_ORDERS: orders, classifier.FACT_ETA: eta})
 
-                    try:
-                        if msg.is_multipart():
-                            email_msg = quopri.decodestring(str(msg.get_payload(0)))
-                        else:
-                            email_msg = quopri.decodestring(str(msg.get_payload()))
-                    except Exception as err:
-                        _LOGGER.debug("Problem decoding email message: %s", str(err))
-                        _LOGGER.error("Unable to process this email. Skipping.")
-                        continue
-                    email_msg = email_msg.decode("utf-8", "ignore")
-
-                    # Check message body for order number
-                    if (
-                        (found := pattern.findall(email_msg))
-                        and len(found) > 0
-                        and found[0] not in order_number
-                    ):
-                        order_number.append(found[0])
-
-                    for search in AMAZON_TIME_PATTERN:
-                        _LOGGER.debug("Looking for: %s", search)
-                        if search not in email_msg:
-                            continue
-
-                        start = email_msg.find(search) + len(search)
-                        end = amazon_date_search(email_msg)
-
-                        arrive_date = email_msg[start:end].replace(">", "").strip()
-                        _LOGGER.debug("First pass: %s", arrive_date)
-                        arrive_date = arrive_date.split(" ")
-                        arrive_date = arrive_date[0:3]
-                        arrive_date = " ".join(arrive_date).strip()
-
-                        # Get the date object
-                        dateobj = dateparser.parse(arrive_date)
-
-                        if (
-                            dateobj is not None
-                            and dateobj.day == datetime.date.today().day
-                            and dateobj.month == datetime.date.today().month
-                        ):
-                            deliveries_today.append("Amazon Order")
-
-    value = None
+    count, order_number = classifier.amazon_packages(facts)
     if param == "count":
-        _LOGGER.debug("Amazon Count: %s", str(len(deliveries_today)))
-        if len(deliveries_today) > len(order_number):
-            value = len(order_number)
-        else:
-            value = len(deliveries_today)
-    else:
-        _LOGGER.debug("Amazon order: %s", str(order_number))
-        value = order_number
-
-    return value
+        _LOGGER.debug("Amazon Count: %s", str(count))
+        return count
+    _LOGGER.debug("Amazon order: %s", str(order_number))
+    return order_number
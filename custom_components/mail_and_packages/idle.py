@@ -0,0 +1,224 @@
+"""IMAP IDLE listener for Mail and Packages."""
+
+from __future__ import annotations
+
+import logging
+import re
+import threading
+from typing import Any, Callable, Optional
+
+from homeassistant.const import (
+    CONF_HOST,
+    CONF_PASSWORD,
+    CONF_PORT,
+    CONF_RESOURCES,
+    CONF_USERNAME,
+)
+from homeassistant.core import HomeAssistant
+
+from .capabilities import CAPABILITIES
+from .classifier import MessageClassifier
+from .const import (
+    CONF_FOLDER,
+    CONF_IMAP_SECURITY,
+    CONF_VERIFY_SSL,
+    DEFAULT_IDLE_STOP_TIMEOUT,
+    DEFAULT_IDLE_TIMEOUT,
+    DEFAULT_RECONNECT_BACKOFF,
+    DEFAULT_RECONNECT_MAX_BACKOFF,
+    DOMAIN,
+)
+from .helpers import login, logout, selectfolder
+
+_LOGGER = logging.getLogger(__name__)
+
+# Untagged responses that change the message count
+EXISTS_RE = re.compile(rb"^\* (\d+) EXISTS", re.IGNORECASE)
+EXPUNGE_RE = re.compile(rb"^\* (\d+) EXPUNGE", re.IGNORECASE)
+
+# Headers of the new messages, to tell which sensors they change
+NEW_MAIL_HEADERS = "(BODY.PEEK[HEADER.FIELDS (FROM)])"
+
+
+class IdleListener:
+    """Wait for new mail with IMAP IDLE on a dedicated connection.
+
+    callback is given the sensors the new mail changes, or None if they
+    could not be told.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        config: dict,
+        callback: Callable[[Optional[list]], Any],
+    ) -> None:
+        """Initialize."""
+        self._hass = hass
+        self._config = config
+        self._callback = callback
+        self._classifier = MessageClassifier(config)
+        self._stop = threading.Event()
+        self._thread = None
+        self._account = None
+        self._tags = 0
+        self._exists = 0
+        self.supported = None
+
+    def start(self) -> None:
+        """Start listening in a background thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name=f"{DOMAIN}_idle", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop listening and wait for the thread to finish."""
+        self._stop.set()
+        if (account := self._account) is not None:
+            try:
+                account.shutdown()
+            except Exception as err:
+                _LOGGER.debug("Error closing IMAP IDLE connection: %s", str(err))
+        if self._thread is not None:
+            self._thread.join(DEFAULT_IDLE_STOP_TIMEOUT)
+            self._thread = None
+
+    def _run(self) -> None:
+        """Keep an IDLE session open, reconnecting on errors."""
+        failures = 0
+        while not self._stop.is_set():
+            account = self._connect()
+            if self.supported is False:
+                return
+            if not account:
+                failures += 1
+                self._stop.wait(
+                    min(
+                        DEFAULT_RECONNECT_BACKOFF * 2**failures,
+                        DEFAULT_RECONNECT_MAX_BACKOFF,
+                    )
+                )
+                continue
+
+            failures = 0
+            self._account = account
+            try:
+                while not self._stop.is_set():
+                    if (new := self._idle(account)) is None:
+                        continue
+                    sensors = self._affected(account, new)
+                    if sensors == []:
+                        _LOGGER.debug("New mail changes no sensor")
+                        continue
+                    _LOGGER.debug("New mail reported, refreshing %s", sensors or "all")
+                    self._hass.add_job(self._callback, sensors)
+            except Exception as err:
+                if not self._stop.is_set():
+                    _LOGGER.debug("IMAP IDLE connection lost: %s", str(err))
+            finally:
+                self._account = None
+                logout(account)
+
+    def _connect(self) -> Any:
+        """Login, select the folder and check the server supports IDLE."""
+        account = login(
+            self._config.get(CONF_HOST),
+            self._config.get(CONF_PORT),
+            self._config.get(CONF_USERNAME),
+            self._config.get(CONF_PASSWORD),
+            self._config.get(CONF_IMAP_SECURITY),
+            self._config.get(CONF_VERIFY_SSL),
+        )
+        if not account:
+            return False
+
+        self.supported = CAPABILITIES.server(account).supports("IDLE")
+        if not self.supported:
+            _LOGGER.info("IMAP server does not support IDLE, polling for new mail")
+            logout(account)
+            return False
+
+        if not selectfolder(account, self._config.get(CONF_FOLDER)):
+            logout(account)
+            return False
+        exists = account.response("EXISTS")[1]
+        self._exists = int(exists[-1]) if exists and exists[-1] else 0
+        return account
+
+    def _idle(self, account: Any) -> Optional[str]:
+        """Wait in IDLE until new mail arrives or the IDLE times out.
+
+        Lines are read with the session's own buffered reader, which
+        blocks until the server answers. Servers may drop IDLE sessions
+        after 30 minutes, so a timer ends the IDLE before that.
+
+        Returns sequence set of the new messages or None
+        """
+        self._tags += 1
+        tag = f"MP{self._tags}".encode()
+
+        account.send(tag + b" IDLE\r\n")
+        line = _readline(account)
+        if not line.startswith(b"+"):
+            raise ConnectionError(f"IDLE rejected: {line!r}")
+
+        lock = threading.Lock()
+        ended = []
+
+        def end() -> None:
+            with lock:
+                if ended:
+                    return
+                ended.append(True)
+                try:
+                    account.send(b"DONE\r\n")
+                except OSError as err:
+                    _LOGGER.debug("Error ending IMAP IDLE: %s", str(err))
+
+        timer = threading.Timer(DEFAULT_IDLE_TIMEOUT, end)
+        timer.daemon = True
+        timer.start()
+        first = self._exists + 1
+        try:
+            while not (line := _readline(account)).startswith(tag):
+                if match := EXISTS_RE.match(line):
+                    self._exists = int(match.group(1))
+                    if self._exists >= first:
+                        end()
+                elif match := EXPUNGE_RE.match(line):
+                    self._exists -= 1
+                    if int(match.group(1)) < first:
+                        first -= 1
+        finally:
+            timer.cancel()
+
+        if self._exists < first:
+            return None
+        return f"{first}:{self._exists}"
+
+    def _affected(self, account: Any, new: str) -> Optional[list]:
+        """Return the sensors the new messages change.
+
+        Returns list of sensors or None if the headers couldn't be fetched
+        """
+        try:
+            (server_response, data) = account.fetch(new, NEW_MAIL_HEADERS)
+        except Exception as err:
+            _LOGGER.debug("Error fetching new mail headers: %s", str(err))
+            return None
+        if server_response != "OK":
+            return None
+        headers = [part[1] for part in data if isinstance(part, tuple)]
+        return self._classifier.affected(self._config.get(CONF_RESOURCES), headers)
+
+
+def _readline(account: Any) -> bytes:
+    """Return the next line the server sent."""
+    line = account.readline()
+    if not line:
+        raise ConnectionError("IMAP server closed the connection")
+    return line
@@ -0,0 +1,188 @@
+"""Precompiled search patterns for Mail and Packages."""
+
+from __future__ import annotations
+
+import functools
+import re
+from collections.abc import Iterator, Mapping
+from dataclasses import dataclass
+from typing import Optional
+
+from .const import (
+    AMAZON_HUB_BODY,
+    AMAZON_HUB_SUBJECT_SEARCH,
+    AMAZON_IMG_PATTERN,
+    AMAZON_OTP_REGEX,
+    AMAZON_PATTERN,
+    ATTR_BODY,
+    ATTR_PATTERN,
+    SENSOR_DATA,
+)
+
+# Amazon patterns
+AMAZON_ORDER_RE = re.compile(AMAZON_PATTERN)
+AMAZON_IMG_RE = re.compile(AMAZON_IMG_PATTERN)
+AMAZON_HUB_SUBJECT_RE = re.compile(AMAZON_HUB_SUBJECT_SEARCH)
+AMAZON_HUB_BODY_RE = re.compile(AMAZON_HUB_BODY)
+AMAZON_OTP_RE = re.compile(AMAZON_OTP_REGEX)
+
+# USPS digest without any scanned mail pieces
+NO_MAILPIECES_RE = re.compile(r"\bimage-no-mailpieces?700\.jpg\b")
+
+# USPS digest mail piece images, matched on the raw html bytes
+MAILPIECE_TAG_RE = re.compile(
+    rb"<img\b[^>]*?\bid\s*=\s*[\"']?mailpiece-image-src-id\b[^>]*>", re.IGNORECASE
+)
+MAILPIECE_DATA_RE = re.compile(rb"data:image/jpeg;base64,([A-Za-z0-9+/=\s]+)")
+
+# A FETCH response line that carries no message data
+FETCH_NO_DATA_RE = re.compile(rb"\d+ \(")
+
+TRACKING_SUFFIX = "_tracking"
+
+
+@functools.lru_cache(maxsize=None)
+def compile_pattern(pattern: str) -> re.Pattern:
+    """Compile a pattern once and reuse it."""
+    return re.compile(pattern)
+
+
+@dataclass(frozen=True)
+class TrackingMatch:
+    """A tracking number and where it was found."""
+
+    number: str
+    start: int
+    end: int
+
+
+def tracking_number(pattern: re.Pattern, value: str) -> str:
+    """Return the tracking number from a pattern match.
+
+    Formats containing a space match a label or prefix along with the
+    number, as DHL's does, so only the part after the space is kept.
+    """
+    if " " in pattern.pattern and len(parts := value.split()) > 1:
+        return parts[1]
+    return value.strip()
+
+
+@functools.lru_cache(maxsize=None)
+def _scanner(sources: tuple) -> re.Pattern:
+    """Combine patterns into a single expression matching any of them.
+
+    Each pattern is a lookahead so overlapping formats all match at the
+    same position, and the final conditionals reject positions where none
+    matched. Groups are named t0, t1, ... in the order of sources.
+    """
+    groups = [f"t{index}" for index in range(len(sources))]
+    lookaheads = "".join(
+        f"(?=(?P<{group}>{source}))?" for group, source in zip(groups, sources)
+    )
+    conditions = "(?!)"
+    for group in reversed(groups):
+        conditions = f"(?({group})|{conditions})"
+    return re.compile(lookaheads + conditions)
+
+
+def scan_tracking(text: str, patterns: dict) -> dict:
+    """Find tracking numbers for several carriers in a single pass.
+
+    Per carrier the matches are the same as re.findall would return:
+    leftmost first and never overlapping.
+
+    Returns dict of carrier to list of TrackingMatch
+    """
+    if not patterns or not text:
+        return {}
+    carriers = list(patterns)
+    scanner = _scanner(tuple(patterns[carrier].pattern for carrier in carriers))
+
+    # Formats may contain groups of their own, so look carriers up by name
+    groups = [(f"t{index}", carrier) for index, carrier in enumerate(carriers)]
+    found = {}
+    resume = dict.fromkeys(carriers, 0)
+    for match in scanner.finditer(text):
+        start = match.start()
+        for group, carrier in groups:
+            value = match.group(group)
+            if value is None or start < resume[carrier]:
+                continue
+            end = start + len(value)
+            resume[carrier] = max(end, start + 1)
+            number = tracking_number(patterns[carrier], value)
+            found.setdefault(carrier, []).append(TrackingMatch(number, start, end))
+    return found
+
+
+def scan_mailpieces(html: bytes) -> Iterator[memoryview]:
+    """Yield the base64 data of every mail piece image in a digest.
+
+    The html is scanned as bytes and each result is a view into it, so
+    nothing is copied or decoded to text before base64 decoding.
+    """
+    view = memoryview(html)
+    for tag in MAILPIECE_TAG_RE.finditer(html):
+        data = MAILPIECE_DATA_RE.search(html, tag.start(), tag.end())
+        if data is not None:
+            yield view[data.start(1) : data.end(1)]
+
+
+@dataclass(frozen=True)
+class SensorMatcher:
+    """Compiled search data for a single SENSOR_DATA entry."""
+
+    sensor: str
+    body: tuple = ()
+    pattern: Optional[re.Pattern] = None
+
+
+def _matcher(sensor: str, sensor_data: dict) -> SensorMatcher:
+    """Compile the patterns of a single sensor."""
+    patterns = sensor_data.get(ATTR_PATTERN)
+    return SensorMatcher(
+        sensor=sensor,
+        body=tuple(
+            (term, compile_pattern(term)) for term in sensor_data.get(ATTR_BODY, ())
+        ),
+        pattern=compile_pattern(patterns[0]) if patterns else None,
+    )
+
+
+class MatcherRegistry(Mapping):
+    """Every SENSOR_DATA entry compiled once, keyed by sensor."""
+
+    def __init__(self, sensor_data: dict) -> None:
+        """Initialize."""
+        self._matchers = {
+            sensor: _matcher(sensor, data) for sensor, data in sensor_data.items()
+        }
+
+        # Tracking patterns by carrier prefix
+        self.tracking = {
+            sensor[: -len(TRACKING_SUFFIX)]: matcher.pattern
+            for sensor, matcher in self._matchers.items()
+            if sensor.endswith(TRACKING_SUFFIX) and matcher.pattern is not None
+        }
+
+    def scan_tracking(self, text: str) -> dict:
+        """Find every carrier's tracking numbers in a single pass.
+
+        Returns dict of carrier to list of TrackingMatch
+        """
+        return scan_tracking(text, self.tracking)
+
+    def __getitem__(self, sensor: str) -> SensorMatcher:
+        """Return the matcher for sensor."""
+        return self._matchers[sensor]
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over sensor names."""
+        return iter(self._matchers)
+
+    def __len__(self) -> int:
+        """Return the number of sensors."""
+        return len(self._matchers)
+
+
+MATCHERS = MatcherRegistry(SENSOR_DATA)
@@ -0,0 +1,103 @@
+"""Lazily parsed email messages for Mail and Packages."""
+
+from __future__ import annotations
+
+import email
+from email.message import Message
+from email.parser import BytesParser
+from typing import Any, Iterator, Optional
+
+from .const import TEXT_TYPES
+
+_BLANK_LINES = (b"\r\n\r\n", b"\n\n")
+
+
+def _header_end(raw: bytes) -> int:
+    """Return the offset of the blank line ending the headers."""
+    ends = [end for end in (raw.find(blank) for blank in _BLANK_LINES) if end != -1]
+    return min(ends) if ends else len(raw)
+
+
+class LazyMessage:
+    """An email message that only parses its body when it is used.
+
+    Header lookups are served from the header block alone. Anything else
+    builds the full message tree on first use and is delegated to it, so
+    a LazyMessage can stand in for email.message.Message.
+    """
+
+    def __init__(self, raw: bytes) -> None:
+        """Initialize."""
+        self._raw = raw
+        self._headers = BytesParser().parsebytes(
+            raw[: _header_end(raw)], headersonly=True
+        )
+        self._message = None
+        self._texts = []
+        self._walker = None
+
+    @property
+    def parsed(self) -> bool:
+        """Return True if the body has been parsed."""
+        return self._message is not None
+
+    @property
+    def message(self) -> Message:
+        """Return the fully parsed message."""
+        if self._message is None:
+            self._message = email.message_from_bytes(self._raw)
+        return self._message
+
+    def __getitem__(self, name: str) -> Optional[str]:
+        """Return a header value."""
+        return self._headers[name]
+
+    def __contains__(self, name: str) -> bool:
+        """Return True if the header is present."""
+        return name in self._headers
+
+    def get(self, name: str, failobj: Any = None) -> Any:
+        """Return a header value or failobj."""
+        return self._headers.get(name, failobj)
+
+    def get_all(self, name: str, failobj: Any = None) -> Any:
+        """Return every value of a header or failobj."""
+        return self._headers.get_all(name, failobj)
+
+    def __getattr__(self, name: str) -> Any:
+        """Delegate everything else to the parsed message."""
+        return getattr(self.message, name)
+
+    def __str__(self) -> str:
+        """Return the whole message as a string."""
+        return str(self.message)
+
+    def texts(self) -> Iterator[str]:
+        """Yield the decoded text parts, decoding each only when reached.
+
+        Decoded parts are kept, so iterating again costs nothing and a
+        caller that stops early never decodes the rest.
+        """
+        index = 0
+        while True:
+            if index < len(self._texts):
+                yield self._texts[index]
+                index += 1
+                continue
+            if self._walker is None:
+                self._walker = _decoded(self.message, TEXT_TYPES)
+            try:
+                self._texts.append(next(self._walker))
+            except StopIteration:
+                return
+
+
+def _decoded(msg: Message, content_types: list) -> Iterator[str]:
+    """Yield the decoded payloads of parts with the given content types."""
+    for part in msg.walk():
+        if part.get_content_type() not in content_types:
+            continue
+        payload = part.get_payload(decode=True)
+        if payload is None:
+            continue
+        yield payload.decode("utf-8", "ignore")
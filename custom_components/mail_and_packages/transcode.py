@@ -0,0 +1,182 @@
+"""Background MP4 generation for Mail and Packages."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from contextlib import suppress
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+from homeassistant.core import HomeAssistant, callback
+
+from .const import DOMAIN
+
+_LOGGER = logging.getLogger(__name__)
+
+DATA_MP4_QUEUE = f"{DOMAIN}_mp4_queue"
+
+
+@dataclass(frozen=True)
+class TranscodeResult:
+    """Outcome of a single ffmpeg run."""
+
+    returncode: Optional[int]
+    duration: float
+
+    @property
+    def success(self) -> bool:
+        """Return True if the MP4 was written."""
+        return self.returncode == 0
+
+
+class Mp4Queue:
+    """Run ffmpeg in the background, one job per MP4 file.
+
+    A newer job for the same file supersedes the one still running, so
+    only the latest GIF is ever transcoded. A job submitted again with
+    the same key while it runs is left to finish. ffmpeg writes to a temporary
+    file that is renamed into place once it succeeds, so a camera never
+    serves a partial MP4.
+    """
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        """Initialize."""
+        self._hass = hass
+        self._jobs = {}
+        self._keys = {}
+        self.results = {}
+
+    def submit(
+        self,
+        gif: str,
+        mp4: str,
+        on_success: Callable[[], None] = None,
+        key: Any = None,
+    ) -> None:
+        """Queue a job from an executor thread.
+
+        on_success runs in the executor after the MP4 is in place.
+        """
+        self._hass.loop.call_soon_threadsafe(
+            self.async_submit, gif, mp4, on_success, key
+        )
+
+    @callback
+    def async_submit(
+        self,
+        gif: str,
+        mp4: str,
+        on_success: Callable[[], None] = None,
+        key: Any = None,
+    ) -> asyncio.Task:
+        """Queue a job, superseding any job for the same MP4.
+
+        key describes what the GIF was built from, a running job with an
+        equal key is returned instead of being restarted.
+        """
+        previous = self._jobs.get(mp4)
+        if (
+            previous is not None
+            and not previous.done()
+            and key is not None
+            and self._keys.get(mp4) == key
+        ):
+            _LOGGER.debug("Keeping running mp4 job for %s", mp4)
+            return previous
+        if previous is not None and not previous.done():
+            _LOGGER.debug("Superseding running mp4 job for %s", mp4)
+            previous.cancel()
+        else:
+            previous = None
+
+        job = self._hass.async_create_background_task(
+            self._async_transcode(gif, mp4, on_success, previous),
+            f"{DOMAIN} mp4 {os.path.basename(mp4)}",
+        )
+        self._jobs[mp4] = job
+        self._keys[mp4] = key
+        job.add_done_callback(lambda done: self._finished(mp4, done))
+        return job
+
+    @callback
+    def _finished(self, mp4: str, job: asyncio.Task) -> None:
+        """Forget a finished job unless it was superseded."""
+        if self._jobs.get(mp4) is job:
+            del self._jobs[mp4]
+            del self._keys[mp4]
+
+    async def _async_transcode(
+        self,
+        gif: str,
+        mp4: str,
+        on_success: Optional[Callable[[], None]],
+        previous: Optional[asyncio.Task],
+    ) -> None:
+        """Transcode gif to mp4."""
+        # Let a superseded job clean up its temporary file first
+        if previous is not None:
+            await asyncio.wait([previous])
+
+        temp = f"{mp4}.part"
+        start = time.monotonic()
+        process = None
+        returncode = None
+        _LOGGER.debug("Generating mp4: %s", mp4)
+        try:
+            process = await asyncio.create_subprocess_exec(
+                "ffmpeg",
+                "-y",
+                "-i",
+                gif,
+                "-pix_fmt",
+                "yuv420p",
+                "-f",
+                "mp4",
+                temp,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+            returncode = await process.wait()
+            if returncode == 0:
+                await self._hass.async_add_executor_job(os.replace, temp, mp4)
+                if on_success is not None:
+                    await self._hass.async_add_executor_job(on_success)
+        except OSError as err:
+            _LOGGER.error("Error generating mp4 %s: %s", mp4, str(err))
+        finally:
+            if process is not None and process.returncode is None:
+                process.kill()
+                await process.wait()
+            if returncode != 0:
+                with suppress(OSError):
+                    os.remove(temp)
+
+            result = TranscodeResult(returncode, time.monotonic() - start)
+            self.results[mp4] = result
+            if result.success:
+                _LOGGER.debug("Generated %s in %.1fs", mp4, result.duration)
+            elif returncode is not None:
+                _LOGGER.error(
+                    "ffmpeg exited with status %s after %.1fs generating %s",
+                    returncode,
+                    result.duration,
+                    mp4,
+                )
+
+    async def async_cancel(self, mp4: Optional[str] = None) -> None:
+        """Cancel the job for mp4, or every job, and wait for them."""
+        jobs = [job for path, job in self._jobs.items() if mp4 is None or path == mp4]
+        for job in jobs:
+            job.cancel()
+        if jobs:
+            await asyncio.wait(jobs)
+
+
+def get_mp4_queue(hass: HomeAssistant) -> Mp4Queue:
+    """Return the MP4 queue shared by every entry."""
+    if DATA_MP4_QUEUE not in hass.data:
+        hass.data[DATA_MP4_QUEUE] = Mp4Queue(hass)
+    return hass.data[DATA_MP4_QUEUE]
@@ -1127,15 +1127,6 @@ def mock_osmakedir_excpetion():
         yield mock_osmakedir
 
 
-@pytest.fixture
-def mock_open_excpetion():
-    """Fixture to mock open."""
-    with patch("builtins.open") as mock_open_excpetion:
-        mock_open_excpetion.side_effect = Exception("File not found")
-
-        yield mock_open_excpetion
-
-
 @pytest.fixture
 def mock_os_path_splitext():
     """Fixture to mock splitext."""
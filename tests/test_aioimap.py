@@ -0,0 +1,307 @@
+"""Tests for aioimap module."""
+
+import asyncio
+
+import pytest
+from homeassistant.const import CONF_HOST, CONF_PORT, CONF_RESOURCES
+
+from custom_components.mail_and_packages import aioimap
+from custom_components.mail_and_packages.cache import RefreshCache
+from custom_components.mail_and_packages.commands import async_run
+from custom_components.mail_and_packages.connection import MailConnection
+from custom_components.mail_and_packages.const import (
+    CONF_IMAP_ASYNC,
+    CONF_IMAP_SECURITY,
+)
+from custom_components.mail_and_packages.helpers import (
+    async_process_emails,
+    email_fetch,
+    email_search,
+    folder_status,
+    selectfolder,
+    vanished_since,
+)
+from tests.const import FAKE_CONFIG_DATA
+
+pytestmark = pytest.mark.asyncio
+
+MESSAGE = b"Subject: Test\r\n\r\nHello\r\n"
+
+
+async def _server(handler):
+    """Start a scripted IMAP server on localhost."""
+
+    async def serve(reader, writer):
+        writer.write(b"* OK IMAP4rev1 ready\r\n")
+        while line := await reader.readline():
+            tag, _, command = line.rstrip(b"\r\n").partition(b" ")
+            for response in await handler(command, reader):
+                writer.write(response.replace(b"TAG", tag) + b"\r\n")
+            await writer.drain()
+            if command == b"LOGOUT":
+                break
+        writer.close()
+
+    return await asyncio.start_server(serve, "127.0.0.1", 0)
+
+
+async def _respond(command, reader):
+    """Answer the commands used by the helpers."""
+    if command == b"CAPABILITY":
+        return [b"* CAPABILITY IMAP4rev1 IDLE", b"TAG OK done"]
+    if command.startswith(b"LOGIN"):
+        return [b"TAG OK [CAPABILITY IMAP4rev1 IDLE UIDPLUS] Logged in"]
+    if command.startswith(b"EXAMINE"):
+        return [
+            b"* 2 EXISTS",
+            b"* OK [UIDVALIDITY 7] UIDs valid",
+            b"* OK [UIDNEXT 3] Predicted next UID",
+            b"TAG OK [READ-ONLY] done",
+        ]
+    if command.startswith(b"SEARCH"):
+        return [b"* SEARCH 1 2", b"TAG OK done"]
+    if command.startswith(b"FETCH"):
+        return [
+            b"* 1 FETCH (RFC822 {%d}" % len(MESSAGE) + b"\r\n" + MESSAGE + b")",
+            b"TAG OK done",
+        ]
+    return [b"TAG OK done"]
+
+
+async def _login(port, timeout=5):
+    """Login to the scripted server."""
+    return await aioimap.async_login(
+        "127.0.0.1", port, "user", "pwd", "", True, timeout
+    )
+
+
+async def test_client(caplog):
+    """Test imaplib shaped responses from the asyncio transport."""
+    server = await _server(_respond)
+    port = server.sockets[0].getsockname()[1]
+
+    async with server:
+        client = await _login(port)
+        try:
+            selected = await client.select('"INBOX"', readonly=True)
+            search = await async_run(
+                client,
+                email_search.steps(client, ["test@example.com"], "01-Jan-2024"),
+            )
+            fetched = await async_run(client, email_fetch.steps(client, "1"))
+        finally:
+            await aioimap.async_logout(client)
+
+    assert client.capabilities == ("IMAP4REV1", "IDLE", "UIDPLUS")
+    assert selected == ("OK", [b"2"])
+    assert search == ("OK", [b"1 2"])
+    assert fetched == ("OK", [(b"1 (RFC822 {%d}" % len(MESSAGE), MESSAGE), b")"])
+
+
+async def test_client_error(caplog):
+    """Test a failed command is raised into the command sequence."""
+
+    async def respond(command, reader):
+        if command.startswith(b"SEARCH"):
+            return [b"TAG BAD unknown charset"]
+        return await _respond(command, reader)
+
+    server = await _server(respond)
+    port = server.sockets[0].getsockname()[1]
+
+    async with server:
+        client = await _login(port)
+        try:
+            search = await async_run(
+                client,
+                email_search.steps(client, ["test@example.com"], "01-Jan-2024"),
+            )
+        finally:
+            await aioimap.async_logout(client)
+
+    assert search[0] == "BAD"
+    assert "Error searching emails" in caplog.text
+
+
+async def test_client_qresync():
+    """Test QRESYNC is enabled and expunged UIDs are reported."""
+    commands = []
+
+    async def respond(command, reader):
+        commands.append(command)
+        if command.startswith(b"LOGIN"):
+            return [b"TAG OK [CAPABILITY IMAP4rev1 CONDSTORE QRESYNC] Logged in"]
+        if command.startswith(b"UID FETCH"):
+            return [
+                b"* VANISHED (EARLIER) 3:4,9",
+                b"* 2 FETCH (UID 5 MODSEQ (12))",
+                b"TAG OK done",
+            ]
+        return await _respond(command, reader)
+
+    server = await _server(respond)
+    port = server.sockets[0].getsockname()[1]
+
+    async with server:
+        client = await _login(port)
+        try:
+            assert await async_run(client, selectfolder.steps(client, '"INBOX"'))
+            vanished = await async_run(
+                client, vanished_since.steps(client, ["1", "3", "5", "9"], 10)
+            )
+        finally:
+            await aioimap.async_logout(client)
+
+    assert vanished == {"3", "9"}
+    assert commands[2:6] == [
+        b'LIST "" *',
+        b"ENABLE QRESYNC",
+        b'EXAMINE "INBOX"',
+        b"UID FETCH 1,3,5,9 (UID) (CHANGEDSINCE 10 VANISHED)",
+    ]
+
+
+async def test_client_uid_search():
+    """Test a None charset is left out like imaplib does."""
+    commands = []
+
+    async def respond(command, reader):
+        commands.append(command)
+        if command.startswith(b"UID SEARCH"):
+            return [b"* SEARCH 5 7", b"TAG OK done"]
+        return await _respond(command, reader)
+
+    server = await _server(respond)
+    port = server.sockets[0].getsockname()[1]
+
+    async with server:
+        client = await _login(port)
+        try:
+            await client.select('"INBOX"', readonly=True)
+            found = await client.uid("SEARCH", None, '(FROM "test@example.com")')
+        finally:
+            await aioimap.async_logout(client)
+
+    assert found == ("OK", [b"5 7"])
+    assert b'UID SEARCH (FROM "test@example.com")' in commands
+
+
+async def test_client_mailbox_state():
+    """Test the selected mailbox is followed through untagged responses."""
+
+    async def respond(command, reader):
+        if command.startswith(b"SEARCH"):
+            # Mail arriving during a search is reported with it
+            return [b"* SEARCH 1 2", b"* 3 EXISTS", b"TAG OK done"]
+        return await _respond(command, reader)
+
+    server = await _server(respond)
+    port = server.sockets[0].getsockname()[1]
+
+    async with server:
+        client = await _login(port)
+        try:
+            assert await async_run(client, selectfolder.steps(client, '"INBOX"'))
+            before = await async_run(client, folder_status.steps(client))
+            await async_run(
+                client,
+                email_search.steps(client, ["test@example.com"], "01-Jan-2024"),
+            )
+            after = await async_run(client, folder_status.steps(client))
+        finally:
+            await aioimap.async_logout(client)
+
+    assert before == {"MESSAGES": 2, "UIDVALIDITY": 7, "UIDNEXT": 3}
+    assert after == {"MESSAGES": 3, "UIDVALIDITY": 7, "UIDNEXT": 3}
+
+
+async def test_client_abort():
+    """Test abort fails a command that is waiting on the server."""
+    stalled = asyncio.Event()
+
+    async def respond(command, reader):
+        if command == b"NOOP":
+            stalled.set()
+            await asyncio.sleep(60)
+        return await _respond(command, reader)
+
+    server = await _server(respond)
+    port = server.sockets[0].getsockname()[1]
+
+    async with server:
+        client = await _login(port, 30)
+        pending = asyncio.ensure_future(client.noop())
+        await stalled.wait()
+        client.abort()
+        with pytest.raises(aioimap.IMAPError):
+            await asyncio.wait_for(pending, 5)
+
+
+async def test_login_error(caplog):
+    """Test connection errors return False like helpers.login."""
+    server = await _server(_respond)
+    port = server.sockets[0].getsockname()[1]
+    server.close()
+    await server.wait_closed()
+
+    assert await _login(port) is False
+    assert "Network error while connecting to server" in caplog.text
+
+
+async def test_process_emails(hass):
+    """Test a refresh with the asyncio transport and an unchanged mailbox."""
+    commands = []
+
+    async def respond(command, reader):
+        commands.append(command)
+        if command.startswith(b"SEARCH"):
+            return [b"* SEARCH", b"TAG OK done"]
+        return await _respond(command, reader)
+
+    server = await _server(respond)
+    config = {
+        **FAKE_CONFIG_DATA,
+        CONF_HOST: "127.0.0.1",
+        CONF_PORT: server.sockets[0].getsockname()[1],
+        CONF_IMAP_SECURITY: "",
+        CONF_IMAP_ASYNC: True,
+        CONF_RESOURCES: ["ups_delivering", "mail_updated"],
+    }
+    connection = MailConnection(config)
+    refresh = RefreshCache()
+
+    async with server:
+        first = await async_process_emails(hass, config, connection, None, refresh)
+        searched = len(commands)
+        second = await async_process_emails(hass, config, connection, None, refresh)
+        await connection.async_close()
+
+    assert first["ups_delivering"] == 0
+    assert "mail_updated" in first
+    assert b"SEARCH" in b" ".join(commands[:searched])
+    # The held session is only asked whether anything changed
+    assert commands[searched:] == [b"NOOP", b"LOGOUT"]
+    assert second["ups_delivering"] == 0
+
+
+async def test_session_dropped_on_error():
+    """Test a client is not reused after a refresh failed with it."""
+    server = await _server(_respond)
+    config = {
+        **FAKE_CONFIG_DATA,
+        CONF_HOST: "127.0.0.1",
+        CONF_PORT: server.sockets[0].getsockname()[1],
+        CONF_IMAP_SECURITY: "",
+        CONF_IMAP_ASYNC: True,
+    }
+    connection = MailConnection(config)
+
+    async with server:
+        with pytest.raises(TimeoutError):
+            async with connection.async_session() as client:
+                raise TimeoutError
+        async with connection.async_session() as other:
+            assert other is not client
+        await connection.async_close()
+
+    assert not connection.connected
@@ -0,0 +1,95 @@
+"""Tests for bodystructure module."""
+
+import email
+
+import pytest
+
+from custom_components.mail_and_packages.bodystructure import (
+    body_parts,
+    build_message,
+    parse_fetch_response,
+    plan_sections,
+    response_section,
+)
+
+pytestmark = pytest.mark.asyncio
+
+DIGEST = (
+    b'1 (UID 7 BODYSTRUCTURE ((("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL'
+    b' "QUOTED-PRINTABLE" 120 4 NIL NIL NIL)("TEXT" "HTML" ("CHARSET" "utf-8")'
+    b' NIL NIL "QUOTED-PRINTABLE" 900 20 NIL NIL NIL) "ALTERNATIVE"'
+    b' ("BOUNDARY" "b1") NIL NIL)("IMAGE" "JPEG" ("NAME" "a.jpg") "<id1>" NIL'
+    b' "BASE64" 5000 NIL ("INLINE" ("FILENAME" "mailpiece.jpg")) NIL) "MIXED"'
+    b' ("BOUNDARY" "b0") NIL NIL))'
+)
+FORWARDED = (
+    b'3 (UID 10 BODYSTRUCTURE (("TEXT" "PLAIN" NIL NIL NIL "7BIT" 5 1 NIL NIL'
+    b' NIL)("MESSAGE" "RFC822" NIL NIL NIL "7BIT" 500 (NIL "subj" NIL NIL NIL'
+    b' NIL NIL NIL NIL NIL) (("TEXT" "PLAIN" NIL NIL NIL "7BIT" 5 1 NIL NIL'
+    b' NIL)("TEXT" "HTML" NIL NIL NIL "7BIT" 5 1 NIL NIL NIL) "ALTERNATIVE" NIL'
+    b' NIL NIL) 20 NIL NIL NIL) "MIXED" NIL NIL NIL))'
+)
+
+
+async def test_parse_fetch_response():
+    """Test FETCH responses with literals."""
+    result = parse_fetch_response(
+        [
+            DIGEST,
+            (b'2 (UID 9 BODYSTRUCTURE ("TEXT" "HTML" ("CHARSET" {5}', b"utf-8"),
+            b') NIL NIL "7BIT" 10 1 NIL NIL NIL))',
+        ]
+    )
+    assert list(result) == [1, 2]
+    assert result[1]["UID"] == "7"
+    assert result[2]["BODYSTRUCTURE"][2] == ["CHARSET", "utf-8"]
+
+
+async def test_parse_fetch_response_error():
+    """Test responses without a FETCH item list."""
+    with pytest.raises(ValueError):
+        parse_fetch_response([(b"", b"From: test@example.com\r\n\r\nBody")])
+
+
+async def test_body_parts():
+    """Test section numbers of nested and attached messages."""
+    digest = body_parts(parse_fetch_response([DIGEST])[1]["BODYSTRUCTURE"])
+    assert [(part.section, part.content_type) for part in digest] == [
+        ("1.1", "text/plain"),
+        ("1.2", "text/html"),
+        ("2", "image/jpeg"),
+    ]
+    assert digest[2].filename == "mailpiece.jpg"
+    assert [part.section for part in plan_sections(digest, ["image/jpeg"])] == ["2"]
+
+    forwarded = body_parts(parse_fetch_response([FORWARDED])[3]["BODYSTRUCTURE"])
+    assert [part.section for part in forwarded] == ["1", "2.1", "2.2"]
+
+    single = body_parts(["TEXT", "HTML", None, None, None, "7BIT", 10, 1])
+    assert single[0].section == "1"
+
+
+async def test_response_section():
+    """Test literals are matched to their section."""
+    assert response_section(b"1 (UID 5 BODY[2.1] {300}") == "2.1"
+    assert (
+        response_section(b"1 (BODY[HEADER.FIELDS (FROM SUBJECT DATE)] {50}")
+        == "HEADER.FIELDS (FROM SUBJECT DATE)"
+    )
+    assert response_section(b"") is None
+
+
+async def test_build_message():
+    """Test fetched parts are parsed like the original message."""
+    parts = body_parts(parse_fetch_response([DIGEST])[1]["BODYSTRUCTURE"])
+    raw = build_message(
+        b"Subject: Your Daily Digest\r\n\r\n",
+        [(parts[1], b"<b>Hello=3D</b>"), (parts[2], b"aGVsbG8=")],
+    )
+    msg = email.message_from_bytes(raw)
+    assert msg["subject"] == "Your Daily Digest"
+    found = [part for part in msg.walk() if not part.is_multipart()]
+    assert found[0].get_content_type() == "text/html"
+    assert found[0].get_payload(decode=True) == b"<b>Hello=</b>"
+    assert found[1].get_filename() == "mailpiece.jpg"
+    assert found[1].get_payload(decode=True) == b"hello"
@@ -0,0 +1,400 @@
+"""Tests for cache module."""
+
+import io
+import json
+
+import pytest
+
+from custom_components.mail_and_packages.cache import (
+    MANIFEST_FILE,
+    ImageCache,
+    MessageCache,
+    RefreshCache,
+)
+from custom_components.mail_and_packages.classifier import classify_emails
+from custom_components.mail_and_packages.helpers import selectfolder
+from tests.const import FAKE_CONFIG_DATA
+
+pytestmark = pytest.mark.asyncio
+
+UPS_SENSORS = ["ups_delivered", "ups_delivering", "ups_packages"]
+
+
+def _mailbox(mock_conn, uidvalidity=1, uidnext=2, uids=b"1", vanished=None, **extra):
+    """Serve NOOP, untagged responses and UID commands from the fixture.
+
+    extra adds untagged responses such as EXISTS and HIGHESTMODSEQ. Each
+    is read once, like imaplib. vanished answers UID FETCH CHANGEDSINCE.
+    """
+    responses = dict(uidvalidity=uidvalidity, uidnext=uidnext, **extra)
+    pending = {
+        name.upper(): [str(value).encode()]
+        for name, value in responses.items()
+        if value is not None
+    }
+    mock_conn.noop.return_value = ("OK", [b"NOOP completed"])
+    mock_conn.response.side_effect = lambda name: (name, pending.pop(name, [None]))
+
+    def uid(command, *args):
+        if command == "SEARCH":
+            return ("OK", [uids])
+        if "CHANGEDSINCE" in args[-1]:
+            if vanished is not None:
+                pending["VANISHED"] = [vanished]
+            return ("OK", [None])
+        return mock_conn.fetch.return_value
+
+    mock_conn.uid.side_effect = uid
+
+
+def _uid_fetches(mock_conn):
+    """Return the number of messages downloaded with UID FETCH."""
+    return len(
+        [
+            c
+            for c in mock_conn.uid.call_args_list
+            if c.args[0] == "FETCH" and c.args[2] == "(RFC822)"
+        ]
+    )
+
+
+async def test_cache_incremental(hass, mock_imap_ups_out_for_delivery):
+    """Test cached messages are not fetched again."""
+    _mailbox(mock_imap_ups_out_for_delivery)
+    cache = MessageCache(hass, "test")
+
+    first = classify_emails(
+        mock_imap_ups_out_for_delivery, FAKE_CONFIG_DATA, UPS_SENSORS, cache
+    )
+    second = classify_emails(
+        mock_imap_ups_out_for_delivery, FAKE_CONFIG_DATA, UPS_SENSORS, cache
+    )
+
+    assert first == second
+    assert first["ups_delivering"] == 1
+    assert first["ups_tracking"] == ["1Z2345YY0678901234"]
+    assert _uid_fetches(mock_imap_ups_out_for_delivery) == 1
+    assert mock_imap_ups_out_for_delivery.fetch.call_count == 0
+    assert cache.uidvalidity == 1
+    assert cache.uidnext == 2
+    assert len(cache) == 1
+
+
+async def test_cache_new_message(hass, mock_imap_ups_out_for_delivery):
+    """Test only new UIDs are fetched and expunged UIDs are pruned."""
+    _mailbox(mock_imap_ups_out_for_delivery)
+    cache = MessageCache(hass, "test")
+    classify_emails(
+        mock_imap_ups_out_for_delivery, FAKE_CONFIG_DATA, UPS_SENSORS, cache
+    )
+
+    _mailbox(mock_imap_ups_out_for_delivery, uidnext=3, uids=b"2")
+    classify_emails(
+        mock_imap_ups_out_for_delivery, FAKE_CONFIG_DATA, UPS_SENSORS, cache
+    )
+
+    assert _uid_fetches(mock_imap_ups_out_for_delivery) == 2
+    assert "1" not in cache
+    assert "2" in cache
+    assert cache.uidnext == 3
+
+
+async def test_cache_uidvalidity(hass, mock_imap_ups_out_for_delivery, caplog):
+    """Test a new UIDVALIDITY drops the cache."""
+    _mailbox(mock_imap_ups_out_for_delivery)
+    cache = MessageCache(hass, "test")
+    classify_emails(
+        mock_imap_ups_out_for_delivery, FAKE_CONFIG_DATA, UPS_SENSORS, cache
+    )
+
+    _mailbox(mock_imap_ups_out_for_delivery, uidvalidity=2)
+    classify_emails(
+        mock_imap_ups_out_for_delivery, FAKE_CONFIG_DATA, UPS_SENSORS, cache
+    )
+
+    assert "Message cache invalidated" in caplog.text
+    assert _uid_fetches(mock_imap_ups_out_for_delivery) == 2
+    assert cache.uidvalidity == 2
+
+
+async def test_cache_other_mailbox(hass, mock_imap_ups_out_for_delivery, caplog):
+    """Test another folder with the same UIDVALIDITY drops the cache."""
+    _mailbox(mock_imap_ups_out_for_delivery)
+    cache = MessageCache(hass, "test")
+    classify_emails(
+        mock_imap_ups_out_for_delivery, FAKE_CONFIG_DATA, UPS_SENSORS, cache
+    )
+
+    _mailbox(mock_imap_ups_out_for_delivery)
+    config = {**FAKE_CONFIG_DATA, "folder": '"Archive"'}
+    classify_emails(mock_imap_ups_out_for_delivery, config, UPS_SENSORS, cache)
+
+    assert "Message cache invalidated" in caplog.text
+    assert _uid_fetches(mock_imap_ups_out_for_delivery) == 2
+    assert cache.uidvalidity == 1
+
+
+async def test_cache_no_uidvalidity(hass, mock_imap_ups_out_for_delivery):
+    """Test sessions without a UIDVALIDITY fall back to fetching everything."""
+    mock_imap_ups_out_for_delivery.noop.return_value = ("OK", [b"NOOP completed"])
+    mock_imap_ups_out_for_delivery.response.return_value = ("UIDVALIDITY", [None])
+    cache = MessageCache(hass, "test")
+
+    result = classify_emails(
+        mock_imap_ups_out_for_delivery, FAKE_CONFIG_DATA, UPS_SENSORS, cache
+    )
+
+    assert result["ups_delivering"] == 1
+    # Headers, BODYSTRUCTURE and then the body
+    assert mock_imap_ups_out_for_delivery.fetch.call_count == 3
+    assert len(cache) == 0
+
+
+def _searches(mock_conn):
+    """Return the criteria of every UID SEARCH."""
+    return [c.args[2] for c in mock_conn.uid.call_args_list if c.args[0] == "SEARCH"]
+
+
+async def test_cache_unchanged(hass, mock_imap_ups_out_for_delivery):
+    """Test an unchanged mailbox is not searched again."""
+    _mailbox(mock_imap_ups_out_for_delivery, exists=1)
+    cache = MessageCache(hass, "test")
+
+    first = classify_emails(
+        mock_imap_ups_out_for_delivery, FAKE_CONFIG_DATA, UPS_SENSORS, cache
+    )
+    searched = len(_searches(mock_imap_ups_out_for_delivery))
+    second = classify_emails(
+        mock_imap_ups_out_for_delivery, FAKE_CONFIG_DATA, UPS_SENSORS, cache
+    )
+
+    assert first == second
+    assert len(_searches(mock_imap_ups_out_for_delivery)) == searched
+    assert _uid_fetches(mock_imap_ups_out_for_delivery) == 1
+
+
+async def test_cache_new_uids(hass, mock_imap_ups_out_for_delivery):
+    """Test without QRESYNC only UIDs from the last UIDNEXT are searched."""
+    mock_conn = mock_imap_ups_out_for_delivery
+    _mailbox(mock_conn, exists=1)
+    cache = MessageCache(hass, "test")
+    classify_emails(mock_conn, FAKE_CONFIG_DATA, UPS_SENSORS, cache)
+
+    # Message 2 arrived
+    mock_conn.uid.reset_mock()
+    _mailbox(mock_conn, uidnext=3, uids=b"2", exists=2)
+    classify_emails(mock_conn, FAKE_CONFIG_DATA, UPS_SENSORS, cache)
+
+    assert all(search.startswith("UID 2:*") for search in _searches(mock_conn))
+    assert _uid_fetches(mock_conn) == 1
+    assert cache.search(cache._search["key"])["uids"] == ["1", "2"]
+
+
+async def test_cache_new_uids_expunged(hass, mock_imap_ups_out_for_delivery):
+    """Test without QRESYNC an expunge falls back to a full search."""
+    mock_conn = mock_imap_ups_out_for_delivery
+    _mailbox(mock_conn, exists=1)
+    cache = MessageCache(hass, "test")
+    classify_emails(mock_conn, FAKE_CONFIG_DATA, UPS_SENSORS, cache)
+
+    # Message 1 was expunged and message 2 arrived
+    mock_conn.uid.reset_mock()
+    _mailbox(mock_conn, uidnext=3, uids=b"2", expunge=1, exists=1)
+    classify_emails(mock_conn, FAKE_CONFIG_DATA, UPS_SENSORS, cache)
+
+    assert not all(search.startswith("UID ") for search in _searches(mock_conn))
+    assert "1" not in cache
+    assert cache.search(cache._search["key"])["uids"] == ["2"]
+
+
+async def test_cache_qresync(hass, mock_imap_ups_out_for_delivery):
+    """Test only the changes since the last MODSEQ are searched."""
+    mock_conn = mock_imap_ups_out_for_delivery
+    mock_conn.capabilities = ("IMAP4REV1", "CONDSTORE", "QRESYNC")
+    mock_conn.enable.return_value = ("OK", [])
+    assert selectfolder(mock_conn, '"INBOX"')
+    mock_conn.enable.assert_called_once_with("QRESYNC")
+    _mailbox(mock_conn, exists=1, highestmodseq=10)
+    cache = MessageCache(hass, "test")
+    classify_emails(mock_conn, FAKE_CONFIG_DATA, UPS_SENSORS, cache)
+    assert cache.search(cache._search["key"])["modseq"] == 10
+
+    # Message 1 was expunged and message 2 arrived, NOOP reports no UIDNEXT
+    mock_conn.uid.reset_mock()
+    _mailbox(
+        mock_conn,
+        uidvalidity=None,
+        uidnext=None,
+        uids=b"2",
+        vanished=b"(EARLIER) 1",
+        expunge=1,
+        exists=1,
+    )
+    result = classify_emails(mock_conn, FAKE_CONFIG_DATA, UPS_SENSORS, cache)
+
+    assert result["ups_delivering"] == 1
+    assert all(search.startswith("UID 2:* ") for search in _searches(mock_conn))
+    assert mock_conn.uid.call_args_list[0].args == (
+        "FETCH",
+        "1",
+        "(UID) (CHANGEDSINCE 10 VANISHED)",
+    )
+    assert _uid_fetches(mock_conn) == 1
+    assert "1" not in cache
+    assert "2" in cache
+    assert cache.search(cache._search["key"])["uids"] == ["2"]
+
+
+async def test_cache_persist(hass, hass_storage):
+    """Test the cache survives a restart."""
+    cache = MessageCache(hass, "test")
+    cache.validate(1, "abc")
+    cache.add("1", {"from": "mcinfo@ups.com"})
+    cache.advance(2)
+    cache.record_search("key", ["1"], [], {"UIDNEXT": 2, "HIGHESTMODSEQ": 5})
+    await cache.async_save()
+
+    restored = MessageCache(hass, "test")
+    await restored.async_load()
+    assert restored.uidvalidity == 1
+    assert restored.uidnext == 2
+    assert restored.get("1") == {"from": "mcinfo@ups.com"}
+    assert restored.search("key")["modseq"] == 5
+
+    await restored.async_remove()
+    assert len(restored) == 0
+
+
+def _resize(resized):
+    """Return a resize callable that records what it was asked for."""
+
+    def resize(images):
+        resized.extend(images)
+        return {
+            name: f"frame-{image.getvalue().decode()}" for name, image in images.items()
+        }
+
+    return resize
+
+
+async def test_image_cache_frames():
+    """Test frames are only resized once per content and size."""
+    cache = ImageCache()
+    resized = []
+    images = {"a.jpg": io.BytesIO(b"a"), "b.jpg": io.BytesIO(b"b")}
+    first = cache.frames(images, 724, 320, _resize(resized))
+    assert [frame for _, frame in first.values()] == ["frame-a", "frame-b"]
+
+    # Same content under a new name, in a new order
+    images = {"c.jpg": io.BytesIO(b"b"), "d.jpg": io.BytesIO(b"d")}
+    second = cache.frames(images, 724, 320, _resize(resized))
+    assert resized == ["a.jpg", "b.jpg", "d.jpg"]
+    assert second["c.jpg"] == first["b.jpg"]
+    assert list(second) == ["c.jpg", "d.jpg"]
+
+    # Another size is another frame
+    cache.frames({"a.jpg": io.BytesIO(b"a")}, 100, 100, _resize(resized))
+    assert resized[-1] == "a.jpg"
+    assert len(cache) == 4
+
+
+async def test_image_cache_evict():
+    """Test the oldest frames are dropped first."""
+    cache = ImageCache(max_frames=2)
+    resized = []
+    for name in ("a", "b", "a", "c"):
+        cache.frames({name: io.BytesIO(name.encode())}, 1, 1, _resize(resized))
+    assert len(cache) == 2
+    cache.frames({"b": io.BytesIO(b"b")}, 1, 1, _resize(resized))
+    assert resized == ["a", "b", "c", "b"]
+
+
+async def test_image_cache_unreadable():
+    """Test images that could not be resized are left out."""
+    cache = ImageCache()
+    found = cache.frames({"bad.jpg": io.BytesIO(b"x")}, 1, 1, lambda images: {})
+    assert found == {}
+    assert len(cache) == 0
+
+
+async def test_image_cache_outputs(tmp_path):
+    """Test files are only unchanged when built from the same frames."""
+    gif = str(tmp_path / "mail_today.gif")
+    cache = ImageCache()
+    assert not cache.unchanged(gif, {"images": ["a"]})
+    cache.record(gif, {"images": ["a"]})
+    # Nothing was written
+    assert not cache.unchanged(gif, {"images": ["a"]})
+    assert not cache.owns(gif)
+
+    (tmp_path / "mail_today.gif").write_bytes(b"GIF89a")
+    cache.record(gif, {"images": ["a"]})
+    assert cache.unchanged(gif, {"images": ["a"]})
+    assert not cache.unchanged(gif, {"images": ["a", "b"]})
+    assert cache.owns(gif)
+
+    # The placeholder image copied over it
+    (tmp_path / "mail_today.gif").write_bytes(b"GIF89a placeholder")
+    assert not cache.unchanged(gif, {"images": ["a"]})
+    assert not cache.owns(gif)
+
+
+async def test_image_cache_manifest(tmp_path):
+    """Test the manifest is kept next to the images across restarts."""
+    gif = str(tmp_path / "mail_today.gif")
+    mp4 = str(tmp_path / "mail_today.mp4")
+    (tmp_path / "mail_today.gif").write_bytes(b"GIF89a")
+    (tmp_path / "mail_today.mp4").write_bytes(b"")
+    ImageCache().record(gif, {"images": ["a"], "duration": 5})
+    ImageCache().record(mp4, {"images": ["a"], "duration": 5})
+
+    manifest = json.loads((tmp_path / MANIFEST_FILE).read_text())
+    assert {name: entry["key"] for name, entry in manifest.items()} == {
+        "mail_today.gif": {"images": ["a"], "duration": 5},
+        "mail_today.mp4": {"images": ["a"], "duration": 5},
+    }
+    assert manifest["mail_today.gif"]["stat"][0] == 6
+    cache = ImageCache()
+    assert cache.unchanged(gif, {"images": ["a"], "duration": 5})
+    assert not cache.unchanged(mp4, {"images": ["b"], "duration": 5})
+
+
+async def test_image_cache_manifest_pruned(tmp_path):
+    """Test files that were removed are dropped from the manifest."""
+    cache = ImageCache()
+    for name in ("first.gif", "second.gif"):
+        (tmp_path / name).write_bytes(b"GIF89a")
+        cache.record(str(tmp_path / name), {"images": [name]})
+
+    (tmp_path / "first.gif").unlink()
+    (tmp_path / "third.gif").write_bytes(b"GIF89a")
+    cache.record(str(tmp_path / "third.gif"), {"images": ["third.gif"]})
+
+    manifest = json.loads((tmp_path / MANIFEST_FILE).read_text())
+    assert sorted(manifest) == ["second.gif", "third.gif"]
+    assert not cache.owns(str(tmp_path / "first.gif"))
+
+
+async def test_image_cache_bad_manifest(tmp_path, caplog):
+    """Test an unreadable manifest is treated as empty."""
+    (tmp_path / "mail_today.gif").write_bytes(b"GIF89a")
+    (tmp_path / MANIFEST_FILE).write_text("{not json")
+    assert not ImageCache().unchanged(str(tmp_path / "mail_today.gif"), {})
+    assert "Unable to read image manifest" in caplog.text
+
+
+async def test_refresh_cache():
+    """Test the previous data is only returned while nothing changed."""
+    refresh = RefreshCache()
+    status = {"MESSAGES": 3, "UIDNEXT": 4, "UIDVALIDITY": 1}
+    assert refresh.get(status, "11-Sep-2020") is None
+
+    data = {"usps_mail": 2}
+    refresh.record(status, "11-Sep-2020", data)
+    data["usps_mail"] = 5
+    assert refresh.get(dict(status), "11-Sep-2020") == {"usps_mail": 2}
+    assert refresh.get({**status, "MESSAGES": 2}, "11-Sep-2020") is None
+    assert refresh.get(status, "12-Sep-2020") is None
+
+    refresh.clear()
+    assert refresh.get(status, "11-Sep-2020") is None
@@ -175,6 +175,70 @@ async def test_async_camera_image_file_error(
         assert "Could not read camera" in caplog.text
 
 
+async def test_async_camera_image_cache(
+    hass,
+    integration,
+    mock_imap_no_email,
+    mock_osremove,
+    mock_osmakedir,
+    mock_listdir,
+    mock_update_time,
+    mock_copy_overlays,
+    mock_hash_file,
+    mock_getctime_today,
+    mock_update,
+    tmp_path,
+):
+    """Test repeat requests are served from memory until the file changes."""
+    entry = integration
+    cameras = hass.data[DOMAIN][entry.entry_id][CAMERA]
+    image = tmp_path / "mail_today.gif"
+    image.write_bytes(b"GIF89a-first")
+    cameras[0]._file_path = str(image)
+
+    assert await cameras[0].async_camera_image() == b"GIF89a-first"
+    with patch("builtins.open", side_effect=AssertionError):
+        assert await cameras[0].async_camera_image() == b"GIF89a-first"
+
+    image.write_bytes(b"GIF89a-second")
+    assert await cameras[0].async_camera_image() == b"GIF89a-second"
+
+
+async def test_async_camera_image_scaled(
+    hass,
+    integration,
+    mock_imap_no_email,
+    mock_osremove,
+    mock_osmakedir,
+    mock_listdir,
+    mock_update_time,
+    mock_copy_overlays,
+    mock_hash_file,
+    mock_getctime_today,
+    mock_update,
+    tmp_path,
+):
+    """Test scaled renditions are kept until the file changes."""
+    entry = integration
+    cameras = hass.data[DOMAIN][entry.entry_id][CAMERA]
+    image = tmp_path / "mail_today.gif"
+    image.write_bytes(b"GIF89a-first")
+    cameras[0]._file_path = str(image)
+
+    with patch(
+        "custom_components.mail_and_packages.camera.scale_image",
+        side_effect=lambda content, width, height: content[:6] + b"-small",
+    ) as mock_scale:
+        assert await cameras[0].async_camera_image(200, 100) == b"GIF89a-small"
+        assert await cameras[0].async_camera_image(200, 100) == b"GIF89a-small"
+        assert await cameras[0].async_camera_image() == b"GIF89a-first"
+        assert mock_scale.call_count == 1
+
+        image.write_bytes(b"GIF89a-second")
+        await cameras[0].async_camera_image(200, 100)
+        assert mock_scale.call_count == 2
+
+
 async def test_async_on_demand_update(
     hass,
     integration,
@@ -0,0 +1,178 @@
+"""Tests for capabilities module."""
+
+import imaplib
+from unittest import mock
+
+import pytest
+
+from custom_components.mail_and_packages.capabilities import (
+    CAPABILITIES,
+    QUIRK_FAILURES,
+    QUIRK_PARTIAL_FETCH,
+    QUIRK_UTF8_SEARCH,
+    CapabilityCache,
+)
+from custom_components.mail_and_packages.helpers import (
+    email_fetch,
+    email_search,
+    selectfolder,
+)
+
+pytestmark = pytest.mark.asyncio
+
+MESSAGE = (b"1 (UID 7 BODY[] {9}", b"Subject: ")
+
+
+def _account(host, capabilities=("IMAP4REV1",), port=993, user="user"):
+    """Return a fake session for host."""
+    account = mock.Mock(host=host, port=port, user=user, capabilities=capabilities)
+    account.capability.return_value = ("OK", [b"IMAP4rev1 IDLE ESEARCH X-GM-EXT-1"])
+    account.list.return_value = ("OK", [])
+    account.select.return_value = ("OK", [b"1"])
+    return account
+
+
+async def test_probe():
+    """Test the capabilities after login replace the greeting's."""
+    account = _account("probe.example.com", ("IMAP4REV1", "STARTTLS"))
+    server = CAPABILITIES.probe(account)
+
+    assert server.supports("idle")
+    assert server.supports("X-GM-EXT-1")
+    assert server.supports("ESEARCH")
+    # Capabilities the session saw itself are kept as well
+    assert server.supports("STARTTLS")
+    assert not server.supports("CONDSTORE")
+    assert server.utf8_search is None
+
+    # The next login replaces them
+    account.capability.return_value = ("OK", [b"IMAP4rev1"])
+    account.capabilities = ("IMAP4REV1",)
+    assert not CAPABILITIES.probe(account).supports("IDLE")
+
+
+async def test_server_key():
+    """Test servers are told apart by port and user."""
+    imaps = CAPABILITIES.probe(_account("key.example.com"))
+    imap = CAPABILITIES.server(_account("key.example.com", port=143))
+    other = CAPABILITIES.server(_account("key.example.com", user="other"))
+
+    assert imaps.supports("IDLE")
+    assert not imap.supports("IDLE")
+    assert not other.supports("IDLE")
+    assert CAPABILITIES.server(_account("key.example.com")) is imaps
+
+
+async def test_partial_fetch_learned():
+    """Test servers answering only BODY[] are detected once."""
+    account = _account("body.example.com")
+
+    def fetch(message_set, parts):
+        if parts == "BODY[]":
+            return ("OK", [MESSAGE, b")"])
+        return ("OK", [b"1 (UID 7)"])
+
+    account.fetch.side_effect = fetch
+
+    for _ in range(QUIRK_FAILURES - 1):
+        assert email_fetch(account, "1") == ("OK", [MESSAGE, b")"])
+    # A single odd answer is not enough
+    assert QUIRK_PARTIAL_FETCH not in CAPABILITIES.server(account).quirks
+    assert email_fetch(account, "1") == ("OK", [MESSAGE, b")"])
+    assert CAPABILITIES.server(account).quirks[QUIRK_PARTIAL_FETCH] is False
+
+    account.fetch.reset_mock()
+    assert email_fetch(account, "1") == ("OK", [MESSAGE, b")"])
+    account.fetch.assert_called_once_with("1", "BODY[]")
+
+
+async def test_partial_fetch_supported():
+    """Test normal servers are never asked twice."""
+    account = _account("rfc822.example.com")
+    account.fetch.return_value = ("OK", [MESSAGE, b")"])
+
+    email_fetch(account, "1")
+    email_fetch(account, "1")
+
+    assert CAPABILITIES.server(account).quirks[QUIRK_PARTIAL_FETCH] is True
+    assert account.fetch.call_args_list == [mock.call("1", "(RFC822)")] * 2
+
+
+async def test_known_quirks():
+    """Test iCloud fetches BODY[] without learning it first."""
+    account = _account("imap.mail.me.com")
+    account.uid.return_value = ("OK", [MESSAGE, b")"])
+
+    email_fetch(account, "7", uid=True)
+    account.uid.assert_called_once_with("FETCH", "7", "BODY[]")
+
+
+async def test_utf8_search_learned():
+    """Test a refused UTF-8 search is not tried again."""
+    account = _account("ascii.example.com")
+    account.search.side_effect = imaplib.IMAP4.error("SEARCH command error: BAD")
+
+    for _ in range(QUIRK_FAILURES):
+        result = email_search(
+            account, ["test@example.com"], "01-Jan-2024", "Zustellung ü"
+        )
+        assert result[0] == "BAD"
+    assert CAPABILITIES.server(account).quirks[QUIRK_UTF8_SEARCH] is False
+
+    result = email_search(account, ["test@example.com"], "01-Jan-2024", "Paket ü")
+    assert result == ("BAD", [b""])
+    assert account.search.call_count == QUIRK_FAILURES
+
+
+async def test_quirk_failures_reset():
+    """Test a success in between starts counting failures again."""
+    account = _account("sometimes.example.com")
+    for value in [False] * (QUIRK_FAILURES - 1) + [True] + [False]:
+        CAPABILITIES.learn(account, QUIRK_UTF8_SEARCH, value)
+    assert CAPABILITIES.server(account).utf8_search is True
+
+
+async def test_utf8_search_lost_connection():
+    """Test a lost connection teaches nothing."""
+    account = _account("flaky.example.com")
+    account.search.side_effect = imaplib.IMAP4.abort("socket error: EOF")
+
+    email_search(account, ["test@example.com"], "01-Jan-2024", "Zustellung ü")
+    assert CAPABILITIES.server(account).utf8_search is None
+
+
+async def test_utf8_accept():
+    """Test UTF8=ACCEPT servers are trusted with UTF-8 searches."""
+    account = _account("utf8.example.com", ("IMAP4REV1", "UTF8=ACCEPT"))
+    assert CAPABILITIES.server(account).utf8_search is True
+
+
+async def test_enable_refused():
+    """Test a refused ENABLE is not sent again."""
+    account = _account("qresync.example.com", ("IMAP4REV1", "QRESYNC"))
+    account.enable.side_effect = imaplib.IMAP4.error("ENABLE command error: NO")
+
+    assert selectfolder(account, '"INBOX"')
+    assert selectfolder(account, '"INBOX"')
+
+    assert account.enable.call_count == 1
+    assert CAPABILITIES.server(account).enabled == {"QRESYNC": False}
+
+
+async def test_persist(hass, hass_storage):
+    """Test capabilities and quirks survive a restart."""
+    cache = CapabilityCache()
+    await cache.async_load(hass)
+    account = _account("persist.example.com")
+    cache.probe(account)
+    for _ in range(QUIRK_FAILURES):
+        cache.learn(account, QUIRK_PARTIAL_FETCH, False)
+    cache.record_enabled(account, "QRESYNC", True)
+    await cache.async_save()
+
+    restored = CapabilityCache()
+    await restored.async_load(hass)
+    server = restored.server(_account("persist.example.com", ()))
+    assert server.supports("IDLE")
+    assert not server.partial_fetch
+    assert server.enabled == {"QRESYNC": True}
@@ -0,0 +1,200 @@
+"""Tests for classifier module."""
+
+from unittest.mock import call
+
+import pytest
+
+from custom_components.mail_and_packages.classifier import (
+    MessageClassifier,
+    classify_emails,
+)
+from custom_components.mail_and_packages.const import HEADER_FIELDS, HEADER_PARTS
+from tests.const import FAKE_CONFIG_DATA
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_classify_ups(mock_imap_ups_out_for_delivery):
+    """Test a single fetch fills every UPS sensor."""
+    headers = mock_imap_ups_out_for_delivery.fetch.return_value
+    mock_imap_ups_out_for_delivery.fetch.side_effect = [
+        headers,
+        (
+            "OK",
+            [
+                b'1 (BODYSTRUCTURE ("TEXT" "PLAIN" ("CHARSET" "UTF-8") NIL NIL'
+                b' "7BIT" 32 1 NIL NIL NIL))'
+            ],
+        ),
+        (
+            "OK",
+            [
+                (
+                    b"1 (BODY[HEADER.FIELDS (FROM SUBJECT DATE)] {84}",
+                    b"From: mcinfo@ups.com\r\n"
+                    b"Subject: UPS Update: Follow Your Delivery on a Live Map\r\n\r\n",
+                ),
+                (b" BODY[1] {32}", b"Your package 1Z2345YY0678901234"),
+                b")",
+            ],
+        ),
+    ]
+    result = classify_emails(
+        mock_imap_ups_out_for_delivery,
+        FAKE_CONFIG_DATA,
+        ["ups_delivered", "ups_delivering", "ups_packages", "mail_updated"],
+    )
+    assert result == {
+        "ups_delivered": 0,
+        "ups_delivering": 1,
+        "ups_tracking": ["1Z2345YY0678901234"],
+        "ups_packages": 1,
+    }
+    assert mock_imap_ups_out_for_delivery.search.call_count == 1
+    # Tracking number is not in the subject, so the text parts are downloaded
+    assert mock_imap_ups_out_for_delivery.fetch.call_args_list == [
+        call("1", HEADER_PARTS),
+        call("1", "(BODYSTRUCTURE)"),
+        call("1", f"({HEADER_FIELDS} BODY.PEEK[1])"),
+    ]
+
+
+async def test_classify_headers_only(mock_imap_fedex_out_for_delivery):
+    """Test tracking numbers in the subject skip the body download."""
+    result = classify_emails(
+        mock_imap_fedex_out_for_delivery,
+        FAKE_CONFIG_DATA,
+        ["fedex_delivering", "fedex_delivered"],
+    )
+    assert result["fedex_delivering"] == 1
+    assert result["fedex_tracking"] == ["61290912345678912345"]
+    assert mock_imap_fedex_out_for_delivery.fetch.call_args_list == [
+        call("1", HEADER_PARTS)
+    ]
+
+
+async def test_classify_unrelated(mock_imap_usps_informed_digest):
+    """Test messages no sensor reads from are never downloaded."""
+    result = classify_emails(
+        mock_imap_usps_informed_digest, FAKE_CONFIG_DATA, ["usps_delivering"]
+    )
+    assert result["usps_delivering"] == 0
+    assert mock_imap_usps_informed_digest.fetch.call_args_list == [
+        call("1", HEADER_PARTS)
+    ]
+
+
+async def test_classify_body(mock_imap_dhl_out_for_delivery):
+    """Test body search terms are counted."""
+    result = classify_emails(
+        mock_imap_dhl_out_for_delivery,
+        FAKE_CONFIG_DATA,
+        ["dhl_delivering", "usps_delivering"],
+    )
+    assert result["dhl_delivering"] == 1
+    assert result["dhl_tracking"] == ["4212345678"]
+    assert result["usps_delivering"] == 0
+
+
+async def test_classify_amazon(mock_imap_amazon_the_hub_2):
+    """Test Amazon hub codes."""
+    result = classify_emails(
+        mock_imap_amazon_the_hub_2, FAKE_CONFIG_DATA, ["amazon_hub", "amazon_otp"]
+    )
+    assert result["amazon_hub"] == 1
+    assert result["amazon_hub_code"] == ["123456"]
+    assert result["amazon_otp"] == {"code": []}
+
+
+async def test_classify_folded_subject(mock_imap_fedex_out_for_delivery_2):
+    """Test a subject folded over two lines still matches."""
+    result = classify_emails(
+        mock_imap_fedex_out_for_delivery_2, FAKE_CONFIG_DATA, ["fedex_delivering"]
+    )
+    assert result["fedex_delivering"] == 1
+    assert result["fedex_tracking"] == ["286548999999"]
+
+
+async def test_classify_amazon_otp(mock_imap_amazon_otp):
+    """Test Amazon OTP codes."""
+    result = classify_emails(mock_imap_amazon_otp, FAKE_CONFIG_DATA, ["amazon_otp"])
+    assert result["amazon_otp"] == {"code": ["671314"]}
+    # Amazon facts are read from the raw first payload, so it is fetched whole
+    mock_imap_amazon_otp.fetch.assert_called_with("1", "(RFC822)")
+
+
+async def test_classify_amazon_exception(mock_imap_amazon_exception):
+    """Test Amazon exception orders."""
+    result = classify_emails(
+        mock_imap_amazon_exception, FAKE_CONFIG_DATA, ["amazon_exception"]
+    )
+    assert result["amazon_exception"] == 1
+    assert result["amazon_exception_order"] == ["123-1234567-1234567"]
+
+
+async def test_classify_no_email(mock_imap_no_email):
+    """Test empty mailboxes."""
+    result = classify_emails(
+        mock_imap_no_email,
+        FAKE_CONFIG_DATA,
+        ["amazon_hub", "amazon_packages", "usps_mail", "zpackages_delivered"],
+    )
+    assert result == {
+        "amazon_hub": 0,
+        "amazon_hub_code": [],
+        "amazon_order": [],
+        "amazon_packages": 0,
+    }
+    assert mock_imap_no_email.search.call_count == 2
+
+
+async def test_classify_search_error(mock_imap_search_error, caplog):
+    """Test search errors leave sensors to the fallback path."""
+    result = classify_emails(
+        mock_imap_search_error, FAKE_CONFIG_DATA, ["ups_delivered"]
+    )
+    assert result == {}
+    assert "Error searching emails:" in caplog.text
+
+
+async def test_classify_one_search(mock_imap_ups_out_for_delivery):
+    """Test every enabled sender is searched for in a single query."""
+    classify_emails(
+        mock_imap_ups_out_for_delivery,
+        FAKE_CONFIG_DATA,
+        ["ups_packages", "fedex_delivered", "usps_delivering"],
+    )
+    mock_imap_ups_out_for_delivery.search.assert_called_once()
+    search = mock_imap_ups_out_for_delivery.search.call_args.args[1]
+    assert search.startswith("(OR OR OR")
+    assert 'FROM "mcinfo@ups.com"' in search
+    assert 'FROM "auto-reply@usps.com"' in search
+
+
+async def test_amazon_days(mock_imap_no_email):
+    """Test 0 Amazon days only searches today's emails."""
+    config = {**FAKE_CONFIG_DATA, "amazon_days": 0}
+    assert not MessageClassifier(config).amazon_window
+    classify_emails(mock_imap_no_email, config, ["amazon_packages"])
+    mock_imap_no_email.search.assert_called_once()
+
+    config.pop("amazon_days")
+    assert MessageClassifier(config).amazon_days == 3
+
+
+async def test_senders():
+    """Test senders include the emails sensors depend on."""
+    classifier = MessageClassifier(FAKE_CONFIG_DATA)
+    assert classifier.senders(["ups_packages"]) == ["mcinfo@ups.com"]
+    assert "shipment-tracking@amazon.com" in classifier.senders(["amazon_packages"])
+    assert classifier.senders(["ups_delivered", "ups_delivering"]) == ["mcinfo@ups.com"]
+
+
+async def test_handles():
+    """Test sensors handled by the classifier."""
+    assert MessageClassifier.handles("ups_delivering")
+    assert MessageClassifier.handles("amazon_packages")
+    assert not MessageClassifier.handles("usps_mail")
+    assert not MessageClassifier.handles("amazon_delivered")
+    assert not MessageClassifier.handles("zpackages_transit")
+    assert not MessageClassifier.handles("mail_updated")
@@ -0,0 +1,56 @@
+"""Tests for commands module."""
+
+import threading
+from unittest.mock import Mock
+
+import pytest
+
+from custom_components.mail_and_packages.commands import (
+    async_run,
+    command,
+    run,
+    sequence,
+)
+
+pytestmark = pytest.mark.asyncio
+
+
+@sequence
+def _count(account, name):
+    """Count the messages a search finds, or None on error."""
+    try:
+        (_, data) = yield command("search", None, f'(FROM "{name}")')
+    except Exception:
+        return None
+    return len(data[0].split()), threading.current_thread()
+
+
+async def test_run():
+    """Test a sequence runs on a blocking account."""
+    account = Mock()
+    account.search.return_value = ("OK", [b"1 2 3"])
+
+    assert _count(account, "test")[0] == 3
+    account.search.assert_called_once_with(None, '(FROM "test")')
+
+    account.search.side_effect = OSError("Connection reset")
+    assert _count(account, "test") is None
+    assert run(account, _count.steps(account, "test")) is None
+
+
+async def test_async_run():
+    """Test commands are awaited and the code between them runs elsewhere."""
+
+    class Client:
+        async def search(self, charset, criteria):
+            self.loop_thread = threading.current_thread()
+            if criteria == '(FROM "error")':
+                raise OSError("Connection reset")
+            return "OK", [b"1 2"]
+
+    client = Client()
+    count, thread = await async_run(client, _count.steps(client, "test"))
+
+    assert count == 2
+    assert thread is not client.loop_thread
+    assert await async_run(client, _count.steps(client, "error")) is None
@@ -4,6 +4,7 @@ import logging
 from unittest.mock import patch
 
 import pytest
+import voluptuous as vol
 from homeassistant import config_entries, setup
 from homeassistant.core import HomeAssistant
 from homeassistant.data_entry_flow import FlowResultType
@@ -13,6 +14,10 @@ from custom_components.mail_and_packages.config_flow import _validate_user_input
 from custom_components.mail_and_packages.const import (
     CONF_AMAZON_FWDS,
     CONF_GENERATE_MP4,
+    CONF_IMAP_ASYNC,
+    CONF_IMAP_COMPRESS,
+    CONF_IMAP_CONNECTIONS,
+    CONF_IMAP_IDLE,
     CONF_IMAP_TIMEOUT,
     CONF_SCAN_INTERVAL,
     CONF_STORAGE,
@@ -2860,3 +2865,65 @@ async def test_reconfig_storage_error(
     assert result["type"] == "form"
     assert result["step_id"] == step_id_3
     assert result["errors"] == {CONF_STORAGE: "path_not_found"}
+
+
+async def test_options_flow(
+    hass: HomeAssistant,
+    integration,
+    mock_imap_no_email,
+):
+    """Test the options flow stores the options and reloads the entry."""
+    entry = integration
+
+    result = await hass.config_entries.options.async_init(entry.entry_id)
+    assert result["type"] is FlowResultType.FORM
+    assert result["step_id"] == "init"
+
+    with patch(
+        "custom_components.mail_and_packages.async_setup_entry",
+        return_value=True,
+    ) as mock_setup_entry:
+        result = await hass.config_entries.options.async_configure(
+            result["flow_id"],
+            user_input={CONF_IMAP_IDLE: True},
+        )
+        await hass.async_block_till_done()
+
+    assert result["type"] is FlowResultType.CREATE_ENTRY
+    assert entry.options[CONF_IMAP_IDLE]
+    assert len(mock_setup_entry.mock_calls) == 1
+
+
+async def test_options_flow_connections(
+    hass: HomeAssistant,
+    integration,
+    mock_imap_no_email,
+):
+    """Test the options flow caps the IMAP connections."""
+    entry = integration
+
+    result = await hass.config_entries.options.async_init(entry.entry_id)
+
+    with pytest.raises(vol.Invalid):
+        await hass.config_entries.options.async_configure(
+            result["flow_id"], user_input={CONF_IMAP_CONNECTIONS: 10}
+        )
+
+
+async def test_options_flow_async_compress(
+    hass: HomeAssistant,
+    integration,
+    mock_imap_no_email,
+):
+    """Test the options flow refuses compression with the asyncio client."""
+    entry = integration
+
+    result = await hass.config_entries.options.async_init(entry.entry_id)
+    result = await hass.config_entries.options.async_configure(
+        result["flow_id"],
+        user_input={CONF_IMAP_ASYNC: True, CONF_IMAP_COMPRESS: True},
+    )
+
+    assert result["type"] is FlowResultType.FORM
+    assert result["step_id"] == "init"
+    assert result["errors"] == {CONF_IMAP_COMPRESS: "compress_async"}
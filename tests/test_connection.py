@@ -0,0 +1,117 @@
+"""Tests for connection module."""
+
+import socket
+from unittest.mock import Mock, patch
+
+import pytest
+
+from custom_components.mail_and_packages.connection import MailConnection
+from tests.const import FAKE_CONFIG_DATA
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_session_reused(mock_imap):
+    """Test the session is kept between refreshes."""
+    mock_imap.noop.return_value = ("OK", [b""])
+    connection = MailConnection(FAKE_CONFIG_DATA)
+
+    with connection.session() as account:
+        assert account is mock_imap
+    with connection.session() as account:
+        assert account is mock_imap
+
+    assert mock_imap.login.call_count == 1
+    assert mock_imap.select.call_count == 1
+    assert mock_imap.noop.call_count == 1
+    assert connection.connected
+
+
+async def test_session_reconnect(mock_imap, caplog):
+    """Test a failed NOOP reconnects."""
+    connection = MailConnection(FAKE_CONFIG_DATA)
+
+    with connection.session() as account:
+        assert account is mock_imap
+
+    mock_imap.noop.side_effect = Exception("Connection reset")
+    with connection.session() as account:
+        assert account is mock_imap
+
+    assert "IMAP session went stale, reconnecting." in caplog.text
+    assert mock_imap.login.call_count == 2
+    assert mock_imap.logout.call_count == 1
+
+
+async def test_session_probe(mock_imap):
+    """Test a probe replaces NOOP and reconnects when it fails."""
+    connection = MailConnection(FAKE_CONFIG_DATA)
+    probe = Mock(return_value=True)
+
+    with connection.session(probe):
+        pass
+    # A fresh session is not probed
+    probe.assert_not_called()
+    with connection.session(probe) as account:
+        assert account is mock_imap
+    probe.assert_called_once_with(mock_imap)
+    assert mock_imap.noop.call_count == 0
+
+    probe.return_value = False
+    with connection.session(probe):
+        pass
+    assert mock_imap.login.call_count == 2
+
+
+async def test_session_backoff(mock_imap_login_error, caplog):
+    """Test login failures back off."""
+    connection = MailConnection(FAKE_CONFIG_DATA)
+
+    with patch("custom_components.mail_and_packages.connection.time.sleep") as sleep:
+        with connection.session() as account:
+            assert not account
+        assert sleep.call_count == 2
+
+    assert mock_imap_login_error.login.call_count == 3
+    assert "Unable to connect to the IMAP server, retrying in" in caplog.text
+
+    with connection.session() as account:
+        assert not account
+    assert mock_imap_login_error.login.call_count == 3
+    assert not connection.connected
+
+
+async def test_close(mock_imap):
+    """Test closing the session logs out."""
+    mock_imap.noop.return_value = ("OK", [b""])
+    connection = MailConnection(FAKE_CONFIG_DATA)
+
+    with connection.session():
+        pass
+    connection.close()
+
+    assert mock_imap.logout.call_count == 1
+    assert not connection.connected
+
+
+async def test_abort(mock_imap):
+    """Test abort shuts down the socket of a blocked imaplib session."""
+    connection = MailConnection(FAKE_CONFIG_DATA)
+    connection.abort()
+    mock_imap.sock.shutdown.assert_not_called()
+
+    with connection.session():
+        connection.abort()
+    mock_imap.sock.shutdown.assert_called_once_with(socket.SHUT_RDWR)
+
+    # A socket that is already closed is ignored
+    mock_imap.sock.shutdown.side_effect = OSError("Bad file descriptor")
+    connection.abort()
+
+
+async def test_login_timeout():
+    """Test the imaplib session is created with the configured timeout."""
+    config = {**FAKE_CONFIG_DATA, "imap_timeout": 45}
+    with patch("custom_components.mail_and_packages.helpers.imaplib") as imaplib:
+        MailConnection(config).open()
+    assert imaplib.IMAP4_SSL.call_args.kwargs["timeout"] == 45
@@ -0,0 +1,108 @@
+"""Tests for deflate module."""
+
+import asyncio
+import zlib
+from unittest import mock
+
+import pytest
+
+from custom_components.mail_and_packages.deflate import (
+    enable_compression,
+    log_compression,
+)
+from custom_components.mail_and_packages.helpers import email_fetch, login, logout
+
+pytestmark = pytest.mark.asyncio
+
+MESSAGE = b"Subject: Digest\r\n\r\n" + b"<img src='data:image/jpeg;base64,AAAA'>" * 200
+
+
+async def _server(capabilities):
+    """Start an IMAP server that compresses after COMPRESS DEFLATE."""
+
+    async def serve(reader, writer):
+        deflate = inflate = None
+        pending = b""
+
+        def write(data):
+            if deflate is not None:
+                data = deflate.compress(data) + deflate.flush(zlib.Z_SYNC_FLUSH)
+            writer.write(data)
+
+        write(b"* OK IMAP4rev1 ready\r\n")
+        while True:
+            while b"\r\n" not in pending:
+                data = await reader.read(4096)
+                if not data:
+                    writer.close()
+                    return
+                pending += inflate.decompress(data) if inflate else data
+            line, _, pending = pending.partition(b"\r\n")
+            tag, _, command = line.partition(b" ")
+            if command == b"CAPABILITY":
+                write(b"* CAPABILITY " + capabilities + b"\r\n")
+            elif command.startswith(b"UID FETCH"):
+                write(b"* 1 FETCH (UID 7 RFC822 {%d}\r\n" % len(MESSAGE))
+                write(MESSAGE + b")\r\n")
+            write(tag + b" OK done\r\n")
+            await writer.drain()
+            if command == b"COMPRESS DEFLATE":
+                deflate = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+                inflate = zlib.decompressobj(-zlib.MAX_WBITS)
+            elif command == b"LOGOUT":
+                writer.close()
+                return
+
+    return await asyncio.start_server(serve, "127.0.0.1", 0)
+
+
+async def test_compression(caplog):
+    """Test a compressed session is transparent to the helpers."""
+    loop = asyncio.get_running_loop()
+    server = await _server(b"IMAP4rev1 COMPRESS=DEFLATE")
+    port = server.sockets[0].getsockname()[1]
+
+    def session():
+        account = login("127.0.0.1", port, "user", "pwd", "", compress=True)
+        try:
+            account.select('"INBOX"', readonly=True)
+            return account.compression, email_fetch(account, "7", uid=True)
+        finally:
+            logout(account)
+
+    async with server:
+        transport, fetched = await loop.run_in_executor(None, session)
+
+    assert fetched[0] == "OK"
+    assert fetched[1][0][1] == MESSAGE
+    assert transport.inflated > len(MESSAGE)
+    assert transport.received < transport.inflated / 10
+    assert transport.deflated > 0
+    assert "IMAP compression enabled" in caplog.text
+    assert "IMAP compression: received" in caplog.text
+
+
+async def test_not_advertised(caplog):
+    """Test servers without COMPRESS=DEFLATE are left alone."""
+    loop = asyncio.get_running_loop()
+    server = await _server(b"IMAP4rev1")
+    port = server.sockets[0].getsockname()[1]
+
+    def session():
+        account = login("127.0.0.1", port, "user", "pwd", "", compress=True)
+        try:
+            return hasattr(account, "compression")
+        finally:
+            logout(account)
+
+    async with server:
+        assert not await loop.run_in_executor(None, session)
+    assert "Server does not support COMPRESS=DEFLATE" in caplog.text
+
+
+async def test_refused():
+    """Test a refused COMPRESS keeps the session uncompressed."""
+    account = mock.Mock(capabilities=("IMAP4REV1", "COMPRESS=DEFLATE"))
+    account.xatom.return_value = ("NO", [b"Compression not allowed"])
+    assert not enable_compression(account)
+    log_compression(account)
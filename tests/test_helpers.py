@@ -2,6 +2,10 @@
 
 import datetime
 import errno
+import io
+import logging
+import threading
+import time
 from datetime import date, timezone
 from unittest import mock
 from unittest.mock import call, mock_open, patch
@@ -9,9 +13,19 @@ from unittest.mock import call, mock_open, patch
 import pytest
 from freezegun import freeze_time
 from homeassistant.components.sensor import DOMAIN as SENSOR_DOMAIN
+from PIL import Image
 from pytest_homeassistant_custom_component.common import MockConfigEntry
 
-from custom_components.mail_and_packages.const import DOMAIN
+from custom_components.mail_and_packages.cache import ImageCache, RefreshCache
+from custom_components.mail_and_packages.connection import MailConnection
+from custom_components.mail_and_packages.const import (
+    CONF_IMAP_CONNECTIONS,
+    DOMAIN,
+    HEADER_FIELDS,
+    HEADER_PARTS,
+    MIN_PARALLEL_RESIZE,
+    SENSOR_DATA,
+)
 from custom_components.mail_and_packages.helpers import (
     _generate_mp4,
     amazon_exception,
@@ -22,18 +36,27 @@ from custom_components.mail_and_packages.helpers import (
     default_image_path,
     download_img,
     email_fetch,
+    email_fetch_batch,
+    email_fetch_parts,
     email_search,
+    encode_gif,
+    fetch_parallel,
     get_count,
     get_formatted_date,
     get_items,
     get_mails,
     get_resources,
+    get_tracking,
     hash_file,
     image_file_name,
     login,
     process_emails,
-    resize_images,
+    process_sensors,
+    resize_frames,
+    scale_image,
     selectfolder,
+    sensor_groups,
+    sequence_set,
     update_time,
 )
 from tests.const import (
@@ -156,7 +179,9 @@ async def test_process_emails_external(
         "custom_components/mail_and_packages/images/" in mock_copytree.call_args.args[0]
     )
     assert "www/mail_and_packages" in mock_copytree.call_args.args[1]
-    assert mock_copytree.call_args.kwargs == {"dirs_exist_ok": True}
+    assert mock_copytree.call_args.kwargs["dirs_exist_ok"]
+    ignore = mock_copytree.call_args.kwargs["ignore"]
+    assert ignore("images", ["mail_today.gif", "manifest.json"]) == {"manifest.json"}
     assert (
         "www/mail_and_packages/amazon/anotherfakefile.mp4"
         in mock_osremove.call_args.args[0]
@@ -186,6 +211,218 @@ async def test_process_emails_external_error(
     assert "Problem creating:" in caplog.text
 
 
+@pytest.mark.asyncio
+async def test_process_emails_parallel(
+    hass,
+    mock_imap_no_email,
+    mock_osremove,
+    mock_osmakedir,
+    mock_listdir,
+    mock_copyfile,
+    mock_copytree,
+    mock_hash_file,
+    mock_getctime_today,
+):
+    config = FAKE_CONFIG_DATA_CORRECTED.copy()
+    sequential = process_emails(hass, config)
+    config[CONF_IMAP_CONNECTIONS] = 3
+    parallel = process_emails(hass, config)
+
+    del sequential["mail_updated"]
+    del parallel["mail_updated"]
+    assert parallel == sequential
+    # Every extra session is logged out again
+    assert mock_imap_no_email.logout.call_count == mock_imap_no_email.login.call_count
+
+
+@pytest.mark.asyncio
+async def test_fetch_parallel_opener_error(hass, caplog):
+    account = mock.Mock()
+    tried = threading.Event()
+
+    def opener():
+        tried.set()
+        raise OSError("Connection refused")
+
+    def fetch_sensor(hass, config, account, data, sensor):
+        if sensor == "a":
+            # Hold the session until the other worker tried to open one
+            assert tried.wait(5)
+        data[sensor] = 1
+
+    slots = []
+    new_semaphore = threading.Semaphore
+
+    def semaphore(value):
+        slots.append(mock.Mock(wraps=new_semaphore(value)))
+        return slots[-1]
+
+    with patch(
+        "custom_components.mail_and_packages.helpers._fetch_sensor",
+        side_effect=fetch_sensor,
+    ), patch(
+        "custom_components.mail_and_packages.helpers.threading.Semaphore",
+        side_effect=semaphore,
+    ):
+        data = {}
+        fetch_parallel(hass, {}, account, data, [["a"], ["b"]], 2, opener)
+
+    # The other worker waits for the first session and the slot is freed
+    assert data == {"a": 1, "b": 1}
+    slots[0].release.assert_called_once()
+    assert "Unable to open another IMAP session" in caplog.text
+
+
+def _untagged(mock_conn, **responses):
+    """Serve untagged responses until read, like imaplib."""
+    pending = {name.upper(): [value] for name, value in responses.items()}
+    mock_conn.noop.return_value = ("OK", [b"NOOP completed"])
+    mock_conn.response.side_effect = lambda name: (name, pending.pop(name, [None]))
+
+
+@pytest.mark.asyncio
+async def test_process_emails_status_check(
+    hass,
+    mock_imap_no_email,
+    mock_osremove,
+    mock_osmakedir,
+    mock_listdir,
+    mock_copyfile,
+    mock_copytree,
+    mock_hash_file,
+    mock_getctime_today,
+):
+    config = FAKE_CONFIG_DATA_CORRECTED.copy()
+    connection = MailConnection(config)
+    refresh = RefreshCache()
+    mock_imap_no_email.select.return_value = ("OK", [b"3"])
+    _untagged(mock_imap_no_email, uidnext=b"4", uidvalidity=b"1")
+
+    with patch(
+        "custom_components.mail_and_packages.helpers.get_formatted_date",
+        return_value="11-Sep-2020",
+    ):
+        first = process_emails(hass, config, connection, None, refresh)
+        mock_imap_no_email.reset_mock()
+        # An idle poll is answered by NOOP alone, never by STATUS
+        second = process_emails(hass, config, connection, None, refresh)
+    assert second.pop("mail_updated") >= first.pop("mail_updated")
+    assert second == first
+    calls = [c[0] for c in mock_imap_no_email.method_calls if c[0] != "response"]
+    assert calls == ["noop"]
+    assert refresh.status == {"MESSAGES": 3, "UIDNEXT": 4, "UIDVALIDITY": 1}
+
+    # New mail is announced with EXISTS
+    _untagged(mock_imap_no_email, exists=b"4")
+    with patch(
+        "custom_components.mail_and_packages.helpers.get_formatted_date",
+        return_value="11-Sep-2020",
+    ):
+        process_emails(hass, config, connection, None, refresh)
+    assert mock_imap_no_email.search.called or mock_imap_no_email.uid.called
+    assert refresh.status == {"MESSAGES": 4, "UIDNEXT": 4, "UIDVALIDITY": 1}
+
+    # An expunge and a new message leave the count unchanged
+    mock_imap_no_email.reset_mock()
+    _untagged(mock_imap_no_email, expunge=b"2", exists=b"4")
+    with patch(
+        "custom_components.mail_and_packages.helpers.get_formatted_date",
+        return_value="11-Sep-2020",
+    ):
+        process_emails(hass, config, connection, None, refresh)
+    assert mock_imap_no_email.search.called or mock_imap_no_email.uid.called
+    assert refresh.status["CHANGES"] == 1
+
+    # So does a new day
+    mock_imap_no_email.reset_mock()
+    with patch(
+        "custom_components.mail_and_packages.helpers.get_formatted_date",
+        return_value="12-Sep-2020",
+    ):
+        process_emails(hass, config, connection, None, refresh)
+    assert mock_imap_no_email.search.called or mock_imap_no_email.uid.called
+    assert refresh.day == "12-Sep-2020"
+    assert not mock_imap_no_email.status.called
+
+
+@pytest.mark.asyncio
+async def test_process_emails_status_check_modseq(hass, mock_imap_no_email):
+    mock_imap_no_email.select.return_value = ("OK", [b"3"])
+    _untagged(mock_imap_no_email, uidnext=b"4", uidvalidity=b"1", highestmodseq=b"90")
+    refresh = RefreshCache()
+    refresh.record(
+        {"MESSAGES": 3, "UIDNEXT": 4, "UIDVALIDITY": 1, "HIGHESTMODSEQ": 90},
+        get_formatted_date(),
+        {"usps_mail": 2},
+    )
+
+    config = FAKE_CONFIG_DATA_CORRECTED.copy()
+    config["allow_external"] = True
+    with patch(
+        "custom_components.mail_and_packages.helpers.copy_images"
+    ) as mock_copy_images:
+        result = process_emails(hass, config, None, None, refresh)
+    # The update time and the www copy are refreshed all the same
+    assert result.pop("mail_updated")
+    assert result == {"usps_mail": 2}
+    mock_copy_images.assert_called_once_with(hass, config)
+    mock_imap_no_email.noop.assert_called_once()
+    assert not mock_imap_no_email.status.called
+    assert not mock_imap_no_email.search.called
+
+
+@pytest.mark.asyncio
+async def test_process_sensors(hass):
+    previous = {
+        "image_name": "mail_today.gif",
+        "ups_delivering": 0,
+        "usps_mail": 3,
+        "usps_delivering": 2,
+        "zpackages_transit": 2,
+    }
+    sensors = ["ups_delivering", "zpackages_transit"]
+    with patch(
+        "custom_components.mail_and_packages.helpers.process_emails",
+        return_value={"image_name": "new.gif", "ups_delivering": 1},
+    ) as mock_process:
+        data = process_sensors(hass, FAKE_CONFIG_DATA, None, sensors, previous)
+
+    config = mock_process.call_args.args[1]
+    assert config["resources"] == ["ups_delivering"]
+    # Untouched sensors and the image of a mail sensor not refreshed are kept
+    assert data == {
+        "image_name": "mail_today.gif",
+        "ups_delivering": 1,
+        "usps_mail": 3,
+        "usps_delivering": 2,
+        "zpackages_transit": 3,
+    }
+    assert previous["ups_delivering"] == 0
+
+
+@pytest.mark.asyncio
+async def test_sensor_groups():
+    groups, dependent = sensor_groups(
+        [
+            "amazon_hub",
+            "amazon_packages",
+            "dhl_parcel_nl_packages",
+            "mail_updated",
+            "ups_delivered",
+            "ups_packages",
+            "usps_mail",
+            "zpackages_delivered",
+        ]
+    )
+    assert groups == [
+        ["amazon_hub", "amazon_packages"],
+        ["dhl_parcel_nl_packages"],
+        ["ups_delivered", "ups_packages"],
+        ["usps_mail"],
+    ]
+    assert dependent == ["mail_updated", "zpackages_delivered"]
+
+
 # @pytest.mark.asyncio
 # async def test_process_emails_copytree_error(
 #     hass,
@@ -385,6 +622,102 @@ async def test_email_fetch(mock_imap_fetch_error, caplog):
     assert "Error fetching emails:" in caplog.text
 
 
+@pytest.mark.asyncio
+async def test_sequence_set():
+    assert sequence_set([b"12", b"1", b"9", b"5", b"10", b"11"]) == "1,5,9:12"
+    assert sequence_set(["3"]) == "3"
+
+
+@pytest.mark.asyncio
+async def test_email_fetch_batch(mock_imap):
+    mock_imap.fetch.side_effect = [
+        (
+            "OK",
+            [
+                (b"1 (RFC822 {3}", b"one"),
+                b")",
+                (b"5 (RFC822 {4}", b"five"),
+                b")",
+            ],
+        ),
+        ("OK", [(b"9 (RFC822 {4}", b"nine"), b")"]),
+    ]
+    result = list(
+        email_fetch_batch(mock_imap, [b"5", b"1", b"9"], "(RFC822)", chunk_size=2)
+    )
+    assert result == [
+        (b"1", (b"1 (RFC822 {3}", b"one")),
+        (b"5", (b"5 (RFC822 {4}", b"five")),
+        (b"9", (b"9 (RFC822 {4}", b"nine")),
+    ]
+    assert mock_imap.fetch.call_args_list == [
+        call("1,5", "(RFC822)"),
+        call("9", "(RFC822)"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_email_fetch_batch_uid(mock_imap):
+    mock_imap.uid.return_value = (
+        "OK",
+        [(b"2 (UID 40 BODY[] {3}", b"abc"), b")"],
+    )
+    result = list(email_fetch_batch(mock_imap, ["40"], "(RFC822)", uid=True))
+    assert result == [("40", (b"2 (UID 40 BODY[] {3}", b"abc"))]
+    mock_imap.uid.assert_called_with("FETCH", "40", "(RFC822)")
+
+
+@pytest.mark.asyncio
+async def test_email_fetch_parts(mock_imap):
+    mock_imap.fetch.side_effect = [
+        (
+            "OK",
+            [
+                b'1 (BODYSTRUCTURE (("TEXT" "PLAIN" NIL NIL NIL "7BIT" 5 1 NIL NIL'
+                b' NIL)("TEXT" "HTML" NIL NIL NIL "7BIT" 12 1 NIL NIL NIL)'
+                b' "ALTERNATIVE" NIL NIL NIL))'
+            ],
+        ),
+        (
+            "OK",
+            [
+                (
+                    b"1 (BODY[HEADER.FIELDS (FROM SUBJECT DATE)] {13}",
+                    b"Subject: hi\r\n",
+                ),
+                (b" BODY[2] {12}", b"<b>hello</b>"),
+                b")",
+            ],
+        ),
+    ]
+    result = list(email_fetch_parts(mock_imap, [b"1"], ["text/html"]))
+    assert len(result) == 1
+    assert result[0][1]["subject"] == "hi"
+    parts = [part for part in result[0][1].walk() if not part.is_multipart()]
+    assert [part.get_content_type() for part in parts] == ["text/html"]
+    assert mock_imap.fetch.call_args_list == [
+        call("1", "(BODYSTRUCTURE)"),
+        call("1", f"({HEADER_FIELDS} BODY.PEEK[2])"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_email_fetch_parts_fallback(mock_imap_usps_informed_digest):
+    result = list(
+        email_fetch_parts(mock_imap_usps_informed_digest, [b"1"], ["text/html"])
+    )
+    assert len(result) == 1
+    assert result[0][1].is_multipart()
+    mock_imap_usps_informed_digest.fetch.assert_called_with("1", "(RFC822)")
+
+
+@pytest.mark.asyncio
+async def test_email_fetch_batch_error(mock_imap_fetch_error, caplog):
+    result = list(email_fetch_batch(mock_imap_fetch_error, [b"1", b"2"]))
+    assert result == []
+    assert "Error fetching emails:" in caplog.text
+
+
 @pytest.mark.asyncio
 async def test_get_mails(mock_imap_no_email, mock_copyfile):
     result = get_mails(mock_imap_no_email, "./", "5", "mail_today.gif", False)
@@ -524,28 +857,199 @@ async def test_informed_delivery_emails_mp4(
 
 
 @pytest.mark.asyncio
-async def test_informed_delivery_emails_open_err(
+async def test_informed_delivery_emails_mp4_queue(
+    mock_imap_usps_informed_digest,
+    mock_osremove,
+    mock_osmakedir,
+    mock_listdir,
+    mock_image,
+    mock_resizeimage,
+    mock_copyfile,
+):
+    mp4_queue = mock.Mock()
+    with patch(
+        "custom_components.mail_and_packages.helpers._generate_mp4"
+    ) as mock_generate_mp4:
+        result = get_mails(
+            mock_imap_usps_informed_digest,
+            "./",
+            "5",
+            "mail_today.gif",
+            True,
+            mp4_queue=mp4_queue,
+        )
+    assert result == 3
+    mock_generate_mp4.assert_not_called()
+    mp4_queue.submit.assert_called_once_with(
+        "./mail_today.gif", "./mail_today.mp4", None, mock.ANY
+    )
+    # The job is keyed by the mail pieces the GIF was built from
+    assert len(mp4_queue.submit.call_args[0][3]["images"]) == 3
+
+
+@pytest.mark.asyncio
+async def test_informed_delivery_emails_in_memory(
     mock_imap_usps_informed_digest,
     mock_listdir,
     mock_osremove,
     mock_osmakedir,
     mock_os_path_splitext,
-    mock_image,
     mock_resizeimage,
     mock_copyfile,
     caplog,
 ):
-    get_mails(
-        mock_imap_usps_informed_digest,
-        "/totally/fake/path/",
-        "5",
-        "mail_today.gif",
-        False,
-    )
-    assert (
-        "Error opening filepath: [Errno 2] No such file or directory: '/totally/fake/path/1040327780-101.jpg'"
-        in caplog.text
-    )
+    with patch("builtins.open", side_effect=OSError("read-only")) as m_open:
+        result = get_mails(
+            mock_imap_usps_informed_digest,
+            "/totally/fake/path/",
+            "5",
+            "mail_today.gif",
+            False,
+        )
+    assert result == 3
+    m_open.assert_not_called()
+    assert "Error opening filepath" not in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_informed_delivery_emails_cached(
+    mock_imap_usps_informed_digest,
+    mock_listdir,
+    mock_osremove,
+    mock_copyfile,
+    tmp_path,
+    caplog,
+):
+    caplog.set_level(logging.DEBUG)
+
+    def save(fp, **kwargs):
+        with open(fp, "wb") as gif:
+            gif.write(b"GIF89a")
+
+    def generate_mp4(path, image_file):
+        (tmp_path / "mail_today.mp4").write_bytes(b"")
+
+    with patch(
+        "custom_components.mail_and_packages.helpers.resize_image"
+    ) as mock_resize, patch(
+        "custom_components.mail_and_packages.helpers._generate_mp4",
+        side_effect=generate_mp4,
+    ) as mock_generate_mp4:
+        mock_resize.return_value.save.side_effect = save
+        # The second cache starts from the manifest, as after a restart
+        for cache in (ImageCache(), ImageCache()):
+            for _ in range(2):
+                result = get_mails(
+                    mock_imap_usps_informed_digest,
+                    f"{tmp_path}/",
+                    "5",
+                    "mail_today.gif",
+                    True,
+                    image_cache=cache,
+                )
+                assert result == 3
+
+    assert mock_resize.call_count == 3
+    mock_resize.return_value.save.assert_called_once()
+    mock_generate_mp4.assert_called_once()
+    assert f"Mail pieces unchanged, keeping {tmp_path}/mail_today.gif" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_informed_delivery_emails_cached_webp(
+    mock_imap_usps_informed_digest, mock_listdir, tmp_path
+):
+    def encode(frames, path, duration, optimize, webp):
+        (tmp_path / "mail_today.gif").write_bytes(b"GIF89a")
+        (tmp_path / "mail_today.webp").write_bytes(b"RIFF")
+
+    cache = ImageCache()
+    with patch("custom_components.mail_and_packages.helpers.resize_image"), patch(
+        "custom_components.mail_and_packages.helpers.encode_gif", side_effect=encode
+    ) as mock_encode:
+        for _ in range(2):
+            get_mails(
+                mock_imap_usps_informed_digest,
+                f"{tmp_path}/",
+                "5",
+                "mail_today.gif",
+                image_cache=cache,
+                gif_webp=True,
+            )
+        mock_encode.assert_called_once()
+
+        # The WebP went missing, the GIF alone is not enough
+        (tmp_path / "mail_today.webp").unlink()
+        get_mails(
+            mock_imap_usps_informed_digest,
+            f"{tmp_path}/",
+            "5",
+            "mail_today.gif",
+            image_cache=cache,
+            gif_webp=True,
+        )
+        assert mock_encode.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_informed_delivery_emails_cached_refresh(
+    hass, mock_imap_usps_informed_digest, tmp_path, caplog
+):
+    caplog.set_level(logging.DEBUG)
+    config = FAKE_CONFIG_DATA_CORRECTED.copy()
+    config["resources"] = ["usps_mail"]
+    config["storage"] = "images/"
+
+    def encode(frames, path, *args):
+        with open(path, "wb") as gif:
+            gif.write(b"GIF89a mail")
+
+    with patch.object(hass.config, "path", return_value=str(tmp_path)), patch(
+        "custom_components.mail_and_packages.helpers.resize_image"
+    ), patch(
+        "custom_components.mail_and_packages.helpers.encode_gif", side_effect=encode
+    ) as mock_encode:
+        first = process_emails(hass, config)
+        second = process_emails(hass, config)
+
+    # The placeholder is not copied over the image of today's mail
+    assert first["image_name"] == second["image_name"]
+    assert second["usps_mail"] == 3
+    gif = tmp_path / "images" / second["image_name"]
+    assert gif.read_bytes() == b"GIF89a mail"
+    mock_encode.assert_called_once()
+    assert f"Mail pieces unchanged, keeping {gif}" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_informed_delivery_frames_cached_refresh(
+    hass, mock_imap_usps_informed_digest, tmp_path
+):
+    config = FAKE_CONFIG_DATA_CORRECTED.copy()
+    config["resources"] = ["usps_mail"]
+    config["storage"] = "images/"
+
+    def encode(frames, path, *args):
+        with open(path, "wb") as gif:
+            gif.write(b"GIF89a mail")
+
+    with patch.object(hass.config, "path", return_value=str(tmp_path)), patch(
+        "custom_components.mail_and_packages.helpers.resize_image"
+    ) as mock_resize, patch(
+        "custom_components.mail_and_packages.helpers.encode_gif", side_effect=encode
+    ) as mock_encode:
+        first = process_emails(hass, config)
+        resized = mock_resize.call_count
+        # Something else replaced today's image
+        gif = tmp_path / "images" / first["image_name"]
+        gif.write_bytes(b"GIF89a replaced")
+        second = process_emails(hass, config)
+
+    # The image is built again from the frames resized for the first refresh
+    assert second["usps_mail"] == 3
+    assert mock_encode.call_count == 2
+    assert mock_resize.call_count == resized
+    assert gif.read_bytes() == b"GIF89a mail"
 
 
 @pytest.mark.asyncio
@@ -949,17 +1453,201 @@ async def test_selectfolder_select_error(mock_imap_select_error, caplog):
 
 
 @pytest.mark.asyncio
-async def test_resize_images_open_err(mock_open_excpetion, caplog):
-    resize_images(["testimage.jpg", "anothertest.jpg"], 724, 320)
-    assert "Error attempting to open image" in caplog.text
+async def test_resize_frames_read_err(mock_image_excpetion, caplog):
+    images = {"testimage.jpg": "testimage.jpg", "anothertest.jpg": "anothertest.jpg"}
+    assert resize_frames(images, 724, 320) == {}
+    assert "Error attempting to read image testimage.jpg" in caplog.text
+    assert "Error attempting to read image anothertest.jpg" in caplog.text
+
+
+def _frame(data):
+    """Return a mock 724x320 frame with the given pixel data."""
+    frame = mock.Mock(width=724, height=320)
+    frame.tobytes.return_value = data
+    return frame
 
 
 @pytest.mark.asyncio
-async def test_resize_images_read_err(mock_image_excpetion, caplog):
-    m_open = mock_open()
-    with patch("builtins.open", m_open, create=True):
-        resize_images(["testimage.jpg", "anothertest.jpg"], 724, 320)
-        assert "Error attempting to read image" in caplog.text
+async def test_encode_gif_optimized(tmp_path, caplog):
+    caplog.set_level(logging.DEBUG)
+    frames = [_frame(b"a"), _frame(b"a"), _frame(b"b"), _frame(b"a")]
+    path = str(tmp_path / "mail_today.gif")
+
+    def save(fp, **kwargs):
+        with open(fp, "wb") as gif:
+            gif.write(b"GIF89a")
+
+    with patch("custom_components.mail_and_packages.helpers.Image") as mock_image:
+        quantized = [mock.Mock(), mock.Mock(), mock.Mock()]
+        for frame, image in zip([frames[0], frames[2], frames[3]], quantized):
+            frame.convert.return_value.quantize.return_value = image
+        quantized[0].save.side_effect = save
+        encode_gif(frames, path, 5000, optimize=True)
+
+    # One palette sampled from the unique frames
+    mock_image.new.assert_called_once_with("RGB", (181, 240))
+    palette = mock_image.new.return_value.quantize.return_value
+    frames[2].convert.return_value.quantize.assert_called_once_with(
+        palette=palette, dither=mock_image.Dither.FLOYDSTEINBERG
+    )
+    frames[1].convert.assert_not_called()
+    quantized[0].save.assert_called_once_with(
+        fp=path,
+        format="GIF",
+        append_images=quantized[1:],
+        save_all=True,
+        duration=5000,
+        loop=0,
+        optimize=True,
+    )
+    assert "Dropped 1 repeated frames" in caplog.text
+    assert f"Encoded {path}: 3 frames, 6 bytes in" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_encode_gif_webp(caplog):
+    frames = [_frame(b"a"), _frame(b"a")]
+    frames[0].save.side_effect = [None, OSError("encoder not available")]
+    encode_gif(frames, "./mail_today.gif", 5000, webp=True)
+
+    assert frames[0].save.call_args_list[0].kwargs["append_images"] == frames[1:]
+    assert frames[0].save.call_args_list[1] == call(
+        "./mail_today.webp",
+        format="WEBP",
+        append_images=frames[1:],
+        save_all=True,
+        duration=5000,
+        loop=0,
+    )
+    assert "Error attempting to generate webp image" in caplog.text
+
+
+def _animation(*colors):
+    """Return an animated 724x320 GIF with a frame per color."""
+    first, *rest = [Image.new("RGB", (724, 320), color) for color in colors]
+    output = io.BytesIO()
+    first.save(
+        output,
+        format="GIF",
+        append_images=rest,
+        save_all=True,
+        duration=1000,
+        loop=0,
+    )
+    return output.getvalue()
+
+
+@pytest.mark.asyncio
+async def test_scale_image():
+    content = _animation("red", "blue")
+    # Nothing to scale
+    assert scale_image(content) is content
+    assert scale_image(content, 1000, 1000) is content
+
+    still = Image.open(io.BytesIO(scale_image(content, 200)))
+    assert still.format == "JPEG"
+    assert still.size == (200, 88)
+
+    animation = Image.open(io.BytesIO(scale_image(content, None, 160)))
+    assert animation.format == "GIF"
+    assert animation.size == (362, 160)
+    assert animation.n_frames == 2
+
+
+@pytest.mark.asyncio
+async def test_resize_frames_parallel(caplog):
+    caplog.set_level(logging.DEBUG)
+    threads = set()
+
+    def resize(image, width, height):
+        threads.add(threading.current_thread().name)
+        if image == "bad":
+            raise OSError("cannot identify image file")
+        # Finish out of order
+        time.sleep(0.05 / int(image))
+        return image
+
+    images = {f"{index}.jpg": str(index) for index in range(1, 6)}
+    images["bad.jpg"] = "bad"
+    with patch(
+        "custom_components.mail_and_packages.helpers.resize_image",
+        side_effect=resize,
+    ):
+        frames = resize_frames(images, 724, 320, 3)
+
+    assert list(frames) == ["1.jpg", "2.jpg", "3.jpg", "4.jpg", "5.jpg"]
+    assert list(frames.values()) == ["1", "2", "3", "4", "5"]
+    assert all(name.startswith("mail_and_packages_resize") for name in threads)
+    assert "Error attempting to read image bad.jpg" in caplog.text
+    assert "Resized 6 images in" in caplog.text
+    assert "with 3 workers" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_resize_frames_serial(caplog):
+    caplog.set_level(logging.DEBUG)
+    threads = set()
+
+    def resize(image, width, height):
+        threads.add(threading.current_thread())
+        return image
+
+    with patch(
+        "custom_components.mail_and_packages.helpers.resize_image",
+        side_effect=resize,
+    ):
+        frames = resize_frames({"a.jpg": "a", "b.jpg": "b"}, 724, 320, 3)
+
+    assert frames == {"a.jpg": "a", "b.jpg": "b"}
+    assert threads == {threading.current_thread()}
+    assert "with 1 workers" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_resize_frames_threshold():
+    threads = []
+
+    def resize(image, width, height):
+        threads.append(threading.current_thread())
+        return image
+
+    with patch(
+        "custom_components.mail_and_packages.helpers.resize_image",
+        side_effect=resize,
+    ):
+        # One image short of the threshold stays in the calling thread
+        images = {f"{index}.jpg": str(index) for index in range(MIN_PARALLEL_RESIZE)}
+        assert resize_frames(dict(list(images.items())[:-1]), 724, 320, 2)
+        assert set(threads) == {threading.current_thread()}
+
+        threads.clear()
+        assert resize_frames(images, 724, 320, 2) == images
+        assert threading.current_thread() not in threads
+
+
+@pytest.mark.asyncio
+async def test_resize_frames_timing():
+    def resize(image, width, height):
+        # Stand in for Pillow resampling, which releases the GIL
+        time.sleep(0.05)
+        return image
+
+    images = {f"{index}.jpg": str(index) for index in range(6)}
+    with patch(
+        "custom_components.mail_and_packages.helpers.resize_image",
+        side_effect=resize,
+    ):
+        start = time.perf_counter()
+        assert resize_frames(images, 724, 320, 1) == images
+        serial = time.perf_counter() - start
+
+        start = time.perf_counter()
+        assert resize_frames(images, 724, 320, 3) == images
+        parallel = time.perf_counter() - start
+
+    assert serial >= 0.3
+    # Three threads resize two images each
+    assert parallel < serial / 2
 
 
 @pytest.mark.asyncio
@@ -1105,6 +1793,17 @@ async def test_fedex_out_for_delivery(hass, mock_imap_fedex_out_for_delivery):
     assert result["tracking"] == ["61290912345678912345"]
 
 
+@pytest.mark.asyncio
+async def test_get_tracking_subject(mock_imap_fedex_out_for_delivery):
+    result = get_tracking(
+        b"1",
+        mock_imap_fedex_out_for_delivery,
+        SENSOR_DATA["fedex_tracking"]["pattern"][0],
+    )
+    assert result == ["61290912345678912345"]
+    mock_imap_fedex_out_for_delivery.fetch.assert_called_once_with("1", HEADER_PARTS)
+
+
 @pytest.mark.asyncio
 async def test_fedex_out_for_delivery_2(hass, mock_imap_fedex_out_for_delivery_2):
     result = get_count(
@@ -0,0 +1,119 @@
+"""Tests for idle module."""
+
+import socket
+import threading
+from unittest import mock
+
+import pytest
+
+from custom_components.mail_and_packages.idle import IdleListener
+from tests.const import FAKE_CONFIG_DATA
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_idle_unsupported(hass, mock_imap, caplog):
+    """Test servers without IDLE are left to polling."""
+    mock_imap.capabilities = ("IMAP4rev1",)
+    listener = IdleListener(hass, FAKE_CONFIG_DATA, mock.Mock())
+
+    assert listener._connect() is False
+    assert listener.supported is False
+    assert "does not support IDLE" in caplog.text
+    mock_imap.select.assert_not_called()
+
+
+def _account(client):
+    """Return an account reading the socket through a buffered reader."""
+    return mock.Mock(readline=client.makefile("rb").readline, send=client.sendall)
+
+
+async def test_idle_new_mail(hass):
+    """Test EXISTS responses end the IDLE and report new mail."""
+    client, server = socket.socketpair()
+    server.sendall(b"+ idling\r\n* 3 EXISTS\r\nMP1 OK IDLE terminated\r\n")
+    listener = IdleListener(hass, FAKE_CONFIG_DATA, mock.Mock())
+    listener._exists = 2
+
+    assert listener._idle(_account(client)) == "3:3"
+    assert server.recv(1024) == b"MP1 IDLE\r\nDONE\r\n"
+    client.close()
+    server.close()
+
+
+async def test_idle_expunge(hass):
+    """Test expunges before the new mail shift its sequence numbers."""
+    client, server = socket.socketpair()
+    server.sendall(
+        b"+ idling\r\n* 1 EXPUNGE\r\n* 2 EXISTS\r\n* 3 EXISTS\r\n"
+        b"MP1 OK IDLE terminated\r\n"
+    )
+    listener = IdleListener(hass, FAKE_CONFIG_DATA, mock.Mock())
+    listener._exists = 2
+
+    # Only the first of the new messages ends the IDLE
+    assert listener._idle(_account(client)) == "2:3"
+    assert server.recv(1024) == b"MP1 IDLE\r\nDONE\r\n"
+    client.close()
+    server.close()
+
+
+async def test_idle_affected(hass, mock_imap_ups_out_for_delivery):
+    """Test only the sensors of the new mail's senders are refreshed."""
+    mock_imap_ups_out_for_delivery.fetch.return_value = (
+        "OK",
+        [
+            (b"3 (BODY[HEADER.FIELDS (FROM)] {23}", b"From: mcinfo@ups.com\r\n\r\n"),
+            b")",
+        ],
+    )
+    listener = IdleListener(hass, FAKE_CONFIG_DATA, mock.Mock())
+
+    sensors = listener._affected(mock_imap_ups_out_for_delivery, "3:3")
+
+    mock_imap_ups_out_for_delivery.fetch.assert_called_once_with(
+        "3:3", "(BODY.PEEK[HEADER.FIELDS (FROM)])"
+    )
+    assert "ups_delivering" in sensors
+    assert "zpackages_transit" in sensors
+    assert "usps_mail" not in sensors
+    assert "amazon_packages" not in sensors
+
+    mock_imap_ups_out_for_delivery.fetch.return_value = ("NO", [None])
+    assert listener._affected(mock_imap_ups_out_for_delivery, "3:3") is None
+
+
+async def test_idle_timeout(hass):
+    """Test the IDLE is renewed when nothing arrives."""
+    client, server = socket.socketpair()
+    server.sendall(b"+ idling\r\n* OK Still here\r\n")
+    account = _account(client)
+    listener = IdleListener(hass, FAKE_CONFIG_DATA, mock.Mock())
+
+    def reply():
+        received = b""
+        while not received.endswith(b"DONE\r\n"):
+            received += server.recv(1024)
+        server.sendall(b"MP1 OK IDLE terminated\r\n")
+
+    responder = threading.Thread(target=reply)
+    responder.start()
+    with mock.patch(
+        "custom_components.mail_and_packages.idle.DEFAULT_IDLE_TIMEOUT", 0.1
+    ):
+        assert listener._idle(account) is None
+    responder.join()
+    client.close()
+    server.close()
+
+
+async def test_idle_server_ended(hass):
+    """Test a server ending the IDLE is not reported as new mail."""
+    client, server = socket.socketpair()
+    server.sendall(b"+ idling\r\nMP1 OK IDLE terminated\r\n")
+    listener = IdleListener(hass, FAKE_CONFIG_DATA, mock.Mock())
+
+    assert listener._idle(_account(client)) is None
+    assert server.recv(1024) == b"MP1 IDLE\r\n"
+    client.close()
+    server.close()
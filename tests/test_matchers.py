@@ -0,0 +1,104 @@
+"""Tests for matchers module."""
+
+import base64
+
+import pytest
+
+from custom_components.mail_and_packages.const import SENSOR_DATA
+from custom_components.mail_and_packages.matchers import (
+    MATCHERS,
+    MatcherRegistry,
+    TrackingMatch,
+    compile_pattern,
+    scan_mailpieces,
+    scan_tracking,
+    tracking_number,
+)
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_registry():
+    """Test every sensor is compiled and indexed by name."""
+    assert set(MATCHERS) == set(SENSOR_DATA)
+    matcher = MATCHERS["usps_delivering"]
+    assert matcher.body[0][0] == "Your item is out for delivery"
+    assert matcher.body[0][1].search("Your item is out for delivery today")
+    assert MATCHERS["ups_tracking"].pattern.pattern == "1Z?[0-9A-Z]{16}"
+    assert MATCHERS["ups_delivered"].pattern is None
+
+
+async def test_tracking():
+    """Test tracking patterns are keyed by carrier."""
+    assert MATCHERS.tracking["ups"] is MATCHERS["ups_tracking"].pattern
+    assert "ups_delivered" not in MATCHERS.tracking
+    # Carriers without a tracking format are left out
+    assert "capost" not in MATCHERS.tracking
+
+
+async def test_tracking_scan():
+    """Test overlapping carrier formats all match in one scan."""
+    registry = MatcherRegistry(
+        {
+            "a_tracking": {"pattern": ["1Z[0-9]{4}"]},
+            "b_tracking": {"pattern": ["[0-9A-Z]{6}"]},
+        }
+    )
+    found = registry.scan_tracking("xx 1Z1234 yy")
+    assert found == {
+        "a": [TrackingMatch("1Z1234", 3, 9)],
+        "b": [TrackingMatch("1Z1234", 3, 9)],
+    }
+
+
+async def test_compile_pattern():
+    """Test patterns are only compiled once."""
+    assert compile_pattern(r"\d{6}") is compile_pattern(r"\d{6}")
+
+
+async def test_scan_tracking():
+    """Test a single scan finds what findall finds for every carrier."""
+    text = (
+        "Your UPS package 1Z2345YY0678901234 ships with USPS "
+        "9400111899560008231892 and FedEx 123456789012, order 61290912345678912345"
+    )
+    found = MATCHERS.scan_tracking(text)
+    for carrier, pattern in MATCHERS.tracking.items():
+        numbers = [match.number for match in found.get(carrier, [])]
+        assert numbers == [value.strip() for value in pattern.findall(text)]
+    assert found["ups"][0] == TrackingMatch("1Z2345YY0678901234", 17, 35)
+
+
+async def test_scan_tracking_subset():
+    """Test only the requested carriers are returned."""
+    patterns = {"ups": MATCHERS.tracking["ups"], "usps": MATCHERS.tracking["usps"]}
+    found = scan_tracking("1Z2345YY0678901234 9400111899560008231892", patterns)
+    assert list(found) == ["ups", "usps"]
+    assert found["usps"] == [TrackingMatch("9400111899560008231892", 19, 41)]
+    assert scan_tracking("", patterns) == {}
+
+
+async def test_tracking_number():
+    """Test formats with a space keep the number after it."""
+    labelled = compile_pattern(r"Waybill \d{10}")
+    assert tracking_number(labelled, "Waybill 1234567890") == "1234567890"
+    assert tracking_number(MATCHERS.tracking["ups"], "1Z2345YY0678901234") == (
+        "1Z2345YY0678901234"
+    )
+    # A trailing space in the format leaves a single token
+    auspost = MATCHERS.tracking["auspost"]
+    assert tracking_number(auspost, "AB123456789AU ") == "AB123456789AU"
+
+
+async def test_scan_mailpieces():
+    """Test mail piece images are found in raw html."""
+    html = (
+        b'<img id="mailpiece-image-src-id" alt="" src="data:image/jpeg;base64,'
+        b'aGVsbG8=">'
+        b'<img src="data:image/jpeg;base64,aWdub3Jl">'
+        b"<IMG SRC='data:image/jpeg;base64,d29y\r\nbGQ=' ID='mailpiece-image-src-id'>"
+        b'<img id="mailpiece-image-src-id" src="https://example.com/a.jpg">'
+    )
+    found = list(scan_mailpieces(html))
+    assert [bytes(data) for data in found] == [b"aGVsbG8=", b"d29y\r\nbGQ="]
+    assert [base64.b64decode(data) for data in found] == [b"hello", b"world"]
@@ -0,0 +1,60 @@
+"""Tests for mime module."""
+
+import email
+
+import pytest
+
+from custom_components.mail_and_packages.mime import LazyMessage
+
+pytestmark = pytest.mark.asyncio
+
+
+def _raw(name):
+    """Read a test email."""
+    with open(f"tests/test_emails/{name}", "rb") as f:
+        return f.read()
+
+
+async def test_headers_only():
+    """Test header lookups don't parse the body."""
+    raw = _raw("informed_delivery.eml")
+    msg = LazyMessage(raw)
+    expected = email.message_from_bytes(raw)
+
+    assert msg["subject"] == expected["subject"]
+    assert msg.get("from") == expected["from"]
+    assert "subject" in msg
+    assert msg.get("x-missing", "none") == "none"
+    assert not msg.parsed
+
+
+async def test_delegate():
+    """Test everything else behaves like email.message.Message."""
+    raw = _raw("informed_delivery.eml")
+    msg = LazyMessage(raw)
+    expected = email.message_from_bytes(raw)
+
+    assert msg.is_multipart() == expected.is_multipart()
+    assert [part.get_content_type() for part in msg.walk()] == [
+        part.get_content_type() for part in expected.walk()
+    ]
+    assert msg.parsed
+
+
+async def test_texts():
+    """Test text parts are decoded on demand and kept."""
+    msg = LazyMessage(_raw("ups_out_for_delivery.eml"))
+
+    first = next(msg.texts())
+    assert msg.parsed
+    assert len(msg._texts) == 1
+    texts = list(msg.texts())
+    assert texts[0] is first
+    assert list(msg.texts()) == texts
+
+
+async def test_no_body():
+    """Test messages with only headers."""
+    msg = LazyMessage(b"Subject: Hello\r\nFrom: test@example.com")
+    assert msg["subject"] == "Hello"
+    assert list(msg.texts()) == [""]
@@ -0,0 +1,129 @@
+"""Tests for transcode module."""
+
+import asyncio
+import sys
+from unittest.mock import Mock, patch
+
+import pytest
+
+from custom_components.mail_and_packages.transcode import Mp4Queue, get_mp4_queue
+
+pytestmark = pytest.mark.asyncio
+
+REAL_EXEC = asyncio.create_subprocess_exec
+
+
+def _ffmpeg(script):
+    """Replace ffmpeg with a python script given the output path."""
+
+    async def create_subprocess_exec(*args, **kwargs):
+        return await REAL_EXEC(sys.executable, "-c", script, args[-1], **kwargs)
+
+    return patch(
+        "custom_components.mail_and_packages.transcode.asyncio.create_subprocess_exec",
+        side_effect=create_subprocess_exec,
+    )
+
+
+WRITE = "import sys; open(sys.argv[1], 'wb').write(b'mp4')"
+FAIL = "import sys; open(sys.argv[1], 'wb').write(b'partial'); sys.exit(1)"
+STALL = "import sys, time; open(sys.argv[1], 'wb').write(b'old'); time.sleep(60)"
+
+
+async def test_transcode(hass, tmp_path):
+    """Test the MP4 is renamed into place and the run recorded."""
+    mp4 = str(tmp_path / "mail_today.mp4")
+    on_success = Mock()
+    queue = Mp4Queue(hass)
+    with _ffmpeg(WRITE):
+        await queue.async_submit(str(tmp_path / "mail_today.gif"), mp4, on_success)
+
+    assert (tmp_path / "mail_today.mp4").read_bytes() == b"mp4"
+    assert not (tmp_path / "mail_today.mp4.part").exists()
+    assert queue.results[mp4].success
+    assert queue.results[mp4].duration >= 0
+    on_success.assert_called_once()
+
+
+async def test_transcode_error(hass, tmp_path, caplog):
+    """Test a failed run leaves no partial file behind."""
+    mp4 = str(tmp_path / "mail_today.mp4")
+    queue = Mp4Queue(hass)
+    with _ffmpeg(FAIL):
+        await queue.async_submit(str(tmp_path / "mail_today.gif"), mp4)
+
+    assert list(tmp_path.iterdir()) == []
+    assert queue.results[mp4].returncode == 1
+    assert "ffmpeg exited with status 1" in caplog.text
+
+
+async def test_transcode_no_ffmpeg(hass, tmp_path, caplog):
+    """Test a missing ffmpeg is logged."""
+    mp4 = str(tmp_path / "mail_today.mp4")
+    queue = Mp4Queue(hass)
+    with patch(
+        "custom_components.mail_and_packages.transcode.asyncio.create_subprocess_exec",
+        side_effect=FileNotFoundError("ffmpeg"),
+    ):
+        await queue.async_submit(str(tmp_path / "mail_today.gif"), mp4)
+
+    assert queue.results[mp4].returncode is None
+    assert "Error generating mp4" in caplog.text
+
+
+async def test_transcode_supersede(hass, tmp_path):
+    """Test a newer job replaces the one still running."""
+    gif = str(tmp_path / "mail_today.gif")
+    mp4 = str(tmp_path / "mail_today.mp4")
+    queue = Mp4Queue(hass)
+    with _ffmpeg(STALL):
+        first = queue.async_submit(gif, mp4)
+        while not (tmp_path / "mail_today.mp4.part").exists():
+            await asyncio.sleep(0.01)
+    with _ffmpeg(WRITE):
+        second = queue.async_submit(gif, mp4)
+        await asyncio.wait_for(second, 10)
+
+    assert first.cancelled()
+    assert (tmp_path / "mail_today.mp4").read_bytes() == b"mp4"
+    assert queue.results[mp4].success
+
+
+async def test_transcode_same_key(hass, tmp_path):
+    """Test a running job is kept when the GIF has not changed."""
+    gif = str(tmp_path / "mail_today.gif")
+    mp4 = str(tmp_path / "mail_today.mp4")
+    queue = Mp4Queue(hass)
+    with _ffmpeg(STALL):
+        first = queue.async_submit(gif, mp4, key={"images": ["a"]})
+        while not (tmp_path / "mail_today.mp4.part").exists():
+            await asyncio.sleep(0.01)
+        assert queue.async_submit(gif, mp4, key={"images": ["a"]}) is first
+        assert not first.done()
+
+        second = queue.async_submit(gif, mp4, key={"images": ["b"]})
+        assert second is not first
+        await queue.async_cancel(mp4)
+        await asyncio.wait([first])
+
+    assert first.cancelled()
+    assert second.cancelled()
+
+
+async def test_transcode_cancel(hass, tmp_path):
+    """Test cancelling waits for the job to stop."""
+    mp4 = str(tmp_path / "mail_today.mp4")
+    queue = Mp4Queue(hass)
+    with _ffmpeg(STALL):
+        job = queue.async_submit(str(tmp_path / "mail_today.gif"), mp4)
+        while not (tmp_path / "mail_today.mp4.part").exists():
+            await asyncio.sleep(0.01)
+        await queue.async_cancel(mp4)
+
+    assert job.cancelled()
+    assert list(tmp_path.iterdir()) == []
+
+
+async def test_get_mp4_queue(hass):
+    """Test a single queue is shared."""
+    assert get_mp4_queue(hass) is get_mp4_queue(hass)